@@ -1,195 +1,53 @@
 import os
-import threading
-import tkinter.messagebox
-from tkinter import *
-from tkinter import ttk
-import numpy as np
-import pywt
-import matplotlib.pyplot as plt
-from scipy.signal import find_peaks, butter, lfilter, savgol_filter
-from collections import deque
-import serial
-import pygame
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 
 # Serial setup for real-time ECG data acquisition
-ser = serial.Serial('COM6', 115200, timeout=1)
-ser.flush()
-
-# Parameters for Butterworth filter
-def butter_lowpass(cutoff, fs, order=5):
-    nyquist = 0.5 * fs
-    normal_cutoff = cutoff / nyquist
-    b, a = butter(order, normal_cutoff, btype='low', analog=False)
-    return b, a
-
-def butter_lowpass_filter(data, cutoff, fs, order=5):
-    b, a = butter_lowpass(cutoff, fs, order)
-    return lfilter(b, a, data)
+# Set RHYTHMSYNC_PORT to use another port, e.g. the virtual device from `python -m rhythmsync.simulator`
+serial_port = os.environ.get('RHYTHMSYNC_PORT', 'COM6')
+serial_protocol = 'ascii'  # 'binary' when ECG_code.ino is built with BINARY_FRAMES
+requested_rate = 100  # Hz, one of rhythmsync.rates.SUPPORTED_RATES
 
 # Parameters for wavelet analysis
-sampling_rate = 100.0  # Hz
 cutoff_frequency = 20  # Hz
-ecg_buffer = deque(maxlen=1000)
-processed_signal_buffer = deque(maxlen=1000)
-
-# Music Player Initialization
-pygame.mixer.init()
+detector_engine = 'swt'  # 'swt' (SWT + find_peaks) or 'pan-tompkins' (streaming, O(1) per sample)
+swt_hop = 25  # SWT engine reruns every this many new samples, reusing the rest; 1 = whole window each update
+heart_rate_rules = 'rr'  # peaks above mean + 2 std, heart rate from the mean RR interval (rhythmsync.heart_rate)
+dsp_precision = 'float64'  # 'float32' halves the filter and SWT memory traffic, at ~1e-7 relative error
+
+# Full-session recording for later review: a directory such as 'sessions' (one subdirectory per run), or None
+record_directory = None
+# Heart-rate telemetry, sent in batches in the background: a bulk-update URL such as
+# rhythmsync.telemetry.THINGSPEAK_URL for your channel, or None. The key is read from the environment.
+telemetry_url = os.environ.get('RHYTHMSYNC_TELEMETRY_URL')
+telemetry_key = os.environ.get('RHYTHMSYNC_TELEMETRY_KEY')
+# Per-stage latency histograms, rewritten every 10 s to a file such as 'latency.json', or Prometheus text
+# for any other name (e.g. for node_exporter's textfile collector); None to keep them in memory only
+latency_export = os.environ.get('RHYTHMSYNC_LATENCY_EXPORT')
+latency_overlay = False  # show the stage latencies above the status bar
+
+# Music playlist, one song per heart-rate zone
 playlist = [
     {"path": r"low.mp3", "condition": "<60"},
     {"path": r"medium.mp3", "condition": "60-100"},
     {"path": r"high.mp3", "condition": ">100"}
 ]
-current_song_index = -1
-
-# Functions for heart rate and music selection
-def select_song_by_hr(hr):
-    if hr < 60:
-        return 0
-    elif 60 <= hr <= 100:
-        return 1
-    else:
-        return 2
-
-def play_song(index):
-    global current_song_index
-    try:
-        if index != current_song_index:
-            song_path = playlist[index]["path"]
-            pygame.mixer.music.load(song_path)
-            pygame.mixer.music.play()
-            current_song_index = index
-            statusbar['text'] = f"Playing: {os.path.basename(song_path)}"
-    except IndexError:
-        tkinter.messagebox.showerror("Error", "Invalid song index or playlist is empty.")
-
-def pause_song():
-    pygame.mixer.music.pause()
-    statusbar['text'] = "Music Paused"
-
-def resume_song():
-    pygame.mixer.music.unpause()
-    statusbar['text'] = "Music Resumed"
-
-def stop_song():
-    pygame.mixer.music.stop()
-    statusbar['text'] = "Music Stopped"
-
-def compute_heart_rate(ecg_signal, sampling_rate):
-    global heart_rate
-    coeffs = pywt.swt(ecg_signal, 'sym4', level=3)
-    coeffs_for_reconstruction = [
-    (np.zeros_like(a), d if i in [2, 3] else np.zeros_like(d))
-    for i, (a, d) in enumerate(coeffs)
-    ]
-    reconstructed_signal = pywt.iswt(coeffs_for_reconstruction, 'sym4')
-    y = np.abs(reconstructed_signal) ** 2
-    avg = np.mean(y)
-    std = np.std(y)
-
-    # Adjust the peak detection threshold R (custom to fit the signal)
-    threshold = avg + 2 * std
-    min_distance = int(sampling_rate * 0.4) # Minimum distance between peaks (depending on the signal) into heart rate)
-
-    # Find R peaks
-    Rpeaks, _ = find_peaks(y, height=threshold, distance=min_distance)
-
-    # Calculate heart rate from the time interval between R peaks
-    if len(Rpeaks) > 1:
-        rr_intervals = np.diff(Rpeaks) / sampling_rate # Calculate the time interval between R peaks (in seconds)
-        avg_rr_interval = np.mean(rr_intervals) # Average of the time interval
-        heart_rate = 60 / avg_rr_interval # Heart rate (bpm)
-    else:
-        heart_rate = 0 # Not enough R peaks to calculate heart rate
-
-    return heart_rate, y, Rpeaks
-
-# GUI setup
-root = Tk()
-root.geometry("900x700")
-root.title("Real-Time ECG and Music Player")
-
-statusbar = Label(root, text="Welcome to the ECG Music App", relief=SUNKEN, anchor=W, font='Times 10 italic')
-statusbar.pack(side=BOTTOM, fill=X)
-
-fig, ax = plt.subplots(2, 1, figsize=(8, 6))
-ax[0].set_ylim(0, 2000)
-ax[0].set_xlim(0, 1000)
-ecg_line, = ax[0].plot([], [], lw=0.5)
-ax[0].set_title("Real-Time ECG Signal")
-ax[0].set_xlabel("Time (samples)")
-ax[0].set_ylabel("Amplitude")
-ax[0].grid(True)
-
-ax[1].set_xlim(0, 1000)
-ax[1].set_ylim(0, 100)
-processed_line, = ax[1].plot([], [], lw=0.5)
-ax[1].set_title("Heart Rate Peaks")
-ax[1].set_xlabel("Time (samples)")
-ax[1].grid(True)
-
-canvas = FigureCanvasTkAgg(fig, master=root)
-canvas_widget = canvas.get_tk_widget()
-canvas_widget.pack(side=TOP, fill=BOTH, expand=True)
-
-def update_data():
-    global ecg_buffer, processed_signal_buffer
-    if ser.in_waiting > 0:
-        try:
-            data = ser.readline().decode('utf-8').strip()
-            raw_value = float(data)
-            ecg_buffer.append(raw_value)
-
-            if len(ecg_buffer) >= 1000:
-                filtered_signal = butter_lowpass_filter(list(ecg_buffer), cutoff_frequency, sampling_rate)
-                filtered_signal = savgol_filter(filtered_signal, window_length=15, polyorder=3)
-                heart_rate, processed_signal, Rpeaks = compute_heart_rate(filtered_signal, sampling_rate)
-                if processed_signal is not None:
-                    processed_signal_buffer.clear()
-                    processed_signal_buffer.extend(processed_signal)
-                    play_song(select_song_by_hr(heart_rate))
-                    processed_line.set_data(range(len(processed_signal_buffer)), processed_signal_buffer)
-                    ax[1].clear()
-                    ax[1].plot(range(len(processed_signal_buffer)), processed_signal_buffer, lw=0.5)
-                    for peak in Rpeaks:
-                        ax[1].plot(peak, processed_signal[peak], 'ro')
-                    statusbar['text'] = f"Heart Rate: {heart_rate:.2f} BPM"
-
-            ecg_line.set_data(range(len(ecg_buffer)), ecg_buffer)
-            ax[0].clear()
-            ax[0].plot(range(len(ecg_buffer)), ecg_buffer, lw=0.5)
-            ax[0].set_ylim(1250, 3000)
-            ax[0].set_xlim(0, 1000)
-
-            canvas.draw()
-        except ValueError:
-            pass
-
-    root.after(10, update_data)
-
-def start_measurement():
-    update_data()
-
-button_frame = Frame(root)
-button_frame.pack(pady=20)
-
-start_button = ttk.Button(button_frame, text="Start", command=start_measurement)
-start_button.grid(row=0, column=0, padx=10)
+# 'bank': decoded once at startup, crossfaded; 'stream': pygame.mixer.music, decoded on each change;
+# 'tempo': like 'bank', played at the tempo nearest the heart rate (renditions cached in $RHYTHMSYNC_CACHE)
+audio_engine = 'bank'
+crossfade_seconds = 2.0
+zone_hysteresis = 5.0  # BPM past a zone edge before the song changes
+stress_lf_hf = None  # e.g. 2.0: while the HRV LF/HF ratio is above it, play the calmer zone's song
 
-pause_button = ttk.Button(button_frame, text="Pause Music", command=pause_song)
-pause_button.grid(row=0, column=1, padx=10)
 
-resume_button = ttk.Button(button_frame, text="Resume Music", command=resume_song)
-resume_button.grid(row=0, column=2, padx=10)
+def main():
+    # The serial port, mixer and Tk window are only created here, so importing this file is cheap
+    from rhythmsync.tkapp import run
 
-stop_button = ttk.Button(button_frame, text="Stop Music", command=stop_song)
-stop_button.grid(row=0, column=3, padx=10)
+    run(serial_port, playlist, requested_rate, serial_protocol, audio_engine=audio_engine,
+        crossfade=crossfade_seconds, hysteresis=zone_hysteresis, stress_lf_hf=stress_lf_hf,
+        show_latency=latency_overlay, engine=detector_engine, swt_hop=swt_hop, rules=heart_rate_rules,
+        cutoff=cutoff_frequency, precision=dsp_precision, record=record_directory, telemetry=telemetry_url,
+        telemetry_key=telemetry_key, latency_export=latency_export)
 
-def on_closing():
-    if ser:
-        ser.close()
-    pygame.mixer.music.stop()
-    root.destroy()
 
-root.protocol("WM_DELETE_WINDOW", on_closing)
-root.mainloop()
\ No newline at end of file
+if __name__ == '__main__':
+    main()
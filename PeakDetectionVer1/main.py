@@ -1,3 +1,7 @@
+import json
+import queue
+import threading
+
 import numpy as np
 import scipy.io  # For loading MATLAB files
 import pywt  # For wavelet transforms
@@ -6,7 +10,6 @@ from scipy.signal import find_peaks
 
 from scipy.io import loadmat
 
-
 import thingspeak
 
 # Replace with your channel ID and read API key
@@ -14,18 +17,26 @@ channel_id = '----'
 read_key = '----'
 
 channel = thingspeak.Channel(id=channel_id, api_key=read_key)
-data1 = channel.get_field_last(field='1')  # Replace '1' with your field number
-data2 = channel.get_field_last(field='2')  # Replace '1' with your field number
-data3 = channel.get_field_last(field='3')  # Replace '1' with your field number
-data4 = channel.get_field_last(field='4')  # Replace '1' with your field number
-data5 = channel.get_field_last(field='5')  # Replace '1' with your field number
-data6 = channel.get_field_last(field='6')  # Replace '1' with your field number
-print("Temperature: %f \n" + data1)
-print("Humidity: %f \n" + data2)
-print("CO: %f \n" + data3)
-print("CO2: %f \n" + data4)
-print("UV: %f \n" + data5)
-print("Dust: %f \n" + data6)
+
+
+def read_environment():
+    # One request for the latest entry of all six fields, instead of one blocking request per field
+    feed = json.loads(channel.get({'results': 1}))
+    entry = feed['feeds'][-1] if feed.get('feeds') else {}
+    return [entry.get(f'field{i}') for i in range(1, 7)]
+
+
+def fetch_environment():
+    try:
+        environment.put(read_environment())
+    except Exception as e:
+        environment.put(e)
+
+
+# Runs while the ECG is loaded and analysed; the readings are printed after the heart rate.
+# A daemon thread, so a request that never returns cannot keep the script from exiting
+environment = queue.Queue(1)
+threading.Thread(target=fetch_environment, daemon=True).start()
 
 
 
@@ -66,6 +77,16 @@ nohb = len(Rpeaks)  # Number of beats
 timelimit = len(ecgsig) / Fs
 hbpermin = (nohb * 60) / timelimit  # Heart rate in BPM
 print(f"Heart Rate = {hbpermin:.2f}")
+try:
+    readings = environment.get(timeout=10)
+    if isinstance(readings, Exception):
+        raise readings
+    for label, value in zip(("Temperature", "Humidity", "CO", "CO2", "UV", "Dust"), readings):
+        print(f"{label}: {value}")
+except queue.Empty:
+    print("Environment readings unavailable: no answer within 10 s")
+except Exception as e:  # the channel is optional; a slow or failed read must not stop the plots
+    print(f"Environment readings unavailable: {e}")
 plt.figure(figsize=(10, 6))
 
 # Original ECG Signal
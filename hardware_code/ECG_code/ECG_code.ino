@@ -1,5 +1,382 @@
+#include "esp_arduino_version.h"
+
 // Define the pin where the AD8232 OUTPUT is connected
 #define AD8232_PIN 34  // Analog pin GPIO34 (change if using a different pin)
+// AD8232 lead-off outputs; pulled down so a board without them wired reads as attached
+#define LO_PLUS_PIN 32
+#define LO_MINUS_PIN 33
+
+// Set to 1 to stream over WiFi as UDP datagrams instead of the USB cable. Binary
+// frames (below) are batched FRAMES_PER_DATAGRAM at a time behind a short header,
+// decoded by rhythmsync/network.py (`python -m rhythmsync.network receive`):
+//   "RSYN" | version 1 (uint8) | sample rate (uint16) | id length (uint8) | device id | frames...
+// The device id is the WiFi MAC address. Serial still answers RATE/HELLO.
+#define UDP_STREAM 0
+#if UDP_STREAM
+#include <WiFi.h>
+#include <WiFiUdp.h>
+#define WIFI_SSID "your-network"
+#define WIFI_PASSWORD "your-password"
+#define UDP_HOST "192.168.1.10"  // machine running the receiver
+#define UDP_PORT 5005
+#define FRAMES_PER_DATAGRAM 5    // 10 datagrams/s at 100 Hz
+#endif
+
+// Set to 1 to send compact binary frames instead of one ASCII line per sample.
+// Frame layout (little-endian, decoded by rhythmsync/protocol.py):
+//   0xA5 0x5A | seq (uint16) | timer tick of first sample, in micros (uint32) | n (uint8)
+//   | n samples packed as 12 bits (two per three bytes) | CRC-16/CCITT-FALSE (uint16)
+// The CRC covers everything between the sync word and the CRC itself.
+#define BINARY_FRAMES 0
+#define SAMPLES_PER_FRAME 10  // 26 bytes per 10 samples vs ~60 bytes as text
+#if UDP_STREAM
+#undef BINARY_FRAMES
+#define BINARY_FRAMES 1  // UDP datagrams always carry binary frames
+#endif
+
+#if BINARY_FRAMES
+uint16_t frameSeq = 0;
+uint32_t frameStartMicros = 0;
+uint16_t frameSamples[SAMPLES_PER_FRAME];
+uint8_t frameCount = 0;
+uint8_t frameBuffer[2 + 7 + (SAMPLES_PER_FRAME * 3 + 1) / 2 + 2];
+
+uint16_t crc16Ccitt(const uint8_t *data, size_t length) {
+  uint16_t crc = 0xFFFF;
+  for (size_t i = 0; i < length; i++) {
+    crc ^= (uint16_t)data[i] << 8;
+    for (uint8_t bit = 0; bit < 8; bit++) {
+      crc = (crc & 0x8000) ? (crc << 1) ^ 0x1021 : crc << 1;
+    }
+  }
+  return crc;
+}
+
+#if UDP_STREAM
+extern uint16_t sampleRate;
+WiFiUDP udp;
+char deviceId[18];  // "AA:BB:CC:DD:EE:FF"
+uint8_t datagram[8 + sizeof(deviceId) + FRAMES_PER_DATAGRAM * sizeof(frameBuffer) + 12];
+size_t datagramLength = 0;
+uint8_t datagramFrames = 0;
+
+void startDatagram() {
+  size_t idLength = strlen(deviceId);
+  memcpy(datagram, "RSYN", 4);
+  datagram[4] = 1;
+  datagram[5] = sampleRate & 0xFF;
+  datagram[6] = sampleRate >> 8;
+  datagram[7] = idLength;
+  memcpy(datagram + 8, deviceId, idLength);
+  datagramLength = 8 + idLength;
+  datagramFrames = 0;
+}
+#endif
+
+// Frames go to the serial port, or into the next UDP datagram. A beat frame is
+// sent right away so beat-only streaming isn't held back.
+void emitFrame(const uint8_t *data, size_t length, bool sampleFrame) {
+#if UDP_STREAM
+  if (datagramLength == 0) {
+    startDatagram();
+  }
+  memcpy(datagram + datagramLength, data, length);
+  datagramLength += length;
+  if (!sampleFrame || ++datagramFrames >= FRAMES_PER_DATAGRAM) {
+    udp.beginPacket(UDP_HOST, UDP_PORT);
+    udp.write(datagram, datagramLength);
+    udp.endPacket();
+    datagramLength = 0;
+  }
+#else
+  Serial.write(data, length);
+#endif
+}
+
+void sendFrame() {
+  size_t pos = 0;
+  frameBuffer[pos++] = 0xA5;
+  frameBuffer[pos++] = 0x5A;
+  frameBuffer[pos++] = frameSeq & 0xFF;
+  frameBuffer[pos++] = frameSeq >> 8;
+  for (uint8_t i = 0; i < 4; i++) {
+    frameBuffer[pos++] = (frameStartMicros >> (8 * i)) & 0xFF;
+  }
+  frameBuffer[pos++] = frameCount;
+
+  // Pack two 12-bit samples into three bytes
+  for (uint8_t i = 0; i < frameCount; i += 2) {
+    uint16_t a = frameSamples[i] & 0x0FFF;
+    uint16_t b = (i + 1 < frameCount) ? frameSamples[i + 1] & 0x0FFF : 0;
+    frameBuffer[pos++] = a & 0xFF;
+    frameBuffer[pos++] = (a >> 8) | ((b & 0x0F) << 4);
+    if (i + 1 < frameCount) {
+      frameBuffer[pos++] = b >> 4;
+    }
+  }
+
+  uint16_t crc = crc16Ccitt(frameBuffer + 2, pos - 2);
+  frameBuffer[pos++] = crc & 0xFF;
+  frameBuffer[pos++] = crc >> 8;
+  emitFrame(frameBuffer, pos, true);
+
+  frameSeq++;
+  frameCount = 0;
+}
+#endif
+
+// What the sketch streams: raw samples (default), only beat events detected on the
+// device, or both. Beats are sent as "BEAT <micros> <amplitude>" lines, or with
+// BINARY_FRAMES as 0xA5 0x5B | beat seq (uint16) | micros (uint32) | amplitude (uint16) | CRC16.
+#define STREAM_RAW 0
+#define STREAM_BEATS 1
+#define STREAM_BOTH 2
+#define STREAM_MODE STREAM_RAW
+
+#if STREAM_MODE != STREAM_RAW
+// Lightweight Pan-Tompkins style detector: slope, squaring, ~80 ms moving-window
+// integration and an adaptive threshold between running signal and noise levels.
+#define MAX_INTEGRATION_WINDOW 80  // 80 ms at 1000 Hz
+#define LEARNING_SECONDS 2         // time spent estimating levels before detecting
+#define REFRACTORY_MICROS 200000   // no second beat within 200 ms
+#define MAX_QRS_MICROS 150000      // a QRS longer than this is treated as over
+
+bool detectorPrimed = false;
+int previousSamples[2] = {0, 0};
+uint32_t integrationBuffer[MAX_INTEGRATION_WINDOW];
+uint8_t integrationWindow = 8;
+uint8_t integrationIndex = 0;
+uint32_t integrationSum = 0;
+uint32_t learningSamples = 0;
+float signalLevel = 0;
+float noiseLevel = 0;
+bool inQrs = false;
+uint32_t qrsStartMicros = 0;
+uint32_t qrsPeakIntegrated = 0;
+int qrsPeakAmplitude = 0;
+uint32_t qrsPeakMicros = 0;
+uint32_t lastBeatMicros = 0;
+uint16_t beatSeq = 0;
+
+void resetBeatDetector(uint16_t rate) {
+  integrationWindow = constrain(rate * 8 / 100, 1, MAX_INTEGRATION_WINDOW);
+  memset(integrationBuffer, 0, sizeof(integrationBuffer));
+  integrationIndex = 0;
+  integrationSum = 0;
+  learningSamples = (uint32_t)rate * LEARNING_SECONDS;
+  signalLevel = 0;
+  noiseLevel = 0;
+  inQrs = false;
+  detectorPrimed = false;
+}
+
+void sendBeat(uint32_t timestamp, int amplitude) {
+#if BINARY_FRAMES
+  uint8_t beat[2 + 8 + 2];
+  beat[0] = 0xA5;
+  beat[1] = 0x5B;
+  beat[2] = beatSeq & 0xFF;
+  beat[3] = beatSeq >> 8;
+  for (uint8_t i = 0; i < 4; i++) {
+    beat[4 + i] = (timestamp >> (8 * i)) & 0xFF;
+  }
+  beat[8] = amplitude & 0xFF;
+  beat[9] = (amplitude >> 8) & 0xFF;
+  uint16_t crc = crc16Ccitt(beat + 2, 8);
+  beat[10] = crc & 0xFF;
+  beat[11] = crc >> 8;
+  emitFrame(beat, sizeof(beat), false);
+#else
+  Serial.print("BEAT ");
+  Serial.print(timestamp);
+  Serial.print(' ');
+  Serial.println(amplitude);
+#endif
+  beatSeq++;
+}
+
+void detectBeat(int ecgValue, uint32_t now) {
+  if (!detectorPrimed) {
+    // Start the slope from the first sample rather than from zero
+    previousSamples[0] = previousSamples[1] = ecgValue;
+    detectorPrimed = true;
+  }
+  int slope = ecgValue - previousSamples[1];  // x[n] - x[n-2]
+  previousSamples[1] = previousSamples[0];
+  previousSamples[0] = ecgValue;
+  uint32_t energy = (uint32_t)(slope * slope);
+  integrationSum += energy - integrationBuffer[integrationIndex];
+  integrationBuffer[integrationIndex] = energy;
+  integrationIndex = (integrationIndex + 1) % integrationWindow;
+  uint32_t integrated = integrationSum / integrationWindow;
+
+  if (learningSamples > 0) {
+    // Seed the levels: half the strongest response as signal, the average as noise
+    learningSamples--;
+    if (integrated * 0.5 > signalLevel) {
+      signalLevel = integrated * 0.5;
+    }
+    noiseLevel = 0.01 * integrated + 0.99 * noiseLevel;
+    return;
+  }
+
+  float threshold = noiseLevel + 0.25 * (signalLevel - noiseLevel);
+  bool aboveThreshold = integrated > threshold && now - lastBeatMicros > REFRACTORY_MICROS;
+  if (aboveThreshold && !(inQrs && now - qrsStartMicros > MAX_QRS_MICROS)) {
+    if (!inQrs) {
+      inQrs = true;
+      qrsStartMicros = now;
+      qrsPeakIntegrated = 0;
+      qrsPeakAmplitude = ecgValue;
+      qrsPeakMicros = now;
+    }
+    if (integrated > qrsPeakIntegrated) {
+      qrsPeakIntegrated = integrated;
+    }
+    if (ecgValue > qrsPeakAmplitude) {
+      qrsPeakAmplitude = ecgValue;
+      qrsPeakMicros = now;
+    }
+  } else if (inQrs) {
+    // End of the QRS complex: report the R peak and update the signal level
+    inQrs = false;
+    signalLevel = 0.125 * qrsPeakIntegrated + 0.875 * signalLevel;
+    lastBeatMicros = qrsPeakMicros;
+    sendBeat(qrsPeakMicros, qrsPeakAmplitude);
+  } else {
+    noiseLevel = 0.125 * integrated + 0.875 * noiseLevel;
+  }
+}
+#endif
+
+
+// Sampling is paced by a hardware timer instead of delay(10). The host picks the
+// rate at connect time by sending "RATE <hz>\n" (or "HELLO\n" to just ask) and the
+// sketch answers with "RHYTHMSYNC RATE=<hz> FORMAT=<ascii|binary>".
+const uint16_t SUPPORTED_RATES[] = {100, 250, 500, 1000};
+uint16_t sampleRate = 100;  // Hz, used until the host asks for something else
+hw_timer_t *sampleTimer = NULL;
+portMUX_TYPE timerMux = portMUX_INITIALIZER_UNLOCKED;
+volatile uint32_t pendingSamples = 0;
+// Samples are stamped with their timer tick, not with when loop() got to them
+uint32_t timerStartMicros = 0;
+uint32_t samplePeriodMicros = 10000;
+uint32_t sampleIndex = 0;
+char commandBuffer[32];
+uint8_t commandLength = 0;
+
+void IRAM_ATTR onSampleTimer() {
+  // analogRead is not ISR-safe, so only count ticks here and sample in loop()
+  portENTER_CRITICAL_ISR(&timerMux);
+  pendingSamples++;
+  portEXIT_CRITICAL_ISR(&timerMux);
+}
+
+void startSampleTimer(uint16_t rate) {
+  if (sampleTimer != NULL) {
+    timerEnd(sampleTimer);
+  }
+#if ESP_ARDUINO_VERSION_MAJOR >= 3
+  sampleTimer = timerBegin(1000000);  // 1 MHz tick
+  timerAttachInterrupt(sampleTimer, &onSampleTimer);
+  timerAlarm(sampleTimer, 1000000 / rate, true, 0);
+#else
+  sampleTimer = timerBegin(0, 80, true);  // 80 MHz APB clock / 80 = 1 MHz tick
+  timerAttachInterrupt(sampleTimer, &onSampleTimer, true);
+  timerAlarmWrite(sampleTimer, 1000000 / rate, true);
+  timerAlarmEnable(sampleTimer);
+#endif
+  portENTER_CRITICAL(&timerMux);
+  pendingSamples = 0;
+  timerStartMicros = micros();
+  portEXIT_CRITICAL(&timerMux);
+  samplePeriodMicros = 1000000 / rate;
+  sampleIndex = 0;
+  sampleRate = rate;
+#if BINARY_FRAMES
+  frameCount = 0;  // A partial frame would mix two rates
+#endif
+#if UDP_STREAM
+  datagramLength = 0;  // The datagram header carries the rate
+#endif
+#if STREAM_MODE != STREAM_RAW
+  resetBeatDetector(rate);
+#endif
+}
+
+// The lead-off state goes out when it changes and every second while leads are off, as
+// "LEADS OFF"/"LEADS ON" lines or with BINARY_FRAMES as 0xA5 0x5C | flags (uint8, bit 0:
+// leads off) | CRC16. The host skips its filters and detector while leads are off.
+#define LEAD_STATUS_INTERVAL_MICROS 1000000
+bool leadsOff = false;
+uint32_t lastLeadStatusMicros = 0;
+
+void sendLeadStatus(bool off) {
+#if BINARY_FRAMES
+  uint8_t status[2 + 1 + 2];
+  status[0] = 0xA5;
+  status[1] = 0x5C;
+  status[2] = off ? 0x01 : 0x00;
+  uint16_t crc = crc16Ccitt(status + 2, 1);
+  status[3] = crc & 0xFF;
+  status[4] = crc >> 8;
+  emitFrame(status, sizeof(status), false);
+#else
+  Serial.println(off ? "LEADS OFF" : "LEADS ON");
+#endif
+  lastLeadStatusMicros = micros();
+}
+
+// Returns whether the leads are off, reporting changes to the host
+bool checkLeads() {
+  bool off = digitalRead(LO_PLUS_PIN) == HIGH || digitalRead(LO_MINUS_PIN) == HIGH;
+  if (off != leadsOff || (off && micros() - lastLeadStatusMicros >= LEAD_STATUS_INTERVAL_MICROS)) {
+    sendLeadStatus(off);
+#if STREAM_MODE != STREAM_RAW
+    if (!off && leadsOff) {
+      resetBeatDetector(sampleRate);  // relearn the levels on the new signal
+    }
+#endif
+  }
+  leadsOff = off;
+  return off;
+}
+
+void sendHandshake() {
+  Serial.print("RHYTHMSYNC RATE=");
+  Serial.print(sampleRate);
+  Serial.print(BINARY_FRAMES ? " FORMAT=binary" : " FORMAT=ascii");
+  Serial.println(STREAM_MODE == STREAM_BEATS ? " MODE=beats" : STREAM_MODE == STREAM_BOTH ? " MODE=both" : " MODE=raw");
+}
+
+void handleCommand(const char *command) {
+  if (strncmp(command, "RATE ", 5) == 0) {
+    uint16_t rate = atoi(command + 5);
+    for (uint8_t i = 0; i < sizeof(SUPPORTED_RATES) / sizeof(SUPPORTED_RATES[0]); i++) {
+      if (SUPPORTED_RATES[i] == rate) {
+        startSampleTimer(rate);
+        break;
+      }
+    }
+  }
+  // Unsupported rates and "HELLO" just report the current configuration
+  sendHandshake();
+}
+
+void readHostCommands() {
+  while (Serial.available() > 0) {
+    char c = Serial.read();
+    if (c == '\n' || c == '\r') {
+      if (commandLength > 0) {
+        commandBuffer[commandLength] = '\0';
+        handleCommand(commandBuffer);
+        commandLength = 0;
+      }
+    } else if (commandLength < sizeof(commandBuffer) - 1) {
+      commandBuffer[commandLength++] = c;
+    }
+  }
+}
 
 
 // Setup function to initialize serial communication
@@ -10,22 +387,64 @@ void setup() {
 
   // Set the AD8232 pin as input
   pinMode(AD8232_PIN, INPUT);
+  pinMode(LO_PLUS_PIN, INPUT_PULLDOWN);
+  pinMode(LO_MINUS_PIN, INPUT_PULLDOWN);
   Serial.println("AD8232 ECG Sensor Test");
+#if UDP_STREAM
+  WiFi.mode(WIFI_STA);
+  WiFi.begin(WIFI_SSID, WIFI_PASSWORD);
+  while (WiFi.status() != WL_CONNECTED) {
+    delay(250);
+  }
+  WiFi.macAddress().toCharArray(deviceId, sizeof(deviceId));
+  Serial.print("Streaming to ");
+  Serial.print(UDP_HOST);
+  Serial.print(':');
+  Serial.println(UDP_PORT);
+#endif
+  startSampleTimer(sampleRate);
+  sendHandshake();
 }
 
 
 // Loop function to read data continuously
 void loop() {
+  readHostCommands();
+
+  // Take one sample per timer tick; ticks missed while busy are caught up here
+  if (pendingSamples == 0) {
+    return;
+  }
+  portENTER_CRITICAL(&timerMux);
+  pendingSamples--;
+  portEXIT_CRITICAL(&timerMux);
+
   // Read the analog value from the AD8232 output pin
   int ecgValue = analogRead(AD8232_PIN);
+  uint32_t sampleMicros = timerStartMicros + ++sampleIndex * samplePeriodMicros;  // wraps with micros()
+  bool off = checkLeads();
 
+#if STREAM_MODE != STREAM_RAW
+  if (!off) {
+    detectBeat(ecgValue, sampleMicros);
+  }
+#endif
 
+#if STREAM_MODE == STREAM_BEATS
+  // Only beat events leave the device in this mode
+#elif BINARY_FRAMES
+  // Buffer samples and send them as one frame; the host decoder counts lost/corrupt frames
+  if (frameCount == 0) {
+    frameStartMicros = sampleMicros;
+  }
+  frameSamples[frameCount++] = ecgValue;
+  if (frameCount == SAMPLES_PER_FRAME) {
+    sendFrame();
+  }
+#else
   // Print the ECG value to the serial monitor
   Serial.println(ecgValue);
-
-
-  // Small delay to control the data output rate
-  delay(10);  // Adjust this as necessary (10ms for ~100Hz sampling rate)
+#endif
 }
 
 // Define the pin where the AD8232 OUTPUT is connected
@@ -1,122 +1,48 @@
-import numpy as np
-import pywt
-import matplotlib.pyplot as plt
-from scipy.signal import find_peaks, butter, lfilter, savgol_filter
-from collections import deque
-import serial
-import matplotlib.animation as animation
+import os
+import sys
 
-# Serial setup for real-time ECG data acquisition
-ser = serial.Serial('COM14', 115200, timeout=1)
-ser.flush()
-
-# Parameters for Butterworth filter
-def butter_lowpass(cutoff, fs, order=5):
-    nyquist = 0.5 * fs
-    normal_cutoff = cutoff / nyquist
-    b, a = butter(order, normal_cutoff, btype='low', analog=False)
-    return b, a
+# Make the shared rhythmsync package importable when run as `python hardware_code/main.py`
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
 
-def butter_lowpass_filter(data, cutoff, fs, order=5):
-    b, a = butter_lowpass(cutoff, fs, order)
-    return lfilter(b, a, data)
+# Serial setup for real-time ECG data acquisition
+# Set RHYTHMSYNC_PORT to use another port, e.g. the virtual device from `python -m rhythmsync.simulator`
+serial_port = os.environ.get('RHYTHMSYNC_PORT', 'COM14')
+serial_protocol = 'ascii'  # 'binary' when ECG_code.ino is built with BINARY_FRAMES
+requested_rate = 100  # Hz, one of rhythmsync.rates.SUPPORTED_RATES
 
 # Parameters for wavelet analysis
-sampling_rate = 100.0  # Hz
 cutoff_frequency = 20  # Hz
-prev_signal = deque(maxlen=1000)
-
-# Visualization setup
-fig, ax = plt.subplots(2, 1, figsize=(10, 8))
-
-# Real-time ECG plot
-ax[0].set_ylim(0, 2000)
-ax[0].set_xlim(0, 1000)
-ecg_line, = ax[0].plot([], [], lw=0.5)
-ax[0].set_title("Real-Time ECG Signal")
-ax[0].set_xlabel("Time (samples)")
-ax[0].set_ylabel("Amplitude")
-ax[0].grid(True)
-
-# Processed heart rate plot
-ax[1].set_xlim(0, 1000)
-ax[1].set_ylim(0, 100)
-processed_line, = ax[1].plot([], [], lw=0.5)
-ax[1].set_title("Heart Rate Peaks")
-ax[1].set_xlabel("Time (samples)")
-ax[1].grid(True)
-
-# Signal buffers
-ecg_buffer = deque(maxlen=1000)
-processed_signal_buffer = deque(maxlen=1000)
-
-# Heart rate computation
-def compute_heart_rate(ecg_signal, fs):
-    # Perform a 4-level stationary wavelet decomposition using 'sym4'
-    # print("ahem0")
-    try:
-        coeffs = pywt.swt(ecg_signal, 'sym4', level=3)
-        # print("ahem1")
-    except Exception as e:
-        print(f"Error in pywt.swt: {e}")
-        return None, None, None
-    coeffs_for_reconstruction = []
-    for i, (a, d) in enumerate(coeffs):
-        # print("ahem2")
-        if i in [2, 3]:  # Keep d3 and d4 coefficients as is
-            coeffs_for_reconstruction.append((np.zeros_like(a), d))
-        else:
-            coeffs_for_reconstruction.append((np.zeros_like(a), np.zeros_like(d)))
-    # print("ahem3")
-    reconstructed_signal = pywt.iswt(coeffs_for_reconstruction, 'sym4')
-    y = np.abs(reconstructed_signal) ** 2  # Magnitude square
-    avg = np.mean(y)
-    Rpeaks, _ = find_peaks(y, height=8 * avg, distance=int(fs / 2))  # Adjust distance based on Fs
-    # print("ahem4")
-    heart_rate = (len(Rpeaks) * 60) / (len(ecg_signal) / fs)
-    return heart_rate, y, Rpeaks
-
-# Animation update function
-def update(frame):
-    if ser.in_waiting > 0:
-        try:
-            data = ser.readline().decode('utf-8').strip()
-            raw_value = float(data)
-            ecg_buffer.append(raw_value)
-            print(len(ecg_buffer))
+detector_engine = 'swt'  # 'swt' (SWT + find_peaks) or 'pan-tompkins' (streaming, O(1) per sample)
+swt_hop = 25  # SWT engine reruns every this many new samples, reusing the rest; 1 = whole window each update
+heart_rate_rules = 'count'  # peaks above 8x the mean, beats counted over the window (rhythmsync.heart_rate)
+dsp_precision = 'float64'  # 'float32' halves the filter and SWT memory traffic, at ~1e-7 relative error
 
-            # Process ECG data for heart rate
-            if len(ecg_buffer) >= 1000:  # Ensure buffer is full
-                # print("check1")
-                filtered_signal = butter_lowpass_filter(list(ecg_buffer), cutoff_frequency, sampling_rate)
-                # print("check3")
-                filtered_signal = savgol_filter(filtered_signal, window_length=15, polyorder=3)
-                # print("check4")
-                heart_rate, processed_signal, Rpeaks = compute_heart_rate(filtered_signal, sampling_rate)
-                # print("check5")
-                if processed_signal is not None:
-                    processed_signal_buffer.clear()
-                    processed_signal_buffer.extend(processed_signal)
+# Full-session recording for later review: a directory such as 'sessions' (one subdirectory per run), or None
+record_directory = None
+# Heart-rate telemetry, sent in batches in the background: a bulk-update URL such as
+# rhythmsync.telemetry.THINGSPEAK_URL for your channel, or None. The key is read from the environment.
+telemetry_url = os.environ.get('RHYTHMSYNC_TELEMETRY_URL')
+telemetry_key = os.environ.get('RHYTHMSYNC_TELEMETRY_KEY')
+# Per-stage latency histograms, rewritten every 10 s to a file such as 'latency.json', or Prometheus text
+# for any other name (e.g. for node_exporter's textfile collector); None to keep them in memory only
+latency_export = os.environ.get('RHYTHMSYNC_LATENCY_EXPORT')
 
-                    # Update processed signal plot
-                    processed_line.set_data(range(len(processed_signal_buffer)), processed_signal_buffer)
-                    for peak in Rpeaks:
-                        ax[1].plot(peak, processed_signal[peak], 'ro')
-                        # print("check2")
+# Long-session mode: a memory/artist-count readout checked once a minute, so an
+# overnight run can be verified to stay flat. tracemalloc slows allocation a little.
+long_session = True
 
-                    print(f"Heart Rate: {heart_rate:.2f} BPM")
 
-            # Update real-time ECG plot
-            ecg_line.set_data(range(len(ecg_buffer)), ecg_buffer)
+def main():
+    # The serial port and the figure are only created here, so importing this file is cheap
+    from rhythmsync.liveplot import run
 
-        except ValueError:
-            pass
+    run(serial_port, requested_rate, serial_protocol, long_session, engine=detector_engine, swt_hop=swt_hop,
+        rules=heart_rate_rules, cutoff=cutoff_frequency, precision=dsp_precision, record=record_directory,
+        telemetry=telemetry_url, telemetry_key=telemetry_key, latency_export=latency_export)
 
-    return ecg_line, processed_line
 
-ani = animation.FuncAnimation(fig, update, frames=None, blit=True, interval=10, repeat=False)
-plt.tight_layout()
-plt.show()
+if __name__ == '__main__':
+    main()
 
 
 ##########################################33
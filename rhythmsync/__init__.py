@@ -0,0 +1,77 @@
+"""Shared signal-processing, acquisition, audio and UI code for the RhythmSync apps.
+
+Importing the package does not touch hardware and only loads the standard
+library: submodules, and the heavy libraries they need (scipy, pywt,
+matplotlib, pygame, tkinter), are imported on first use. The names below can
+be taken straight from the package, e.g. ``rhythmsync.StreamingFilter``.
+Entry points build serial ports, audio and windows in their ``main()``.
+"""
+import importlib
+import threading
+
+_EXPORTS = {
+    'AcquisitionThread': 'rhythmsync.acquisition',
+    'SerialReader': 'rhythmsync.acquisition',
+    'negotiate_sampling_rate': 'rhythmsync.acquisition',
+    'AudioBank': 'rhythmsync.audio',
+    'MusicPlayer': 'rhythmsync.audio',
+    'ZoneSelector': 'rhythmsync.audio',
+    'select_song_by_hr': 'rhythmsync.audio',
+    'BeatAggregator': 'rhythmsync.beats',
+    'HopSwtDetector': 'rhythmsync.detectors',
+    'PanTompkinsDetector': 'rhythmsync.detectors',
+    'SwtDetector': 'rhythmsync.detectors',
+    'StreamingFilter': 'rhythmsync.filters',
+    'butter_lowpass': 'rhythmsync.filters',
+    'butter_lowpass_filter': 'rhythmsync.filters',
+    'compute_heart_rate': 'rhythmsync.heart_rate',
+    'RRStore': 'rhythmsync.hrv',
+    'LatencyMonitor': 'rhythmsync.latency',
+    'NetworkReader': 'rhythmsync.network',
+    'UdpReceiver': 'rhythmsync.network',
+    'FrameDecoder': 'rhythmsync.protocol',
+    'SignalQuality': 'rhythmsync.quality',
+    'RecordedSession': 'rhythmsync.recorder',
+    'SessionRecorder': 'rhythmsync.recorder',
+    'RingBuffer': 'rhythmsync.ringbuffer',
+    'EcgSession': 'rhythmsync.session',
+    'IngestService': 'rhythmsync.ingest',
+    'RenditionCache': 'rhythmsync.tempo',
+    'TempoEngine': 'rhythmsync.tempo',
+    'time_stretch': 'rhythmsync.tempo',
+    'TelemetryPublisher': 'rhythmsync.telemetry',
+    'SwtBandEnergy': 'rhythmsync.wavelets',
+    'swt_band_energy': 'rhythmsync.wavelets',
+}
+
+__all__ = sorted(_EXPORTS) + ['preload']
+
+
+def __getattr__(name):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module 'rhythmsync' has no attribute {name!r}")
+    value = getattr(importlib.import_module(module), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_EXPORTS))
+
+
+def preload(*modules):
+    """Import ``modules`` on a daemon thread, e.g. while the serial handshake blocks.
+
+    Modules that are not installed are skipped; the real import reports them.
+    """
+    def load():
+        for name in modules:
+            try:
+                importlib.import_module(name)
+            except ImportError:
+                pass
+
+    thread = threading.Thread(target=load, name='rhythmsync-preload', daemon=True)
+    thread.start()
+    return thread
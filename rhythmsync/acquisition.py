@@ -0,0 +1,216 @@
+import re
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from rhythmsync.latency import no_timing
+from rhythmsync.protocol import FrameDecoder
+from rhythmsync.rates import BASE_RATE, SUPPORTED_RATES
+
+HANDSHAKE = re.compile(rb'RHYTHMSYNC RATE=(\d+) FORMAT=(ascii|binary)(?: MODE=(raw|beats|both))?')
+
+
+def parse_beat_lines(lines):
+    # 'BEAT <micros> <amplitude>' lines from the sketch's on-device detector
+    events = []
+    for line in lines:
+        try:
+            _, timestamp, amplitude = line.split()
+            events.append((int(timestamp), int(amplitude)))
+        except ValueError:
+            pass
+    return events
+
+
+def parse_lines(lines):
+    # Convert a batch of ASCII sample lines in one pass; fall back per line only on garbage
+    if not lines:
+        return np.empty(0), 0
+    try:
+        return np.array(lines, dtype=np.bytes_).astype(np.float64), 0
+    except ValueError:
+        values = []
+        for line in lines:
+            try:
+                values.append(float(line))
+            except ValueError:
+                pass
+        return np.asarray(values, dtype=np.float64), len(lines) - len(values)
+
+
+def negotiate_sampling_rate(ser, requested=None, timeout=2.0, default=BASE_RATE):
+    """Ask ECG_code.ino for a sampling rate and return ``(rate, protocol, mode)``.
+
+    The sketch answers ``RATE <hz>`` (or ``HELLO``) with a
+    ``RHYTHMSYNC RATE=<hz> FORMAT=<ascii|binary> MODE=<raw|beats|both>`` line.
+    Firmware that predates the handshake never answers, in which case
+    ``(default, None, 'raw')`` is returned. If the sketch keeps reporting another
+    rate, the last handshake seen is returned after ``timeout``.
+    """
+    if requested is not None and int(requested) not in SUPPORTED_RATES:
+        raise ValueError(f"Unsupported sampling rate {requested}; choose one of {SUPPORTED_RATES}")
+    ser.reset_input_buffer()
+    ser.write(b'RATE %d\n' % int(requested) if requested is not None else b'HELLO\n')
+    deadline = time.monotonic() + timeout
+    answer = None
+    while time.monotonic() < deadline:
+        match = HANDSHAKE.search(ser.readline())
+        if match:
+            mode = match.group(3).decode('ascii') if match.group(3) else 'raw'
+            answer = float(match.group(1)), match.group(2).decode('ascii'), mode
+            # The boot-time handshake can arrive before the reply to our request
+            if requested is None or answer[0] == int(requested):
+                return answer
+    return answer or (float(default), None, 'raw')
+
+
+class SerialReader:
+    """Reads ECG samples from the sketch's serial stream.
+
+    ``protocol='ascii'`` expects one ``Serial.println`` value per line. With
+    ``drain=True`` every call empties ``in_waiting`` and returns all complete
+    lines as one array, keeping any partial line for the next call; with
+    ``drain=False`` it reads a single line per call like the original loop did.
+    ``protocol='binary'`` always drains and decodes the sketch's BINARY_FRAMES
+    output through a FrameDecoder (see ``rhythmsync.protocol``).
+    Beat events from the sketch's on-device detector are queued on ``beats`` as
+    ``(timestamp_us, amplitude)``; the consumer pops them from the other thread.
+    ``lead_off`` is the AD8232 lead-off state last reported by the sketch
+    (``LEADS OFF``/``LEADS ON`` lines or status frames), ``None`` until then.
+    Ingest and arrival rates (samples/sec) are refreshed about once a second.
+    ``last_arrival`` is the ``time.monotonic()`` at which the newest samples
+    were read; ``timer`` (e.g. ``LatencyMonitor.stage``) times the ``read``
+    stage, the decoding of each non-empty chunk, not the wait for it.
+    """
+
+    def __init__(self, ser, drain=True, protocol='ascii', rate_interval=1.0):
+        if protocol not in ('ascii', 'binary'):
+            raise ValueError(f"Unknown serial protocol: {protocol!r}")
+        self.ser = ser
+        self.drain = drain or protocol == 'binary'
+        self.protocol = protocol
+        self.decoder = FrameDecoder() if protocol == 'binary' else None
+        self.rate_interval = rate_interval
+        self._partial = b''
+        self.beats = deque(maxlen=1024)
+        self.lead_off = None
+        self.dropped = 0  # ASCII lines that could not be parsed
+        self.backlog = 0  # bytes still waiting after the last read
+        self.last_arrival = None
+        self.timer = no_timing
+        self.ingest_rate = 0.0
+        self.arrival_rate = 0.0
+        self._bytes_per_sample = 0.0
+        self._samples_total = 0
+        self._bytes_total = 0
+        self._window_start = time.monotonic()
+        self._window_samples = 0
+        self._window_arrived = 0
+
+    def read(self, block=False):
+        # With block=True an empty port waits up to the serial timeout for data
+        waiting = self.ser.in_waiting
+        if self.drain:
+            chunk = self.ser.read(max(waiting, 1)) if waiting > 0 or block else b''
+        else:
+            chunk = self.ser.readline() if waiting > 0 or block else b''
+        received = time.monotonic()
+        backlog = max(waiting - len(chunk), 0)
+        arrived = max(len(chunk) + backlog - self.backlog, 0)
+        self.backlog = backlog
+
+        with (self.timer if chunk else no_timing)('read'):
+            if self.decoder is not None:
+                samples = self.decoder.feed(chunk)
+                if self.decoder.beats:
+                    self.beats.extend(self.decoder.beats)
+                    self.decoder.beats.clear()
+                if self.decoder.lead_off is not None:
+                    self.lead_off = self.decoder.lead_off
+            else:
+                samples = self._parse_ascii(chunk)
+        if len(samples):
+            self.last_arrival = received
+        self._update_rates(len(samples), arrived, len(chunk))
+        return samples
+
+    def _parse_ascii(self, chunk):
+        if self.drain:
+            data = self._partial + chunk
+            lines = data.split(b'\n')
+            self._partial = lines.pop()
+        else:
+            data = chunk
+            lines = [chunk] if chunk else []
+        lines = [line for line in lines if line.strip()]
+        if b'BEAT' in data:
+            self.beats.extend(parse_beat_lines(line for line in lines if line.startswith(b'BEAT')))
+            lines = [line for line in lines if not line.startswith(b'BEAT')]
+        if b'LEADS' in data:
+            for line in lines:
+                if line.startswith(b'LEADS'):
+                    self.lead_off = line.split()[-1] == b'OFF'
+            lines = [line for line in lines if not line.startswith(b'LEADS')]
+        samples, dropped = parse_lines(lines)
+        self.dropped += dropped
+        return samples
+
+    def _update_rates(self, samples, arrived_bytes, read_bytes):
+        self._bytes_total += read_bytes
+        self._samples_total += samples
+        if self._samples_total:
+            self._bytes_per_sample = self._bytes_total / self._samples_total
+        self._window_samples += samples
+        self._window_arrived += arrived_bytes
+
+        now = time.monotonic()
+        elapsed = now - self._window_start
+        if elapsed >= self.rate_interval:
+            self.ingest_rate = self._window_samples / elapsed
+            if self._bytes_per_sample:
+                self.arrival_rate = self._window_arrived / self._bytes_per_sample / elapsed
+            self._window_start = now
+            self._window_samples = 0
+            self._window_arrived = 0
+
+    def rate_text(self):
+        text = f"{self.ingest_rate:.0f}/{self.arrival_rate:.0f} samples/s"
+        if self.decoder is not None:
+            text += f", {self.decoder.lost_frames} lost/{self.decoder.corrupt_frames} bad frames"
+        return text
+
+
+class AcquisitionThread(threading.Thread):
+    """Background producer that moves samples from a SerialReader into a RingBuffer.
+
+    The Tk thread is the single consumer and reads the ring with ``since``/``view``,
+    so a slow redraw no longer delays serial reads and vice versa. ``sink``, if
+    set, is also called with each batch of samples as it arrives.
+    """
+
+    def __init__(self, reader, ring, sink=None):
+        super().__init__(name='ecg-acquisition', daemon=True)
+        self.reader = reader
+        self.ring = ring
+        self.sink = sink
+        self.error = None
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                samples = self.reader.read(block=True)
+            except OSError as e:  # serial.SerialException is an OSError
+                self.error = e
+                break
+            if len(samples):
+                self.ring.extend(samples)
+                if self.sink is not None:
+                    self.sink(samples)
+
+    def stop(self, timeout=2.0):
+        self._stop_event.set()
+        if self.is_alive():
+            self.join(timeout)
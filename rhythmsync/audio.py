@@ -0,0 +1,192 @@
+import math
+import os
+import threading
+
+
+def select_song_by_hr(hr):
+    if hr < 60:
+        return 0
+    elif 60 <= hr <= 100:
+        return 1
+    else:
+        return 2
+
+
+class ZoneSelector:
+    """``select_song_by_hr`` with hysteresis against a heart rate hovering at 60 or 100 BPM.
+
+    The first heart rate picks its zone directly. After that the zone only
+    changes once the heart rate is more than ``hysteresis`` BPM outside the
+    current zone's range. With ``stress_lf_hf`` set, ``select`` also takes
+    the ``hrv`` metrics of ``rhythmsync.hrv.RRStore``: while their LF/HF ratio
+    is above it, the song of the zone below is chosen.
+    """
+
+    RANGES = ((-math.inf, 60.0), (60.0, 100.0), (100.0, math.inf))
+
+    def __init__(self, hysteresis=5.0, stress_lf_hf=None):
+        self.hysteresis = hysteresis
+        self.stress_lf_hf = stress_lf_hf
+        self.zone = None
+
+    def select(self, hr, hrv=None):
+        if self.zone is None or not self.hysteresis:
+            self.zone = select_song_by_hr(hr)
+        else:
+            low, high = self.RANGES[self.zone]
+            if hr < low - self.hysteresis or hr > high + self.hysteresis:
+                self.zone = select_song_by_hr(hr)
+        if self.stress_lf_hf and hrv and hrv.get('lf_hf') is not None and hrv['lf_hf'] > self.stress_lf_hf:
+            return max(self.zone - 1, 0)
+        return self.zone
+
+
+class MusicPlayer:
+    """pygame.mixer.music playback of a playlist entry per heart-rate zone.
+
+    ``playlist`` holds ``{"path": ..., "condition": ...}`` entries for the
+    <60, 60-100 and >100 BPM zones. ``on_status`` receives the same messages
+    the apps show in their status bar. pygame is imported and the mixer
+    initialised on construction. Each zone change loads and decodes the song
+    on the calling thread; ``AudioBank`` avoids that.
+    """
+
+    def __init__(self, playlist, on_status=None, hysteresis=5.0):
+        import pygame
+
+        pygame.mixer.init()
+        self.music = pygame.mixer.music
+        self.playlist = playlist
+        self.zones = ZoneSelector(hysteresis)
+        self.current_song_index = -1
+        self.on_status = on_status or (lambda text: None)
+
+    def play(self, index):
+        # Raises IndexError for an index outside the playlist
+        if index != self.current_song_index:
+            song_path = self.playlist[index]["path"]
+            self.music.load(song_path)
+            self.music.play()
+            self.current_song_index = index
+            self.on_status(f"Playing: {os.path.basename(song_path)}")
+
+    def play_for_heart_rate(self, hr, hrv=None):
+        self.play(self.zones.select(hr, hrv))
+
+    def update(self):
+        # Called on every tick of the app's loop; nothing to hand over here
+        pass
+
+    def pause(self):
+        self.music.pause()
+        self.on_status("Music Paused")
+
+    def resume(self):
+        self.music.unpause()
+        self.on_status("Music Resumed")
+
+    def stop(self):
+        self.music.stop()
+        self.on_status("Music Stopped")
+
+
+class AudioBank:
+    """Playlist decoded once into ``pygame.mixer.Sound`` buffers, crossfaded on zone changes.
+
+    Decoding runs on a background thread at construction, so nothing is
+    decoded when the zone changes. Songs loop on two reserved mixer channels.
+    A zone change fades the old channel out and the new one in over
+    ``crossfade`` seconds. A zone whose song is still decoding starts on the
+    first ``play`` after it is ready. A file that cannot be decoded is reported
+    once through ``on_status``, and the current song keeps playing. Decoded
+    PCM stays in memory, about 10 MB per minute of 44.1 kHz stereo audio.
+    Same interface as ``MusicPlayer``, whose ``update`` the apps call on
+    every tick of their loop.
+    """
+
+    def __init__(self, playlist, on_status=None, hysteresis=5.0, crossfade=2.0):
+        import pygame
+
+        pygame.mixer.init()
+        pygame.mixer.set_reserved(2)
+        self.mixer = pygame.mixer
+        self.channels = [pygame.mixer.Channel(0), pygame.mixer.Channel(1)]
+        self.playlist = playlist
+        self.zones = ZoneSelector(hysteresis)
+        self.crossfade = crossfade
+        self.on_status = on_status or (lambda text: None)
+        self.sounds = [None] * len(playlist)
+        self.errors = {}  # playlist index -> decode error
+        self.current_song_index = -1
+        self._active = 0
+        self._reported = set()
+        self.loaded = threading.Event()
+        self._loader = threading.Thread(target=self._decode_all, name='audio-bank', daemon=True)
+        self._loader.start()
+
+    def _decode_all(self):
+        for index, entry in enumerate(self.playlist):
+            try:
+                self.sounds[index] = self.mixer.Sound(entry["path"])
+            except Exception as e:  # pygame.error for undecodable files, OSError/FileNotFoundError
+                self.errors[index] = e
+        self.loaded.set()
+
+    def play(self, index):
+        # Raises IndexError for an index outside the playlist
+        song_path = self.playlist[index]["path"]
+        if index == self.current_song_index:
+            return
+        sound = self.sounds[index]
+        if sound is None:
+            if index in self.errors and index not in self._reported:
+                self._reported.add(index)
+                self.on_status(f"Cannot play {os.path.basename(song_path)}: {self.errors[index]}")
+            return  # still decoding, or unplayable; the next call retries
+        fade_ms = int(self.crossfade * 1000)
+        old = self.channels[self._active]
+        self._active ^= 1
+        if fade_ms:
+            old.fadeout(fade_ms)
+        else:
+            old.stop()
+        self.channels[self._active].play(sound, loops=-1, fade_ms=fade_ms)
+        self.current_song_index = index
+        self.on_status(f"Playing: {os.path.basename(song_path)}")
+
+    def play_for_heart_rate(self, hr, hrv=None):
+        self.play(self.zones.select(hr, hrv))
+
+    def update(self):
+        # Called on every tick of the app's loop; TempoEngine starts prepared renditions here
+        pass
+
+    def pause(self):
+        self.mixer.pause()
+        self.on_status("Music Paused")
+
+    def resume(self):
+        self.mixer.unpause()
+        self.on_status("Music Resumed")
+
+    def stop(self):
+        for channel in self.channels:
+            channel.stop()
+        self.on_status("Music Stopped")
+
+
+def make_player(playlist, engine='bank', on_status=None, hysteresis=5.0, crossfade=2.0, stress_lf_hf=None):
+    # 'bank' pre-decodes and crossfades (AudioBank); 'stream' decodes on each change (MusicPlayer);
+    # 'tempo' also follows the heart rate with cached time-stretched renditions (rhythmsync.tempo)
+    if engine == 'tempo':
+        from rhythmsync.tempo import TempoEngine
+
+        player = TempoEngine(playlist, on_status, hysteresis, crossfade)
+    elif engine == 'stream':
+        player = MusicPlayer(playlist, on_status, hysteresis)
+    elif engine == 'bank':
+        player = AudioBank(playlist, on_status, hysteresis, crossfade)
+    else:
+        raise ValueError(f"Unknown audio engine: {engine!r}")
+    player.zones.stress_lf_hf = stress_lf_hf
+    return player
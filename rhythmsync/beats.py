@@ -0,0 +1,60 @@
+from collections import deque
+
+import numpy as np
+
+
+class BeatAggregator:
+    """Verifies beat events detected on the ESP32 and turns them into a heart rate.
+
+    Events arrive as ``(timestamp_us, amplitude)`` with the sketch's 32-bit
+    ``micros()`` clock. Beats closer than ``min_rr`` seconds to the previous one
+    are rejected (keeping the larger of the two), and beats whose amplitude is
+    far below the recent median are treated as noise. A gap longer than
+    ``max_rr`` (e.g. lost events) restarts the RR history instead of producing
+    one huge interval.
+    """
+
+    def __init__(self, min_rr=0.3, max_rr=2.0, history=8, min_amplitude_ratio=0.4):
+        self.min_rr = min_rr
+        self.max_rr = max_rr
+        self.min_amplitude_ratio = min_amplitude_ratio
+        self.rr_intervals = deque(maxlen=history)
+        self._amplitudes = deque(maxlen=history)
+        self._last_timestamp = None
+        self._last_amplitude = 0
+        self.accepted = 0
+        self.rejected = 0
+
+    def add(self, timestamp_us, amplitude):
+        if self._amplitudes and amplitude < self.min_amplitude_ratio * np.median(self._amplitudes):
+            self.rejected += 1
+            return False
+        if self._last_timestamp is not None:
+            rr = ((timestamp_us - self._last_timestamp) & 0xFFFFFFFF) / 1e6
+            if rr < self.min_rr:
+                # Two detections inside one refractory period: keep the stronger one
+                self.rejected += 1
+                if amplitude > self._last_amplitude:
+                    self._last_timestamp = timestamp_us
+                    self._last_amplitude = amplitude
+                return False
+            if rr > self.max_rr:
+                self.rr_intervals.clear()
+            else:
+                self.rr_intervals.append(rr)
+        self._last_timestamp = timestamp_us
+        self._last_amplitude = amplitude
+        self._amplitudes.append(amplitude)
+        self.accepted += 1
+        return True
+
+    def extend(self, events):
+        for timestamp_us, amplitude in events:
+            self.add(timestamp_us, amplitude)
+
+    @property
+    def heart_rate(self):
+        # Median RR is robust to a single missed or extra beat
+        if not self.rr_intervals:
+            return 0
+        return 60.0 / float(np.median(self.rr_intervals))
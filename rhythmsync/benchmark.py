@@ -0,0 +1,393 @@
+"""Benchmarks for the DSP and UI hot paths, fed from the recorded ``ECG Data`` records.
+
+Needs no serial port and no display: the records are replayed as ASCII serial
+traffic through ``RecordedSerial`` and the plots render to an off-screen Agg
+canvas. Each stage reports throughput, per-call latency percentiles and the
+peak traced allocation, and the run is saved as JSON for comparison across
+commits. ``--allocations`` adds a per-stage allocation report of the live
+pipeline (read, quality gate, filter, SWT, peak search) in both precisions:
+
+    python -m rhythmsync.benchmark -o bench.json --baseline previous.json --allocations
+"""
+import argparse
+import functools
+import glob
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+from scipy.io import loadmat
+from scipy.signal import savgol_filter
+
+from rhythmsync.filters import StreamingFilter, butter_lowpass_filter
+from rhythmsync.heart_rate import compute_heart_rate
+from rhythmsync.memory import StageAllocations
+from rhythmsync.rates import savgol_window, window_size
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_RECORDS = os.path.join(ROOT, 'ECG Data', '*.mat')
+APP_RULES = {'app': 'count', 'DAFRR': 'rr'}  # compute_heart_rate rule set of each app
+
+
+class RecordedSerial:
+    """Stands in for a ``serial.Serial`` port, replaying samples as ``println`` lines.
+
+    Every time the input buffer runs dry the next ``samples_per_read`` samples
+    become available, so each ``SerialReader.read`` sees one tick's worth.
+    """
+
+    def __init__(self, samples, samples_per_read=1):
+        self.samples = np.asarray(samples)
+        self.samples_per_read = samples_per_read
+        self.position = 0
+        self.timeout = 0
+        self._buffer = b''
+
+    @property
+    def exhausted(self):
+        return self.position >= len(self.samples) and not self._buffer
+
+    @property
+    def in_waiting(self):
+        if not self._buffer and self.position < len(self.samples):
+            chunk = self.samples[self.position:self.position + self.samples_per_read]
+            self.position += len(chunk)
+            self._buffer = b''.join(b'%d\n' % int(v) for v in chunk)
+        return len(self._buffer)
+
+    def read(self, size=1):
+        self.in_waiting
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def readline(self):
+        self.in_waiting
+        line, sep, self._buffer = self._buffer.partition(b'\n')
+        return line + sep
+
+    def write(self, data):
+        return len(data)
+
+    def reset_input_buffer(self):
+        self._buffer = b''
+
+    def close(self):
+        pass
+
+
+def load_records(patterns):
+    records = {}
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern)) or [pattern]:
+            records[os.path.basename(path)] = loadmat(path)['val'].astype(np.float64).ravel()
+    return records
+
+
+def windows(records, window, hop):
+    for signal in records.values():
+        for start in range(0, len(signal) - window + 1, hop):
+            yield signal[start:start + window]
+
+
+def measure(stage, calls, samples_per_call, memory_calls=20):
+    """Time ``stage(*args)`` for every args tuple in ``calls``, then trace a few for peak memory."""
+    calls = list(calls)
+    durations = np.empty(len(calls))
+    total_samples = 0
+    for i, args in enumerate(calls):
+        start = time.perf_counter()
+        stage(*args)
+        durations[i] = time.perf_counter() - start
+        total_samples += samples_per_call(args)
+
+    tracemalloc.start()
+    for args in calls[:memory_calls]:
+        stage(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    elapsed = float(durations.sum())
+    return {
+        'calls': len(calls),
+        'samples': total_samples,
+        'samples_per_sec': total_samples / elapsed if elapsed else 0.0,
+        'mean_us': float(durations.mean() * 1e6) if len(calls) else 0.0,
+        'p50_us': float(np.percentile(durations, 50) * 1e6) if len(calls) else 0.0,
+        'p99_us': float(np.percentile(durations, 99) * 1e6) if len(calls) else 0.0,
+        'peak_memory_bytes': peak,
+    }
+
+
+def make_update_loop(engine, fs, samples_per_tick, precision='float64'):
+    """Build a headless copy of the apps' ``update_data`` for one record.
+
+    Returns a ``tick()`` callable doing one ``update_data`` pass (acquisition
+    read, ring handoff, detector, plot update and throttled blit) without the
+    song or statusbar calls, plus the fake port it reads from.
+    """
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    from rhythmsync.plotting import LivePlotRenderer
+    from rhythmsync.session import EcgSession
+
+    port = RecordedSerial([], samples_per_tick)
+    # 'swt' reruns the whole window every update, 'hop' is the overlap-reusing SWT engine
+    # The records are in their own units rather than ADC counts, which the quality gate would reject
+    session = EcgSession(port, fs, engine='pan-tompkins' if engine == 'pan-tompkins' else 'swt',
+                         swt_hop=25 if engine == 'hop' else 1, gate=False, precision=precision)
+    window = session.window
+
+    fig = Figure(figsize=(8, 6))
+    ax = fig.subplots(2, 1)
+    ax[0].set_ylim(1250, 3000)
+    ax[0].set_xlim(0, window)
+    ecg_line, = ax[0].plot([], [], lw=0.5)
+    ax[1].set_xlim(0, window)
+    ax[1].set_ylim(0, 100)
+    processed_line, = ax[1].plot([], [], lw=0.5)
+    # Frames are throttled on the replayed signal's clock, so a faster-than-real-time
+    # replay still draws 30 frames per second of ECG
+    renderer = LivePlotRenderer(FigureCanvasAgg(fig), ax[0], ecg_line, ax[1], processed_line, window,
+                                clock=lambda: session.cursor / fs)
+
+    def tick():
+        # The acquisition thread's read happens inline so every sample is accounted for
+        session.pump()
+        new, ecg_window, result = session.poll()
+        if len(new):
+            if result is not None:
+                heart_rate, processed_signal, Rpeaks = result
+                if processed_signal is not None:
+                    renderer.set_processed(processed_signal, Rpeaks)
+            renderer.set_ecg(ecg_window)
+        renderer.draw()
+        return len(new)
+
+    return tick, port, renderer
+
+
+def bench_update_loop(records, engine, fs, samples_per_tick, seconds=None, memory_ticks=200, precision='float64'):
+    durations = []
+    total_samples = 0
+    frames = 0
+    rescales = 0
+    peak = 0
+    for signal in records.values():
+        tick, port, renderer = make_update_loop(engine, fs, samples_per_tick, precision)
+        port.samples = signal[:int(seconds * fs)] if seconds else signal
+        while not port.exhausted:
+            start = time.perf_counter()
+            total_samples += tick()
+            durations.append(time.perf_counter() - start)
+        frames += renderer.frames
+        rescales += renderer.rescales
+
+        # Memory is traced on a fresh loop so the timed ticks run untraced
+        tick, port, _ = make_update_loop(engine, fs, samples_per_tick, precision)
+        port.samples = signal[:memory_ticks * samples_per_tick + window_size(fs)]
+        tracemalloc.start()
+        while not port.exhausted:
+            tick()
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    durations = np.asarray(durations)
+    elapsed = float(durations.sum())
+    return {
+        'calls': len(durations),
+        'samples': total_samples,
+        'samples_per_sec': total_samples / elapsed if elapsed else 0.0,
+        'mean_us': float(durations.mean() * 1e6),
+        'p50_us': float(np.percentile(durations, 50) * 1e6),
+        'p99_us': float(np.percentile(durations, 99) * 1e6),
+        'peak_memory_bytes': peak,
+        'frames': frames,
+        'rescales': rescales,  # full redraws besides the first frame
+    }
+
+
+def bench_allocations(records, engine, fs, samples_per_tick, precision, seconds=20.0):
+    """Per-stage ``StageAllocations`` report of a session polling the records, after a warm-up window.
+
+    ``seconds`` of each record are traced after the warm-up (0 = the rest of
+    the record); a record no longer than the warm-up raises ``ValueError``.
+    """
+    from rhythmsync.session import EcgSession
+
+    tracker = StageAllocations()
+    for name, signal in records.items():
+        port = RecordedSerial(signal, samples_per_tick)
+        session = EcgSession(port, fs, engine='pan-tompkins' if engine == 'pan-tompkins' else 'swt',
+                             swt_hop=25 if engine == 'hop' else 1, gate=False, precision=precision)
+        detector = session.detector
+        session.reader.read = tracker.wrap('read', session.reader.read)
+        session.quality.update = tracker.wrap('quality', session.quality.update)
+        if engine == 'hop':
+            detector.filter.push = tracker.wrap('filter', detector.filter.push)
+            detector.band_energy = tracker.wrap('swt', detector.band_energy)
+            detector._detect = tracker.wrap('peaks', detector._detect)
+        elif engine == 'swt':
+            detector.filter.push = tracker.wrap('filter', detector.filter.push)
+            compute = detector.compute_heart_rate
+            band_energy = tracker.wrap('swt', compute.keywords['band_energy'])
+            detector.compute_heart_rate = tracker.wrap('heart_rate', functools.partial(
+                compute.func, **dict(compute.keywords, band_energy=band_energy)))
+        detector.push = tracker.wrap('detector', detector.push)
+        poll = tracker.wrap('poll', session.poll)
+        # The first window builds the rings and SWT buffers; only the steady state is traced
+        warmup = session.window + session.quality.size
+        if len(signal) <= warmup:
+            raise ValueError(f"{name}: {len(signal)} samples leave nothing to trace after the "
+                             f"{warmup}-sample warm-up")
+        if seconds:
+            port.samples = port.samples[:warmup + int(seconds * fs)]
+        while not port.exhausted and session.ring.count < warmup:
+            session.pump()
+            session.poll()
+        tracker.start()
+        while not port.exhausted:
+            session.pump()
+            poll()
+        tracker.stop()
+    return tracker.report()
+
+
+def run(record_patterns, fs=100.0, hop=100, samples_per_tick=1, engines=('swt', 'hop', 'pan-tompkins'),
+        stages=None, seconds=20.0, precision='float64', allocations=False):
+    records = load_records(record_patterns)
+    window = window_size(fs)
+    raw_windows = [(w,) for w in windows(records, window, hop)]
+    filtered_windows = [(butter_lowpass_filter(w, 20, fs),) for (w,) in raw_windows]
+    per_window = lambda args: len(args[0])
+    wl = savgol_window(fs)
+
+    benches = {
+        'butter_lowpass_filter': lambda: measure(lambda w: butter_lowpass_filter(w, 20, fs), raw_windows, per_window),
+        'savgol_filter': lambda: measure(lambda w: savgol_filter(w, wl, 3), filtered_windows, per_window),
+        'streaming_filter.push': lambda: measure(
+            StreamingFilter(20, fs, window_length=wl, polyorder=3, size=window, dtype=precision).push,
+            [(signal[i:i + samples_per_tick],) for signal in records.values()
+             for i in range(0, len(signal), samples_per_tick)], per_window),
+    }
+    for name, rules in APP_RULES.items():
+        benches[f'compute_heart_rate[{name}]'] = (
+            lambda rules=rules: measure(lambda w: compute_heart_rate(w, fs, rules), filtered_windows, per_window))
+    for engine in engines:
+        benches[f'update_data[{engine}]'] = (
+            lambda engine=engine: bench_update_loop(records, engine, fs, samples_per_tick, seconds,
+                                                    precision=precision))
+
+    results = {}
+    for name, bench in benches.items():
+        if stages and not any(stage in name for stage in stages):
+            continue
+        results[name] = bench()
+    report = {'meta': run_metadata(records, fs, window, hop, samples_per_tick, seconds, precision),
+              'stages': results}
+    if allocations:
+        report['allocations'] = {f'{engine}/{dtype}': bench_allocations(records, engine, fs, samples_per_tick,
+                                                                        dtype, seconds)
+                                 for engine in engines for dtype in ('float64', 'float32')}
+    return report
+
+
+def run_metadata(records, fs, window, hop, samples_per_tick, seconds, precision='float64'):
+    import pywt
+    import scipy
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                                text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        'commit': commit,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'numpy': np.__version__,
+        'scipy': scipy.__version__,
+        'pywt': pywt.__version__,
+        'records': sorted(records),
+        'fs': fs,
+        'window': window,
+        'hop': hop,
+        'samples_per_tick': samples_per_tick,
+        'update_seconds': seconds,
+        'precision': precision,
+    }
+
+
+def format_report(report, baseline=None):
+    lines = [f"{'stage':32} {'samples/s':>12} {'p50 us':>10} {'p99 us':>10} {'peak KiB':>9}"]
+    previous = (baseline or {}).get('stages', {})
+    for name, stage in report['stages'].items():
+        line = (f"{name:32} {stage['samples_per_sec']:12.0f} {stage['p50_us']:10.1f} "
+                f"{stage['p99_us']:10.1f} {stage['peak_memory_bytes'] / 1024:9.1f}")
+        if name in previous and previous[name]['samples_per_sec']:
+            change = stage['samples_per_sec'] / previous[name]['samples_per_sec'] - 1
+            line += f"  {change:+.1%} vs {baseline['meta'].get('commit') or 'baseline'}"
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+def format_allocations(report, baseline=None):
+    # Steady-state bytes per call of each pipeline stage, per engine and precision
+    lines = [f"{'engine/precision':20} {'stage':12} {'calls':>7} {'mean KiB':>9} {'max KiB':>9} {'held B':>7}"]
+    previous = (baseline or {}).get('allocations', {})
+    for pipeline, stages in report.get('allocations', {}).items():
+        for name, stage in stages.items():
+            line = (f"{pipeline:20} {name:12} {stage['calls']:7} {stage['mean_peak_bytes'] / 1024:9.2f} "
+                    f"{stage['max_peak_bytes'] / 1024:9.2f} {stage['mean_retained_bytes']:7.0f}")
+            before = previous.get(pipeline, {}).get(name)
+            if before and before['mean_peak_bytes']:
+                line += f"  {stage['mean_peak_bytes'] / before['mean_peak_bytes'] - 1:+.1%}"
+            lines.append(line)
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m rhythmsync.benchmark',
+                                     description="Benchmark the RhythmSync DSP and UI hot paths headlessly.")
+    parser.add_argument('records', nargs='*', default=[DEFAULT_RECORDS], help="record files or glob patterns")
+    parser.add_argument('--fs', type=float, default=100.0, help="sampling rate the records are replayed at")
+    parser.add_argument('--hop', type=int, default=100, help="samples between windows for the per-window stages")
+    parser.add_argument('--samples-per-tick', type=int, default=1,
+                        help="samples arriving per update_data call (1 = 10 ms ticks at 100 Hz)")
+    parser.add_argument('--engine', action='append', choices=('swt', 'hop', 'pan-tompkins'),
+                        help="detector engines for the update_data loop (default: all)")
+    parser.add_argument('--seconds', type=float, default=20.0,
+                        help="seconds of each record replayed through update_data, and traced after the "
+                             "warm-up with --allocations (0 = all)")
+    parser.add_argument('--stage', action='append', help="only run stages whose name contains this")
+    parser.add_argument('--precision', choices=('float64', 'float32'), default='float64',
+                        help="dtype of the filter and detector in the timed stages")
+    parser.add_argument('--allocations', action='store_true',
+                        help="also report bytes allocated per call of each pipeline stage")
+    parser.add_argument('-o', '--output', help="write the results as JSON")
+    parser.add_argument('--baseline', help="JSON from an earlier run to compare throughput against")
+    args = parser.parse_args(argv)
+
+    report = run(args.records, args.fs, args.hop, args.samples_per_tick,
+                 tuple(args.engine or ('swt', 'hop', 'pan-tompkins')), args.stage, args.seconds, args.precision,
+                 args.allocations)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print(format_report(report, baseline))
+    if args.allocations:
+        print(format_allocations(report, baseline))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
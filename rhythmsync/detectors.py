@@ -0,0 +1,271 @@
+from collections import deque
+
+import numpy as np
+from scipy.signal import butter, find_peaks, lfilter, sosfilt, sosfilt_zi
+
+from rhythmsync.latency import no_timing
+from rhythmsync.rates import swt_level
+from rhythmsync.ringbuffer import RingBuffer
+from rhythmsync.wavelets import SwtBandEnergy, boundary_margin
+
+
+class SwtDetector:
+    """Window-based engine: the streaming low-pass, then an app's ``compute_heart_rate``.
+
+    ``push`` returns ``None`` until a full window is available, then
+    ``compute_heart_rate(window, fs)`` -> ``(heart_rate, y, Rpeaks)`` on every call.
+    ``timer(stage)`` (e.g. ``rhythmsync.latency.LatencyMonitor.stage``) times the
+    ``filter`` stage; ``compute_heart_rate`` takes its own for ``swt``/``peaks``.
+    """
+
+    def __init__(self, compute_heart_rate, ecg_filter, fs, window, timer=no_timing):
+        self.compute_heart_rate = compute_heart_rate
+        self.filter = ecg_filter
+        self.fs = fs
+        self.window = window
+        self.timer = timer
+
+    def push(self, samples):
+        with self.timer('filter'):
+            self.filter.push(samples)
+        if len(self.filter) < self.window:
+            return None
+        return self.compute_heart_rate(self.filter.window(), self.fs)
+
+
+class HopSwtDetector:
+    """SWT engine that reruns only every ``hop`` new samples and reuses the overlap.
+
+    The band energy of the previous hop is kept in a ring. On each hop only the
+    newest samples plus ``boundary_margin`` samples on either side are
+    re-transformed; away from segment edges the SWT of a segment equals the SWT
+    of the whole window. The last margin of the previous result, distorted by the
+    periodic extension at the segment end, is recomputed as well.
+
+    The whole-window SWT's own periodic extension joins the window's two ends,
+    so its first and last margins depend only on the samples near them. Those
+    are transformed as one short wrapped segment and patched into ``y``, which
+    then equals the whole-window band energy of ``SwtDetector`` (bit for bit
+    in float64). The threshold and ``find_peaks`` run over all of ``y``, as in
+    ``compute_heart_rate``, so a result matches ``SwtDetector`` at the same
+    sample; the only difference is that results come every ``hop`` samples.
+
+    A peak is confirmed once it is past the distorted tail margin plus the
+    minimum peak distance, where later samples can no longer move or
+    suppress it. Confirmed peaks are carried forward in ``confirmed`` as
+    absolute sample indices (counted from the first sample pushed) and are
+    never reported twice; each is also queued on ``new_peaks`` for the caller.
+
+    ``peak_settings(y, fs) -> (height, distance)`` and
+    ``heart_rate_from_peaks(Rpeaks, n, fs)`` are the app's own rules, so ``push``
+    keeps the ``(heart_rate, y, Rpeaks)`` contract of ``compute_heart_rate``. It
+    returns ``None`` between hops. The band energy is computed with
+    ``SwtBandEnergy`` in ``dtype`` and kept in a preallocated ring; ``y`` is a
+    reused buffer. ``timer`` times the ``filter``, ``swt`` and ``peaks`` stages,
+    as for ``SwtDetector``.
+    """
+
+    def __init__(self, ecg_filter, fs, window, hop, peak_settings, heart_rate_from_peaks,
+                 keep=(2, 3), wavelet='sym4', dtype=np.float64, history=32, timer=no_timing):
+        self.filter = ecg_filter
+        self.fs = fs
+        self.window = window
+        self.hop = hop
+        self.peak_settings = peak_settings
+        self.heart_rate_from_peaks = heart_rate_from_peaks
+        self.keep = keep
+        self.wavelet = wavelet
+        self.level = swt_level(fs)
+        self.margin = boundary_margin(self.level, keep, wavelet)
+        self.band_energy = SwtBandEnergy(self.level, keep, wavelet, dtype)
+        self.energy = RingBuffer(window, dtype)
+        self._y = np.empty(window, dtype)
+        self._wrapped = np.empty(4 * self.margin, dtype)  # window end then window start, 2 margins each
+        self._pending = 0
+        self._ready = False
+        self.count = 0  # samples pushed
+        self.confirmed = deque(maxlen=history)
+        self.new_peaks = deque(maxlen=history)
+        self.timer = timer
+
+    def push(self, samples):
+        samples = np.atleast_1d(samples)
+        with self.timer('filter'):
+            self.filter.push(samples)
+        self.count += len(samples)
+        self._pending += len(samples)
+        if len(self.filter) < self.window or (self._ready and self._pending < self.hop):
+            return None
+        with self.timer('swt'):
+            y = self._update_energy()
+        self._pending = 0
+        with self.timer('peaks'):
+            return self._detect(y)
+
+    def _update_energy(self):
+        # Returns the whole-window band energy
+        filtered = self.filter.window()
+        step = 2 ** self.level
+        fresh = self._pending + self.margin  # new samples plus the previously distorted tail
+        segment = -(-(fresh + self.margin) // step) * step
+        if not self._ready or segment >= self.window or len(self._wrapped) >= self.window:
+            y = self.band_energy(filtered)
+            self.energy.reset()
+            self.energy.extend(y)
+            self._ready = True
+            return y
+        energy = self.band_energy(filtered[-segment:])
+        self.energy.rewind(self.margin)
+        self.energy.extend(energy[-fresh:])
+
+        y = self._y
+        y[:] = self.energy.view()
+        m = self.margin
+        wrapped = self._wrapped
+        wrapped[:2 * m] = filtered[-2 * m:]
+        wrapped[2 * m:] = filtered[:2 * m]
+        edges = self.band_energy(wrapped)
+        y[-m:] = edges[m:2 * m]
+        y[:m] = edges[2 * m:3 * m]
+        return y
+
+    def _detect(self, y):
+        height, distance = self.peak_settings(y, self.fs)
+        Rpeaks, _ = find_peaks(y, height=height, distance=distance)
+        self._confirm(Rpeaks, len(y), distance)
+        return self.heart_rate_from_peaks(Rpeaks, len(y), self.fs), y, Rpeaks
+
+    def _confirm(self, Rpeaks, n, distance):
+        first = self.count - n  # absolute index of y[0]
+        settled = n - self.margin - distance
+        last = self.confirmed[-1] if self.confirmed else None
+        for i in Rpeaks:
+            if i < self.margin or i >= settled:
+                continue
+            peak = first + int(i)
+            if last is not None and peak - last < distance:
+                continue  # confirmed already, or too close to a peak that was
+            self.confirmed.append(peak)
+            self.new_peaks.append(peak)
+            last = peak
+
+
+class PanTompkinsDetector:
+    """Streaming Pan-Tompkins style R-peak detector with constant work per sample.
+
+    Each batch goes through a 5-15 Hz band-pass, a five-point derivative, squaring
+    and a ~150 ms moving-window integration, all with carried filter state.
+    Local maxima of the integrated signal are classified against an adaptive
+    threshold between running signal (SPKI) and noise (NPKI) peak levels, with a
+    200 ms refractory period; the first two seconds only seed those levels.
+
+    ``push`` returns the same ``(heart_rate, y, Rpeaks)`` contract as
+    ``compute_heart_rate`` when a beat was detected or moved, and ``None``
+    otherwise: ``y`` is the integrated signal over the last ``window`` samples
+    and ``Rpeaks`` are the detected peaks inside it. Each detection is also
+    queued on ``new_beats`` as ``(sample_index, value)``; a larger peak within
+    the refractory period replaces the last beat there as well.
+    ``dtype`` is the precision of the filters and the ``y`` ring; ``timer``
+    times the ``filter`` (band-pass to integration) and ``peaks`` stages.
+    """
+
+    def __init__(self, fs, window, band=(5.0, 15.0), integration_seconds=0.15,
+                 refractory_seconds=0.2, learning_seconds=2.0, history=32, dtype=np.float64, timer=no_timing):
+        self.fs = fs
+        self.window = window
+        self.dtype = np.dtype(dtype)
+        self.sos = butter(2, band, btype='bandpass', fs=fs, output='sos').astype(self.dtype)
+        self._sos_zi = None
+        self._derivative = (np.array([2.0, 1.0, 0.0, -1.0, -2.0]) * fs / 8.0).astype(self.dtype)
+        self._derivative_zi = np.zeros(len(self._derivative) - 1, dtype=self.dtype)
+        width = max(int(round(integration_seconds * fs)), 1)
+        self._integrator = np.full(width, 1.0 / width, dtype=self.dtype)
+        self._integrator_zi = np.zeros(width - 1, dtype=self.dtype)
+        self.refractory = int(round(refractory_seconds * fs))
+        self.integrated = RingBuffer(window, self.dtype)
+        self.beats = deque(maxlen=history)  # absolute sample index of recent R peaks
+        self.new_beats = deque(maxlen=history)
+        self.count = 0  # samples processed
+        self.spki = 0.0
+        self.npki = 0.0
+        self._learning = int(learning_seconds * fs)
+        self._learning_max = 0.0
+        self._learning_sum = 0.0
+        self._tail = np.zeros(2, dtype=self.dtype)  # last two integrated samples, for peaks across batches
+        self._last_qrs_value = 0.0
+        self.timer = timer
+
+    @property
+    def threshold(self):
+        return self.npki + 0.25 * (self.spki - self.npki)
+
+    def push(self, samples):
+        samples = np.atleast_1d(np.asarray(samples, dtype=self.dtype))
+        if not len(samples) or not self._process(samples):
+            return None
+        return self.heart_rate(), self.integrated.view(), self.peaks_in_window()
+
+    def _process(self, samples):
+        with self.timer('filter'):
+            if self._sos_zi is None:
+                self._sos_zi = (sosfilt_zi(self.sos) * samples[0]).astype(self.dtype)
+            banded, self._sos_zi = sosfilt(self.sos, samples, zi=self._sos_zi)
+            slope, self._derivative_zi = lfilter(self._derivative, 1.0, banded, zi=self._derivative_zi)
+            np.square(slope, out=slope)
+            integrated, self._integrator_zi = lfilter(self._integrator, 1.0, slope, zi=self._integrator_zi)
+            self.integrated.extend(integrated)
+
+        with self.timer('peaks'):
+            start = self.count
+            self.count += len(integrated)
+            if self._learning > 0:
+                seed = integrated[:self._learning]
+                self._learning -= len(seed)
+                self._learning_max = max(self._learning_max, float(seed.max()))
+                self._learning_sum += float(seed.sum())
+                if self._learning <= 0:
+                    self.spki = self._learning_max / 3.0
+                    self.npki = self._learning_sum / self.count / 2.0
+
+            # Local maxima, including one that straddles the previous batch
+            extended = np.concatenate((self._tail, integrated))
+            self._tail = extended[-2:]
+            middle = extended[1:-1]
+            candidates = np.flatnonzero((middle > extended[:-2]) & (middle >= extended[2:])) + 1
+            changed = False
+            for k in candidates:
+                changed |= self._classify(start - 2 + k, float(extended[k]))
+        return changed
+
+    def _classify(self, index, value):
+        # True if a beat was added or moved
+        if self.spki == 0.0:
+            return False  # still learning
+        if value > self.threshold:
+            if self.beats and index - self.beats[-1] <= self.refractory:
+                # Same QRS complex: keep the larger peak
+                if value <= self._last_qrs_value:
+                    return False
+                if self.new_beats and self.new_beats[-1][0] == self.beats[-1]:
+                    self.new_beats[-1] = (index, value)
+                self.beats[-1] = index
+                self._last_qrs_value = value
+                return True
+            self.spki = 0.125 * value + 0.875 * self.spki
+            self.beats.append(index)
+            self.new_beats.append((index, value))
+            self._last_qrs_value = value
+            return True
+        self.npki = 0.125 * value + 0.875 * self.npki
+        return False
+
+    def peaks_in_window(self):
+        first = self.count - len(self.integrated)
+        return np.array([beat - first for beat in self.beats if beat >= first], dtype=int)
+
+    def heart_rate(self):
+        # Mean RR over the beats inside the current window, like DAFRR.py
+        peaks = self.peaks_in_window()
+        if len(peaks) < 2:
+            return 0
+        return 60.0 / float(np.mean(np.diff(peaks)) / self.fs)
@@ -0,0 +1,144 @@
+import numpy as np
+from scipy.ndimage import convolve1d
+from scipy.signal import butter, lfilter, savgol_coeffs, savgol_filter, sosfilt, sosfilt_zi
+
+from rhythmsync.ringbuffer import RingBuffer
+
+
+# Parameters for Butterworth filter
+def butter_lowpass(cutoff, fs, order=5):
+    nyquist = 0.5 * fs
+    normal_cutoff = cutoff / nyquist
+    b, a = butter(order, normal_cutoff, btype='low', analog=False)
+    return b, a
+
+
+def butter_lowpass_filter(data, cutoff, fs, order=5):
+    b, a = butter_lowpass(cutoff, fs, order)
+    return lfilter(b, a, data)
+
+
+class StreamingFilter:
+    """Butterworth low-pass followed by Savitzky-Golay smoothing, one sample batch at a time.
+
+    The filter is designed once as second-order sections and its ``zi`` state is
+    carried between calls, so a ``push`` filters and smooths only the new
+    samples. Smoothed output lands in a preallocated ring; the last
+    ``window_length // 2`` values are provisional (fitted like ``mode='interp'``)
+    and are rewritten once enough future samples have arrived. The smoother
+    works in preallocated buffers, so the only allocations per push are the
+    low-passed output for the new samples and, for small batches, a few short
+    Python lists holding the filter state. ``dtype`` float32 runs the
+    whole chain, and the rings, in single precision.
+
+    Each call has a fixed cost of several NumPy/SciPy calls, so push once per
+    poll rather than once per sample. ``sosfilt`` alone costs ~75 us a call,
+    so batches of up to ``SMALL_BATCH`` samples run the same sections in
+    Python and the smoother as dot products with its taps instead; a
+    one-sample push then takes ~40 us, against ~1 ms (100 Hz, 1000 samples)
+    for refiltering the whole window with ``butter_lowpass_filter`` and
+    ``savgol_filter``.
+    """
+
+    SMALL_BATCH = 16
+
+    def __init__(self, cutoff, fs, order=5, window_length=15, polyorder=3, size=1000, dtype=np.float64):
+        self.cutoff = cutoff
+        self.fs = fs
+        self.dtype = np.dtype(dtype)
+        self.sos = butter(order, cutoff / (0.5 * fs), btype='low', output='sos').astype(self.dtype)
+        self._zi_step = sosfilt_zi(self.sos).astype(self.dtype)
+        self._zi = None
+        self._sections = self.sos[:, [0, 1, 2, 4, 5]].tolist()  # b0, b1, b2, a1, a2 per section
+        self.window_length = window_length
+        self.polyorder = polyorder
+        self._half = window_length // 2
+        self._coeffs = savgol_coeffs(window_length, polyorder).astype(self.dtype)
+        self._taps = self._coeffs[::-1].copy()  # the same filter as a dot product with the samples
+        # Rows map the last window_length samples to the provisional tail, as mode='interp' would
+        self._tail_fit = savgol_filter(np.eye(window_length), window_length, polyorder,
+                                       mode='interp', axis=0)[window_length - self._half:].astype(self.dtype)
+        self.lowpassed = RingBuffer(size, self.dtype)
+        self.smoothed = RingBuffer(size, self.dtype)
+        self._work = np.empty(size + window_length, dtype=self.dtype)  # smoother output before it enters the ring
+        self._final = 0  # smoothed samples that no longer change
+
+    def reset(self):
+        self._zi = None
+        self.lowpassed.reset()
+        self.smoothed.reset()
+        self._final = 0
+
+    def push(self, values):
+        values = np.atleast_1d(np.asarray(values, dtype=self.dtype))
+        # Batches larger than the ring would skip samples the smoother still needs
+        step = max(self.lowpassed.size // 2, 1)
+        for start in range(0, len(values), step):
+            self._push_chunk(values[start:start + step])
+        return self.smoothed.view()
+
+    def _push_chunk(self, values):
+        if not len(values):
+            return
+        if self._zi is None:
+            # Start in steady state at the first sample instead of ringing up from zero
+            self._zi = self._zi_step * values[0]
+        if len(values) <= self.SMALL_BATCH:
+            lowpassed = self._sosfilt_small(values)
+        else:
+            lowpassed, self._zi = sosfilt(self.sos, values, zi=self._zi)
+        self.lowpassed.extend(lowpassed)
+
+        half = self._half
+        total = self.lowpassed.count
+        self.smoothed.rewind(self.smoothed.count - self._final)
+
+        if total < self.window_length:
+            # Not enough history to smooth yet; expose the low-passed samples as-is
+            self.smoothed.extend(self.lowpassed.view(total - self._final))
+            return
+
+        final_end = total - half
+        if self._final < half:
+            # The first half-window has no left context; keep it unsmoothed
+            head = self.lowpassed.view(total)[self._final:half]
+            self.smoothed.extend(head)
+            self._final = half
+        if final_end > self._final:
+            segment = self.lowpassed.view(total - self._final + half)
+            fresh = final_end - self._final
+            if fresh <= self.SMALL_BATCH:
+                work = self._work[:fresh]
+                for i in range(fresh):
+                    work[i] = np.dot(self._taps, segment[i:i + self.window_length])
+                self.smoothed.extend(work)
+            else:
+                # Same as np.convolve(mode='valid') once the half-window at each end is dropped
+                work = self._work[:len(segment)]
+                convolve1d(segment, self._coeffs, output=work, mode='nearest')
+                self.smoothed.extend(work[half:len(segment) - half])
+            self._final = final_end
+
+        tail = self._work[:half]
+        np.matmul(self._tail_fit, self.lowpassed.view(self.window_length), out=tail)
+        self.smoothed.extend(tail)
+
+    def _sosfilt_small(self, values):
+        # sosfilt's transposed direct form II, without its per-call overhead
+        zi = self._zi.tolist()
+        out = values.tolist()
+        for i, x in enumerate(out):
+            for section, (b0, b1, b2, a1, a2) in zip(zi, self._sections):
+                y = b0 * x + section[0]
+                section[0] = b1 * x - a1 * y + section[1]
+                section[1] = b2 * x - a2 * y
+                x = y
+            out[i] = x
+        self._zi[:] = zi
+        return out
+
+    def window(self, n=None):
+        return self.smoothed.view(n)
+
+    def __len__(self):
+        return len(self.smoothed)
@@ -0,0 +1,207 @@
+"""Heart-rate-driven playback without a display, for small single-board computers.
+
+Serial acquisition, filtering, heart-rate detection and song selection run in
+one thread that wakes every ``--poll`` seconds and handles everything that
+arrived since. No Tk or matplotlib is loaded. Heart rate and status are logged
+every ``--interval`` seconds:
+
+    python -m rhythmsync.headless --port /dev/ttyUSB0 --interval 10 --log heart_rate.log
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+from rhythmsync.audio import ZoneSelector
+from rhythmsync.hrv import format_hrv
+from rhythmsync.latency import format_latency
+from rhythmsync.quality import format_quality
+from rhythmsync.session import EcgSession
+
+DEFAULT_PLAYLIST = ('low.mp3', 'medium.mp3', 'high.mp3')  # <60, 60-100 and >100 BPM
+
+log = logging.getLogger('rhythmsync.headless')
+
+
+class HeadlessRunner:
+    """Polls an ``EcgSession`` and plays the song for the current heart-rate zone.
+
+    ``player`` is an ``AudioBank``/``MusicPlayer``, or ``None`` to only log the
+    song that would play; zones change with the player's hysteresis. The
+    session is pumped from this thread, so its acquisition thread is not started.
+    """
+
+    def __init__(self, session, player=None, playlist=DEFAULT_PLAYLIST, interval=5.0, poll_interval=0.2,
+                 hysteresis=5.0, stress_lf_hf=None):
+        self.session = session
+        self.player = player
+        self.zones = player.zones if player is not None else ZoneSelector(hysteresis, stress_lf_hf)
+        self.playlist = playlist
+        self.interval = interval
+        self.poll_interval = poll_interval
+        self.heart_rate = None
+        self.source = None  # 'host' or 'on-device'
+        self.song_index = -1
+        self.updates = 0
+        self._quality_changes = 0
+        self._last_log = time.monotonic()
+
+    def step(self):
+        session = self.session
+        try:
+            session.pump()
+        except OSError as e:  # serial.SerialException is an OSError
+            log.error("Serial error: %s", e)
+            raise
+        heart_rate = session.consume_beats()
+        if heart_rate:
+            self._set_heart_rate(heart_rate, 'on-device')
+        samples, _, result = session.poll()
+        if result is not None:
+            heart_rate, processed_signal, _ = result
+            if processed_signal is not None:
+                self._set_heart_rate(heart_rate, 'host')
+        if self.player is not None:
+            self.player.update()
+        if session.quality.changes != self._quality_changes:
+            self._quality_changes = session.quality.changes
+            log.info("%s, heart rate %s", format_quality(session.quality),
+                     'resumed' if session.quality.ok else 'paused')
+
+        now = time.monotonic()
+        if now - self._last_log >= self.interval:
+            self._last_log = now
+            self.log_status()
+
+    def _set_heart_rate(self, heart_rate, source):
+        self.heart_rate = heart_rate
+        self.source = source
+        self.updates += 1
+        hrv = self.session.hrv.metrics()
+        index = self.zones.select(heart_rate, hrv)
+        if self.player is None:
+            if index != self.song_index:
+                self.song_index = index
+                log.info("Song: %s (%.1f BPM)", self._song_name(index), heart_rate)
+            return
+        try:
+            # Repeated every update: the bank starts a zone once its song has been decoded,
+            # and the tempo engine follows the heart rate within a zone
+            with self.session.latency.stage('play_song'):
+                self.player.play_for_heart_rate(heart_rate, hrv)
+        except Exception as e:  # a missing file or audio device must not stop acquisition
+            if index != self.song_index:
+                log.error("Could not play %s: %s", self._song_name(index), e)
+        self.song_index = index
+
+    def _song_name(self, index):
+        entry = self.playlist[index] if index < len(self.playlist) else None
+        path = entry["path"] if isinstance(entry, dict) else entry
+        return os.path.basename(path) if path else f"song {index}"
+
+    def log_status(self):
+        reader = self.session.reader
+        heart_rate = f"{self.heart_rate:.1f} BPM ({self.source})" if self.heart_rate is not None else "--"
+        song = self._song_name(self.song_index) if self.song_index >= 0 else "--"
+        log.info("Heart Rate: %s | song %s | %s | %d dropped lines | %d B backlog",
+                 heart_rate, song, reader.rate_text(), reader.dropped, reader.backlog)
+        log.info("%s | %d beats, %d rejected | %s", format_hrv(self.session.hrv.metrics()), len(self.session.hrv),
+                 self.session.hrv.rejected, format_quality(self.session.quality))
+        log.info("%s", format_latency(self.session.latency))
+        telemetry = self.session.telemetry
+        if telemetry is not None:
+            log.info("Telemetry: %d sent, %d pending, %d dropped%s", telemetry.sent, telemetry.pending,
+                     telemetry.dropped, f", retrying in up to {telemetry.backoff:g} s" if telemetry.backoff else '')
+
+    def run(self, duration=None):
+        start = time.monotonic()
+        next_poll = start
+        while duration is None or time.monotonic() - start < duration:
+            self.step()
+            # Sleep to a fixed schedule so each wake-up handles a whole batch of samples
+            next_poll += self.poll_interval
+            delay = next_poll - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_poll = time.monotonic()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m rhythmsync.headless',
+                                     description="Heart-rate-driven music from the ECG device, without a GUI.")
+    parser.add_argument('--port', default=os.environ.get('RHYTHMSYNC_PORT', 'COM14'),
+                        help="serial port (default: $RHYTHMSYNC_PORT or COM14)")
+    parser.add_argument('--rate', type=int, default=100, help="requested sampling rate in Hz")
+    parser.add_argument('--protocol', choices=('ascii', 'binary'), default='ascii',
+                        help="serial format if the sketch does not report one")
+    parser.add_argument('--engine', choices=('swt', 'pan-tompkins'), default='swt', help="R-peak detector")
+    parser.add_argument('--swt-hop', type=int, default=100,
+                        help="samples between SWT updates (default: 1 s at 100 Hz)")
+    parser.add_argument('--rules', choices=('count', 'rr'), default='count',
+                        help="SWT heart-rate rules: app.py's 'count' or DAFRR.py's 'rr'")
+    parser.add_argument('--precision', choices=('float64', 'float32'), default='float64',
+                        help="dtype of the filter and detector")
+    parser.add_argument('--playlist', nargs=3, default=DEFAULT_PLAYLIST, metavar=('LOW', 'MEDIUM', 'HIGH'),
+                        help="songs for <60, 60-100 and >100 BPM")
+    parser.add_argument('--no-audio', action='store_true', help="only log the song that would play")
+    parser.add_argument('--audio-engine', choices=('bank', 'stream', 'tempo'), default='bank',
+                        help="'bank' decodes the playlist once and crossfades, 'stream' decodes on each change, "
+                             "'tempo' also matches the song's tempo to the heart rate")
+    parser.add_argument('--crossfade', type=float, default=2.0, help="crossfade between songs in seconds")
+    parser.add_argument('--hysteresis', type=float, default=5.0,
+                        help="BPM past a zone edge before the song changes")
+    parser.add_argument('--stress-lf-hf', type=float,
+                        help="play the calmer zone's song while the HRV LF/HF ratio is above this")
+    parser.add_argument('--no-gate', action='store_true',
+                        help="run the detector on every sample, even with leads off or an unusable signal")
+    parser.add_argument('--interval', type=float, default=5.0, help="seconds between status log lines")
+    parser.add_argument('--poll', type=float, default=0.2, help="seconds between serial polls")
+    parser.add_argument('--record', metavar='DIR', help="record the session under this directory")
+    parser.add_argument('--telemetry-url', metavar='URL', default=os.environ.get('RHYTHMSYNC_TELEMETRY_URL'),
+                        help="publish heart rate to this bulk-update endpoint (default: $RHYTHMSYNC_TELEMETRY_URL)")
+    parser.add_argument('--telemetry-key', default=os.environ.get('RHYTHMSYNC_TELEMETRY_KEY'),
+                        help="the endpoint's write API key (default: $RHYTHMSYNC_TELEMETRY_KEY)")
+    parser.add_argument('--latency-export', metavar='PATH', default=os.environ.get('RHYTHMSYNC_LATENCY_EXPORT'),
+                        help="rewrite the latency histograms to this file every 10 s: JSON for *.json, Prometheus "
+                             "text otherwise (default: $RHYTHMSYNC_LATENCY_EXPORT)")
+    parser.add_argument('--log', help="append the log to this file instead of stdout")
+    parser.add_argument('--duration', type=float, help="stop after this many seconds")
+    args = parser.parse_args(argv)
+
+    handler = logging.FileHandler(args.log) if args.log else logging.StreamHandler(sys.stdout)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s', handlers=[handler])
+
+    playlist = [{"path": path} for path in args.playlist]
+    session = EcgSession.open(args.port, args.rate, args.protocol, engine=args.engine, swt_hop=args.swt_hop,
+                              rules=args.rules, record=args.record, telemetry=args.telemetry_url,
+                              telemetry_key=args.telemetry_key, gate=not args.no_gate,
+                              precision=args.precision, latency_export=args.latency_export)
+    log.info("Reading %s at %.0f Hz (%s mode)", args.port, session.sampling_rate, session.mode)
+    if session.recorder is not None:
+        log.info("Recording to %s", session.recorder.directory)
+    player = None
+    if not args.no_audio:
+        from rhythmsync.audio import make_player
+
+        player = make_player(playlist, args.audio_engine, log.info, args.hysteresis, args.crossfade,
+                             args.stress_lf_hf)
+    runner = HeadlessRunner(session, player, playlist, args.interval, args.poll, args.hysteresis,
+                            args.stress_lf_hf)
+    try:
+        runner.run(args.duration)
+    except KeyboardInterrupt:
+        pass
+    except OSError:
+        return 1
+    finally:
+        runner.log_status()
+        if player is not None:
+            player.stop()
+        session.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
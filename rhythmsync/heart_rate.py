@@ -0,0 +1,64 @@
+import numpy as np
+
+from rhythmsync.latency import no_timing
+from rhythmsync.rates import swt_level
+
+
+# app.py and hardware_code/main.py: peaks above 8x the mean, beats counted over the window
+def mean_peak_settings(y, fs):
+    avg = np.mean(y)
+    return 8 * avg, int(fs / 2)  # Adjust distance based on Fs
+
+
+def heart_rate_from_count(Rpeaks, n, fs):
+    return (len(Rpeaks) * 60) / (n / fs)
+
+
+# DAFRR.py: peaks above mean + 2 std, heart rate from the mean RR interval
+def spread_peak_settings(y, sampling_rate):
+    avg = np.mean(y)
+    std = np.std(y)
+
+    # Adjust the peak detection threshold R (custom to fit the signal)
+    threshold = avg + 2 * std
+    min_distance = int(sampling_rate * 0.4) # Minimum distance between peaks (depending on the signal) into heart rate)
+    return threshold, min_distance
+
+
+def heart_rate_from_rr(Rpeaks, n, sampling_rate):
+    # Calculate heart rate from the time interval between R peaks
+    if len(Rpeaks) > 1:
+        rr_intervals = np.diff(Rpeaks) / sampling_rate # Calculate the time interval between R peaks (in seconds)
+        avg_rr_interval = np.mean(rr_intervals) # Average of the time interval
+        heart_rate = 60 / avg_rr_interval # Heart rate (bpm)
+    else:
+        heart_rate = 0 # Not enough R peaks to calculate heart rate
+    return heart_rate
+
+
+# (peak_settings, heart_rate_from_peaks) per rule set
+RULES = {
+    'count': (mean_peak_settings, heart_rate_from_count),
+    'rr': (spread_peak_settings, heart_rate_from_rr),
+}
+
+
+def compute_heart_rate(ecg_signal, fs, rules='count', band_energy=None, timer=no_timing):
+    # SWT with 'sym4', keeping d3 and d4, magnitude squared, then the rule set's R-peak search.
+    # With band_energy (a rhythmsync.wavelets.SwtBandEnergy) y is its reused buffer;
+    # timer (rhythmsync.latency.LatencyMonitor.stage) times the 'swt' and 'peaks' stages
+    from scipy.signal import find_peaks
+
+    from rhythmsync.wavelets import swt_band_energy
+
+    peak_settings, heart_rate_from_peaks = RULES[rules]
+    with timer('swt'):
+        if band_energy is not None:
+            y = band_energy(ecg_signal)
+        else:
+            y = swt_band_energy(ecg_signal, swt_level(fs), keep=(2, 3))
+    with timer('peaks'):
+        height, distance = peak_settings(y, fs)
+        Rpeaks, _ = find_peaks(y, height=height, distance=distance)
+    heart_rate = heart_rate_from_peaks(Rpeaks, len(ecg_signal), fs)
+    return heart_rate, y, Rpeaks
@@ -0,0 +1,263 @@
+"""Heart-rate variability from every RR interval of a session, updated beat by beat.
+
+``RRStore`` keeps all accepted RR intervals of a session and running sums
+over them. SDNN, RMSSD and pNN50, over the whole session and over the last
+``window`` seconds, and the Lomb-Scargle LF and HF band powers of that
+window, are read from the sums. Adding a beat costs the same at minute one
+and hour ten, and nothing is recomputed over the history.
+"""
+import numpy as np
+
+LF_BAND = (0.04, 0.15)  # Hz
+HF_BAND = (0.15, 0.4)
+
+
+class _Moments:
+    # Count, sum and sum of squares of values offset by ``ref``, so the variance keeps its precision
+
+    __slots__ = ('ref', 'n', 's', 'ss')
+
+    def __init__(self, ref=0.0):
+        self.ref = ref
+        self.n = 0
+        self.s = 0.0
+        self.ss = 0.0
+
+    def add(self, x, sign=1):
+        x -= self.ref
+        self.n += sign
+        self.s += sign * x
+        self.ss += sign * x * x
+
+    @property
+    def mean(self):
+        return float(self.ref + self.s / self.n) if self.n else None
+
+    @property
+    def std(self):
+        if self.n < 2:
+            return None
+        return float(np.sqrt(max(self.ss - self.s * self.s / self.n, 0.0) / (self.n - 1)))
+
+    @property
+    def rms(self):
+        # Of the values themselves; only meaningful with ref=0
+        return float(np.sqrt(max(self.ss, 0.0) / self.n)) if self.n else None
+
+
+class _Periodogram:
+    """Lomb-Scargle sums over unevenly spaced ``(t, y)`` at fixed ``freqs``; samples can be added and removed."""
+
+    def __init__(self, freqs):
+        self.freqs = freqs
+        self.omega = 2 * np.pi * freqs
+        self.sums = np.zeros((6, len(freqs)))  # cos, sin, y cos, y sin, cos 2wt, sin 2wt
+
+    def add(self, t, y, sign=1):
+        wt = self.omega * t
+        c, s = np.cos(wt), np.sin(wt)
+        self.sums += sign * np.array([c, s, y * c, y * s, c * c - s * s, 2 * s * c])
+
+    def power(self, n, mean):
+        """Classical Lomb-Scargle power of the mean-removed samples, one value per frequency."""
+        c, s, yc, ys, c2, s2 = self.sums
+        yc = yc - mean * c
+        ys = ys - mean * s
+        two_tau = np.arctan2(s2, c2)
+        cos_tau, sin_tau = np.cos(two_tau / 2), np.sin(two_tau / 2)
+        cc = (n + c2 * np.cos(two_tau) + s2 * np.sin(two_tau)) / 2
+        ss = n - cc
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return 0.5 * (np.where(cc > 1e-9, (yc * cos_tau + ys * sin_tau) ** 2 / cc, 0.0)
+                          + np.where(ss > 1e-9, (ys * cos_tau - yc * sin_tau) ** 2 / ss, 0.0))
+
+
+class RRStore:
+    """The RR intervals of one session, with session-long and rolling HRV statistics.
+
+    Beats are added with ``add_beat`` (a beat time in seconds) or
+    ``add_rr``. Intervals outside ``min_rr``-``max_rr`` seconds, or more
+    than ``max_change`` away from the median of the last few accepted ones,
+    are rejected as missed or extra beats; successive differences are only
+    taken between adjacent accepted intervals. ``metrics`` reports the
+    statistics, with LF and HF once the window spans ``min_spectrum_span``
+    seconds; band powers are only accurate while ``freq_step`` is below
+    ``1 / window`` Hz. ``times`` and ``intervals`` are the accepted beats.
+    """
+
+    def __init__(self, window=300.0, min_rr=0.3, max_rr=2.0, max_change=0.3, freq_step=0.002,
+                 min_spectrum_span=60.0, rebuild_every=10000):
+        self.window = window
+        self.min_rr = min_rr
+        self.max_rr = max_rr
+        self.max_change = max_change
+        self.min_spectrum_span = min_spectrum_span
+        self.rebuild_every = rebuild_every
+        self.freqs = np.arange(LF_BAND[0], HF_BAND[1] + freq_step / 2, freq_step)
+        self._times = np.empty(1024)
+        self._rr = np.empty(1024)
+        self._diffs = np.empty(1024)  # ms, NaN where the previous interval was not adjacent
+        self.count = 0
+        self.rejected = 0
+        self._start = 0  # first interval inside the window
+        self._last_beat = None
+        self._adjacent = False  # whether the next interval follows the last accepted one
+        self._recent = []  # last accepted intervals, for the artefact check
+        self._rejected_run = 0
+        self._removed = 0
+        self.session = _Moments(ref=800.0)
+        self.session_diffs = _Moments()
+        self.session_nn50 = 0
+        self._reset_window()
+
+    def _reset_window(self):
+        self.rolling = _Moments(ref=800.0)
+        self.rolling_diffs = _Moments()
+        self.rolling_nn50 = 0
+        self.periodogram = _Periodogram(self.freqs)
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def times(self):
+        return self._times[:self.count]
+
+    @property
+    def intervals(self):
+        return self._rr[:self.count]
+
+    def add_beat(self, t):
+        """Add the beat at ``t`` seconds; returns the accepted RR interval, or None."""
+        if self._last_beat is None:
+            self._last_beat = t
+            return None
+        rr = t - self._last_beat
+        if rr < self.min_rr:
+            # An extra detection (e.g. a T wave); the next beat is measured from the last real one
+            self.rejected += 1
+            return None
+        self._last_beat = t
+        return rr if self.add_rr(rr, t) else None
+
+    def add_rr(self, rr, t):
+        """Add the interval ``rr`` ending at ``t`` seconds. Returns False when it is rejected."""
+        if rr < self.min_rr or rr > self.max_rr or not self._plausible(rr):
+            self.rejected += 1
+            self._adjacent = False
+            return False
+        if self.count == len(self._rr):
+            for name in ('_times', '_rr', '_diffs'):
+                grown = np.empty(2 * self.count)
+                grown[:self.count] = getattr(self, name)
+                setattr(self, name, grown)
+        adjacent = self._adjacent
+        diff = (rr - self._rr[self.count - 1]) * 1000 if adjacent else np.nan
+        i = self.count
+        self._times[i], self._rr[i], self._diffs[i] = t, rr, diff
+        self.count += 1
+        self._adjacent = True
+        self._recent = (self._recent + [rr])[-5:]
+
+        ms = rr * 1000
+        self.session.add(ms)
+        self.rolling.add(ms)
+        self.periodogram.add(t, ms)
+        if adjacent:
+            self.session_diffs.add(diff)
+            self.rolling_diffs.add(diff)
+            nn50 = int(abs(diff) > 50)
+            self.session_nn50 += nn50
+            self.rolling_nn50 += nn50
+        self._expire(t)
+        return True
+
+    def _plausible(self, rr):
+        if not self._recent:
+            return True
+        median = float(np.median(self._recent))
+        if abs(rr - median) <= self.max_change * median:
+            self._rejected_run = 0
+            return True
+        self._rejected_run += 1
+        if self._rejected_run >= 5:
+            # The rhythm really changed; start the comparison over
+            self._recent = []
+            self._rejected_run = 0
+            return True
+        return False
+
+    def _expire(self, now):
+        while self._start < self.count and self._times[self._start] < now - self.window:
+            i = self._start
+            self.rolling.add(self._rr[i] * 1000, -1)
+            self.periodogram.add(self._times[i], self._rr[i] * 1000, -1)
+            diff = self._diffs[i]
+            if not np.isnan(diff):
+                self.rolling_diffs.add(diff, -1)
+                self.rolling_nn50 -= int(abs(diff) > 50)
+            self._start += 1
+            self._removed += 1
+        if self._removed >= self.rebuild_every:
+            self._rebuild()
+
+    def _rebuild(self):
+        # Removing terms from the sums accumulates rounding error; start them again from the window
+        self._removed = 0
+        self._reset_window()
+        for i in range(self._start, self.count):
+            ms = self._rr[i] * 1000
+            self.rolling.add(ms)
+            self.periodogram.add(self._times[i], ms)
+            if not np.isnan(self._diffs[i]):
+                self.rolling_diffs.add(self._diffs[i])
+                self.rolling_nn50 += int(abs(self._diffs[i]) > 50)
+
+    def spectrum(self):
+        """``(freqs, psd)`` of the window in ms²/Hz, or None while it spans under ``min_spectrum_span`` s."""
+        n = self.rolling.n
+        if n < 8:
+            return None
+        span = self._times[self.count - 1] - self._times[self._start]
+        if span < self.min_spectrum_span:
+            return None
+        # Scaled so the spectrum integrates to about the variance of the intervals
+        return self.freqs, self.periodogram.power(n, self.rolling.mean) * 2 * span / n
+
+    def metrics(self):
+        """HRV of the window and the session; times in ms, pNN50 in %, LF/HF in ms²."""
+        mean_rr = self.rolling.mean
+        metrics = {
+            'beats': self.count,
+            'rejected': self.rejected,
+            'heart_rate': 60000 / mean_rr if mean_rr else None,
+            'mean_rr': mean_rr,
+            'sdnn': self.rolling.std,
+            'rmssd': self.rolling_diffs.rms,
+            'pnn50': 100 * self.rolling_nn50 / self.rolling_diffs.n if self.rolling_diffs.n else None,
+            'session_sdnn': self.session.std,
+            'session_rmssd': self.session_diffs.rms,
+            'session_pnn50': (100 * self.session_nn50 / self.session_diffs.n if self.session_diffs.n
+                              else None),
+            'lf': None,
+            'hf': None,
+            'lf_hf': None,
+        }
+        spectrum = self.spectrum()
+        if spectrum is not None:
+            freqs, psd = spectrum
+            step = freqs[1] - freqs[0]
+            lf = float(psd[(freqs >= LF_BAND[0]) & (freqs < LF_BAND[1])].sum() * step)
+            hf = float(psd[(freqs >= HF_BAND[0]) & (freqs <= HF_BAND[1])].sum() * step)
+            metrics.update(lf=lf, hf=hf, lf_hf=lf / hf if hf > 0 else None)
+        return metrics
+
+
+def format_hrv(metrics):
+    # One-line summary for status bars and logs
+    if not metrics or metrics['rmssd'] is None:
+        return "HRV: --"
+    text = f"HRV: RMSSD {metrics['rmssd']:.0f} ms, SDNN {metrics['sdnn']:.0f} ms, pNN50 {metrics['pnn50']:.0f}%"
+    if metrics['lf_hf'] is not None:
+        text += f", LF/HF {metrics['lf_hf']:.2f}"
+    return text
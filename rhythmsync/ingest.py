@@ -0,0 +1,273 @@
+"""Heart rate from many ECG devices in one process, for group sessions.
+
+Each device gets its own ``EcgSession``: serial reader thread, ring buffer,
+filter and detector state. A dispatcher hands each device's new samples to
+a shared thread pool for filtering and detection, at most one job per device
+at a time, so per-device state is never touched by two threads at once.
+Throughput, lag, DSP time and the p99 time from a sample's arrival to its
+heart rate are tracked per device and logged as a table every ``--interval``
+seconds:
+
+    python -m rhythmsync.ingest /dev/ttyUSB0 /dev/ttyUSB1 /dev/ttyUSB2 --workers 4 --record sessions
+"""
+import argparse
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from rhythmsync.session import EcgSession
+
+log = logging.getLogger('rhythmsync.ingest')
+
+
+class Device:
+    """One device of an ``IngestService``: its session, latest heart rate and counters.
+
+    ``pending`` is the number of samples read but not yet processed; ``lag``
+    is the same in seconds. ``max_lag`` is the largest ``pending`` seen when
+    a job was dispatched.
+    """
+
+    def __init__(self, name, session):
+        self.name = name
+        self.session = session
+        session.latency.labels.setdefault('device', name)
+        self.heart_rate = None
+        self.source = None  # 'host' or 'on-device'
+        self.updates = 0
+        self.processed = 0  # samples through the detector
+        self.jobs = 0
+        self.dsp_seconds = 0.0
+        self.max_lag = 0
+        self.error = None
+        self.future = None
+        self._last_stats = (time.monotonic(), 0)
+
+    @property
+    def pending(self):
+        return self.session.ring.count - self.session.cursor
+
+    @property
+    def lag(self):
+        return self.pending / self.session.sampling_rate
+
+    def process(self):
+        # Runs on the worker pool, never concurrently for the same device
+        start = time.perf_counter()
+        session = self.session
+        heart_rate = session.consume_beats()
+        if heart_rate:
+            self.heart_rate, self.source = heart_rate, 'on-device'
+            self.updates += 1
+        samples, _, result = session.poll()
+        self.processed += len(samples)
+        if result is not None:
+            heart_rate, processed_signal, _ = result
+            if processed_signal is not None:
+                self.heart_rate, self.source = heart_rate, 'host'
+                self.updates += 1
+        self.jobs += 1
+        self.dsp_seconds += time.perf_counter() - start
+
+    def stats(self):
+        # Counters since the previous call; throughput is processed samples per second
+        now = time.monotonic()
+        since, processed = self._last_stats
+        self._last_stats = (now, self.processed)
+        reader = self.session.reader
+        end_to_end = self.session.latency.end_to_end
+        return {
+            'device': self.name,
+            'heart_rate': self.heart_rate,
+            'source': self.source,
+            'signal': self.session.quality.reason,
+            'throughput': (self.processed - processed) / max(now - since, 1e-9),
+            'lag_s': self.lag,
+            'max_lag_s': self.max_lag / self.session.sampling_rate,
+            'dsp_ms': 1000 * self.dsp_seconds / self.jobs if self.jobs else 0.0,
+            'e2e_p99_ms': 1000 * end_to_end.quantile(0.99) if end_to_end.count else None,
+            'dropped': reader.dropped,
+            'backlog': reader.backlog,
+            'error': str(self.error) if self.error else '',
+        }
+
+
+class IngestService:
+    """Runs ``Device`` pipelines for many sessions, DSP shared over ``workers`` threads.
+
+    Every ``poll_interval`` seconds the dispatcher submits each idle device
+    that has new samples to the pool. A device whose reader or detector
+    fails is marked with ``error`` and left out from then on; the others keep
+    running. numpy, scipy and pywt release the GIL in their inner loops, so
+    the threads overlap well enough for a dozen devices at 100 Hz.
+    """
+
+    def __init__(self, sessions, workers=None, poll_interval=0.1):
+        self.devices = [Device(name, session) for name, session in sessions.items()]
+        self.workers = workers or max(min(len(self.devices), os.cpu_count() or 1), 1)
+        self.pool = ThreadPoolExecutor(self.workers, thread_name_prefix='ingest-dsp')
+        self.poll_interval = poll_interval
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._dispatch, name='ingest-dispatch', daemon=True)
+
+    @classmethod
+    def open(cls, ports, requested_rate=100, protocol='ascii', workers=None, poll_interval=0.1, record=None,
+             latency_export=None, **settings):
+        """Open ``ports`` concurrently (each handshake can take seconds) and build the service.
+
+        Ports that fail to open are logged and skipped. With ``record``, each
+        device records under ``record/<device name>``; with ``latency_export``,
+        its latency histograms go to ``latency_export/<device name>.prom``.
+        """
+        def open_one(port):
+            device_record = os.path.join(record, device_name(port)) if record else None
+            export = os.path.join(latency_export, f'{device_name(port)}.prom') if latency_export else None
+            return EcgSession.open(port, requested_rate, protocol, record=device_record, latency_export=export,
+                                   **settings)
+
+        sessions = {}
+        with ThreadPoolExecutor(len(ports)) as pool:
+            futures = [(port, pool.submit(open_one, port)) for port in ports]
+            for port, future in futures:
+                try:
+                    sessions[device_name(port)] = future.result()
+                except (OSError, ValueError) as e:  # serial.SerialException is an OSError
+                    log.error("Could not open %s: %s", port, e)
+        if not sessions:
+            raise OSError("No device could be opened")
+        return cls(sessions, workers, poll_interval)
+
+    def add_device(self, name, session):
+        # Devices can join while the service runs, e.g. network senders as they appear
+        device = Device(name, session)
+        self.devices.append(device)
+        if self._thread.is_alive():
+            session.start()
+        return device
+
+    def start(self):
+        for device in self.devices:
+            device.session.start()
+        self._thread.start()
+
+    def _dispatch(self):
+        next_poll = time.monotonic()
+        while not self._stop_event.is_set():
+            for device in list(self.devices):
+                self._dispatch_one(device)
+            next_poll += self.poll_interval
+            delay = next_poll - time.monotonic()
+            if delay > 0:
+                self._stop_event.wait(delay)
+            else:
+                next_poll = time.monotonic()
+
+    def _dispatch_one(self, device):
+        if device.error is not None:
+            return
+        future = device.future
+        if future is not None:
+            if not future.done():
+                return
+            device.future = None
+            if future.exception() is not None:
+                device.error = future.exception()
+                log.error("%s: processing failed: %s", device.name, device.error)
+                return
+        if device.session.error is not None:
+            device.error = device.session.error
+            log.error("%s: serial error: %s", device.name, device.error)
+            return
+        pending = device.pending
+        if pending:
+            device.max_lag = max(device.max_lag, pending)
+            device.future = self.pool.submit(device.process)
+
+    def stats(self):
+        return [device.stats() for device in self.devices]
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        self.pool.shutdown(wait=True)
+        for device in self.devices:
+            device.session.close()
+
+
+def device_name(port):
+    # 'COM14' -> 'COM14', '/dev/ttyUSB0' -> 'ttyUSB0', '/dev/pts/3' -> 'pts-3'
+    name = port[len('/dev/'):] if port.startswith('/dev/') else os.path.basename(port.rstrip('/\\')) or port
+    return name.replace('/', '-')
+
+
+def format_stats(rows):
+    lines = [f"{'device':<12} {'BPM':>6} {'source':<9} {'signal':<9} {'samples/s':>9} {'lag s':>6} {'max lag':>7} "
+             f"{'DSP ms':>6} {'e2e p99':>7} {'dropped':>7} {'backlog':>7}"]
+    for row in rows:
+        heart_rate = f"{row['heart_rate']:.1f}" if row['heart_rate'] is not None else '--'
+        e2e = f"{row['e2e_p99_ms']:.0f}" if row['e2e_p99_ms'] is not None else '--'
+        lines.append(f"{row['device']:<12} {heart_rate:>6} {row['source'] or '--':<9} {row['signal']:<9} "
+                     f"{row['throughput']:>9.1f} {row['lag_s']:>6.2f} {row['max_lag_s']:>7.2f} {row['dsp_ms']:>6.2f} "
+                     f"{e2e:>7} {row['dropped']:>7} {row['backlog']:>7}"
+                     + (f"  {row['error']}" if row['error'] else ''))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m rhythmsync.ingest',
+                                     description="Heart rate from several ECG devices in one process.")
+    parser.add_argument('ports', nargs='*', help="serial ports (default: the comma-separated $RHYTHMSYNC_PORTS)")
+    parser.add_argument('--rate', type=int, default=100, help="requested sampling rate in Hz")
+    parser.add_argument('--protocol', choices=('ascii', 'binary'), default='ascii',
+                        help="serial format if the sketch does not report one")
+    parser.add_argument('--engine', choices=('swt', 'pan-tompkins'), default='swt', help="R-peak detector")
+    parser.add_argument('--swt-hop', type=int, default=100,
+                        help="samples between SWT updates (default: 1 s at 100 Hz)")
+    parser.add_argument('--rules', choices=('count', 'rr'), default='count',
+                        help="SWT heart-rate rules: app.py's 'count' or DAFRR.py's 'rr'")
+    parser.add_argument('--precision', choices=('float64', 'float32'), default='float64',
+                        help="dtype of the filter and detector")
+    parser.add_argument('--workers', type=int, help="DSP threads (default: one per device, up to the CPU count)")
+    parser.add_argument('--poll', type=float, default=0.1, help="seconds between dispatches")
+    parser.add_argument('--interval', type=float, default=5.0, help="seconds between status tables")
+    parser.add_argument('--record', metavar='DIR', help="record each device under DIR/<device>")
+    parser.add_argument('--latency-export', metavar='DIR',
+                        help="rewrite each device's latency histograms to DIR/<device>.prom every 10 s")
+    parser.add_argument('--log', help="append the log to this file instead of stdout")
+    parser.add_argument('--duration', type=float, help="stop after this many seconds")
+    args = parser.parse_args(argv)
+
+    ports = args.ports or [p for p in os.environ.get('RHYTHMSYNC_PORTS', '').split(',') if p]
+    if not ports:
+        parser.error("no serial ports given")
+    handler = logging.FileHandler(args.log) if args.log else logging.StreamHandler(sys.stdout)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s', handlers=[handler])
+
+    try:
+        service = IngestService.open(ports, args.rate, args.protocol, args.workers, args.poll, args.record,
+                                     args.latency_export, engine=args.engine, swt_hop=args.swt_hop, rules=args.rules,
+                                     precision=args.precision)
+    except OSError as e:
+        log.error("%s", e)
+        return 1
+    log.info("Reading %d devices with %d DSP threads", len(service.devices), service.workers)
+    service.start()
+    deadline = time.monotonic() + args.duration if args.duration is not None else None
+    try:
+        while deadline is None or time.monotonic() < deadline:
+            remaining = deadline - time.monotonic() if deadline is not None else args.interval
+            time.sleep(max(min(args.interval, remaining), 0))
+            log.info("\n%s", format_stats(service.stats()))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,218 @@
+"""Per-stage latency histograms for the acquisition and DSP pipeline, and their export.
+
+``LatencyMonitor.stage(name)`` is a context manager that times one call of a
+pipeline stage with ``time.perf_counter`` into a fixed-size histogram; one
+call costs about a microsecond, so it stays on in normal runs. Besides the
+stages (``read``, ``quality``, ``filter``, ``swt``, ``peaks``, ``detector``
+and the apps' ``play_song``/``draw``), it keeps the end-to-end latency from a
+sample's arrival to the heart rate computed from it, and the reader's backlog
+(bytes waiting on the serial port, or frames held for reordering over UDP).
+The histograms can be written as JSON or Prometheus text every few seconds:
+
+    python -m rhythmsync.headless --latency-export /var/lib/node_exporter/rhythmsync.prom
+"""
+import bisect
+import contextlib
+import json
+import os
+import time
+
+# Upper bucket bounds: 10 us to 10 s in 1-2-5 steps, and the reader's backlog
+TIME_BUCKETS = tuple(m * 10.0 ** e for e in range(-5, 1) for m in (1, 2, 5)) + (10.0,)
+BACKLOG_BUCKETS = (0, 16, 64, 256, 1024, 4096, 16384, 65536)
+
+_NULL_CONTEXT = contextlib.nullcontext()
+
+
+def no_timing(name):
+    # Stand-in for LatencyMonitor.stage where nothing is measured
+    return _NULL_CONTEXT
+
+
+class Histogram:
+    """Counts of values per bucket (``bounds`` are the upper edges), with the sum and maximum."""
+
+    __slots__ = ('bounds', 'counts', 'count', 'sum', 'max')
+
+    def __init__(self, bounds=TIME_BUCKETS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)  # the last bucket is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """Estimate of the ``q`` quantile, interpolated inside its bucket; None while empty."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                low = self.bounds[i - 1] if i else 0.0
+                high = self.bounds[i] if i < len(self.bounds) else self.max
+                return min(low + (high - low) * (rank - seen) / n, self.max)
+            seen += n
+        return self.max
+
+    def reset(self):
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+
+class _StageTimer:
+    # Reused for every call of its stage, so timing allocates nothing; not reentrant
+
+    __slots__ = ('histogram', '_start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+        self._start = 0.0
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.add(time.perf_counter() - self._start)
+        return False
+
+
+class LatencyMonitor:
+    """Latency histograms of one device's pipeline.
+
+    ``stage(name)`` times a block, ``observe(name, seconds)`` records a
+    duration measured elsewhere, and ``end_to_end``/``backlog`` hold the
+    arrival-to-heart-rate latency and the reader's backlog. Each histogram should be
+    written from one thread only (``read`` from the acquisition thread, the
+    rest from the consumer). With ``export`` set to a path ending in ``.json``
+    (otherwise Prometheus text), ``maybe_export`` rewrites that file at most
+    every ``export_interval`` seconds. ``labels`` are added to every
+    Prometheus sample, e.g. ``{'device': 'ttyUSB0'}``.
+    """
+
+    def __init__(self, export=None, export_interval=10.0, labels=None):
+        self.export = export
+        self.export_interval = export_interval
+        self.labels = dict(labels or {})
+        self.stages = {}
+        self._timers = {}
+        self.end_to_end = Histogram()
+        self.backlog = Histogram(BACKLOG_BUCKETS)
+        self.started = time.time()
+        self._last_export = time.monotonic()
+
+    def stage(self, name):
+        timer = self._timers.get(name)
+        if timer is None:
+            timer = self._timers[name] = _StageTimer(self.stages.setdefault(name, Histogram()))
+        return timer
+
+    def observe(self, name, seconds):
+        histogram = self.stages.get(name)
+        if histogram is None:
+            histogram = self.stages[name] = Histogram()
+        histogram.add(seconds)
+
+    def summary(self):
+        """p50, p99 and max per histogram in seconds (bytes or frames for ``backlog``), plus call counts."""
+        histograms = dict(self.stages, end_to_end=self.end_to_end, backlog=self.backlog)
+        return {name: {'count': h.count, 'p50': h.quantile(0.5), 'p99': h.quantile(0.99), 'max': h.max,
+                       'sum': h.sum}
+                for name, h in histograms.items()}
+
+    def to_json(self):
+        def buckets(h):
+            return {'bounds': list(h.bounds), 'counts': list(h.counts), 'count': h.count, 'sum': h.sum,
+                    'max': h.max}
+
+        return {'started': self.started, 'written': time.time(), 'labels': self.labels,
+                'stages': {name: buckets(h) for name, h in self.stages.items()},
+                'end_to_end': buckets(self.end_to_end), 'backlog': buckets(self.backlog),
+                'summary': self.summary()}
+
+    def to_prometheus(self):
+        lines = []
+        self._prometheus_histogram(lines, 'rhythmsync_stage_seconds', "Time per call of each pipeline stage",
+                                   [({'stage': name}, h) for name, h in sorted(self.stages.items())])
+        self._prometheus_histogram(lines, 'rhythmsync_end_to_end_seconds',
+                                   "Time from a sample's arrival to the heart rate computed from it",
+                                   [({}, self.end_to_end)])
+        self._prometheus_histogram(lines, 'rhythmsync_input_backlog',
+                                   "Bytes waiting on the serial port, or frames held for reordering, at each poll",
+                                   [({}, self.backlog)])
+        return '\n'.join(lines) + '\n'
+
+    def _prometheus_histogram(self, lines, metric, help_text, series):
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} histogram")
+        for labels, h in series:
+            labels = dict(self.labels, **labels)
+            cumulative = 0
+            for bound, n in zip(h.bounds + ('+Inf',), h.counts):
+                cumulative += n
+                lines.append(f"{metric}_bucket{_labels(labels, le=_number(bound))} {cumulative}")
+            lines.append(f"{metric}_sum{_labels(labels)} {_number(h.sum)}")
+            lines.append(f"{metric}_count{_labels(labels)} {h.count}")
+
+    def write(self, path=None):
+        # Written to a temporary file and renamed, so a scraper never reads half a file
+        path = path or self.export
+        text = json.dumps(self.to_json(), indent=2) if path.endswith('.json') else self.to_prometheus()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        temporary = f"{path}.tmp"
+        with open(temporary, 'w') as f:
+            f.write(text)
+        os.replace(temporary, path)
+
+    def maybe_export(self):
+        if self.export is None:
+            return False
+        now = time.monotonic()
+        if now - self._last_export < self.export_interval:
+            return False
+        self._last_export = now
+        try:
+            self.write()
+        except OSError:
+            return False  # a full disk or missing permission must not stop acquisition
+        return True
+
+
+def _number(value):
+    return value if isinstance(value, str) else repr(float(value))
+
+
+def _labels(labels, **extra):
+    labels = dict(labels, **extra)
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in labels.items()) + '}'
+
+
+def format_latency(monitor, stages=('read', 'filter', 'swt', 'peaks', 'play_song', 'draw')):
+    # One-line p50/p99 summary in ms for status bars and logs
+    parts = []
+    if monitor.end_to_end.count:
+        parts.append(f"e2e {_ms(monitor.end_to_end.quantile(0.5))}/{_ms(monitor.end_to_end.quantile(0.99))} ms")
+    for name in stages:
+        h = monitor.stages.get(name)
+        if h is not None and h.count:
+            parts.append(f"{name} {_ms(h.quantile(0.5))}/{_ms(h.quantile(0.99))}")
+    if monitor.backlog.count:
+        parts.append(f"backlog max {monitor.backlog.max:.0f}")
+    return "Latency p50/p99: " + (", ".join(parts) if parts else "--")
+
+
+def _ms(seconds):
+    return f"{seconds * 1000:.2f}" if seconds < 0.01 else f"{seconds * 1000:.0f}"
@@ -0,0 +1,99 @@
+from rhythmsync import preload
+from rhythmsync.session import EcgSession
+
+# Imported on a background thread while the serial handshake runs
+HEAVY_MODULES = ('rhythmsync.detectors', 'rhythmsync.filters', 'rhythmsync.heart_rate', 'rhythmsync.wavelets',
+                 'matplotlib.pyplot', 'matplotlib.animation')
+
+
+def run(port, requested_rate=100, protocol='ascii', long_session=True, **settings):
+    """hardware_code/main.py: live ECG and R-peak plots in a matplotlib window, heart rate on stdout.
+
+    With ``long_session`` a memory/artist-count readout is checked once a
+    minute, so an overnight run can be verified to stay flat (tracemalloc slows
+    allocation a little). ``settings`` go to ``EcgSession``.
+    """
+    preload(*HEAVY_MODULES)
+    session = EcgSession.open(port, requested_rate, protocol, **settings)
+
+    import matplotlib.animation as animation
+    import matplotlib.pyplot as plt
+    import numpy as np
+
+    from rhythmsync.hrv import format_hrv
+    from rhythmsync.memory import MemoryMonitor
+    from rhythmsync.quality import format_quality
+
+    window = session.window
+
+    # Visualization setup
+    fig, ax = plt.subplots(2, 1, figsize=(10, 8))
+
+    # Real-time ECG plot
+    ax[0].set_ylim(0, 2000)
+    ax[0].set_xlim(0, window)
+    ecg_line, = ax[0].plot([], [], lw=0.5)
+    ax[0].set_title("Real-Time ECG Signal")
+    ax[0].set_xlabel("Time (samples)")
+    ax[0].set_ylabel("Amplitude")
+    ax[0].grid(True)
+
+    # Processed heart rate plot
+    ax[1].set_xlim(0, window)
+    ax[1].set_ylim(0, 100)
+    processed_line, = ax[1].plot([], [], lw=0.5)
+    # One marker artist for all R peaks, updated in place every frame
+    peak_markers, = ax[1].plot([], [], 'ro')
+    ax[1].set_title("Heart Rate Peaks")
+    ax[1].set_xlabel("Time (samples)")
+    ax[1].grid(True)
+    sample_index = np.arange(window)
+
+    memory_monitor = MemoryMonitor(interval=60.0) if long_session else None
+    memory_text = ax[0].text(0.01, 0.95, "", transform=ax[0].transAxes, va='top', fontsize=8)
+
+    quality_changes = 0
+
+    # Animation update function
+    def update(frame):
+        nonlocal quality_changes
+        heart_rate = session.consume_beats()
+        if heart_rate is not None:
+            # Beat events detected on the device stand in for the SWT detector
+            print(f"Heart Rate: {heart_rate:.2f} BPM (on-device) | {format_hrv(session.hrv.metrics())}")
+        # Take everything the acquisition thread has added since the last frame
+        try:
+            samples, ecg_window, result = session.poll()
+        except ValueError as e:
+            print(f"Error in pywt.swt: {e}")
+            samples, ecg_window, result = (), None, None
+        if session.quality.changes != quality_changes:
+            quality_changes = session.quality.changes
+            print(f"{format_quality(session.quality)}, heart rate {'resumed' if session.quality.ok else 'paused'}")
+        if len(samples):
+            # Heart rate result, None until the SWT engine has a full window
+            if result is not None:
+                heart_rate, processed_signal, Rpeaks = result
+                if processed_signal is not None:
+                    # Update processed signal plot
+                    processed_line.set_data(sample_index[:len(processed_signal)], processed_signal)
+                    peak_markers.set_data(Rpeaks, processed_signal[Rpeaks])
+
+                    print(f"Heart Rate: {heart_rate:.2f} BPM ({session.reader.rate_text()}) | "
+                          f"{format_hrv(session.hrv.metrics())}")
+
+            # Update real-time ECG plot
+            ecg_line.set_data(sample_index[:len(ecg_window)], ecg_window)
+
+        if memory_monitor is not None and memory_monitor.poll(fig):
+            memory_text.set_text(memory_monitor.readout)
+            print(memory_monitor.report())
+
+        return ecg_line, processed_line, peak_markers, memory_text
+
+    session.start()
+    ani = animation.FuncAnimation(fig, update, frames=None, blit=True, interval=10, repeat=False)
+    plt.tight_layout()
+    plt.show()
+    session.close()
+    return ani
@@ -0,0 +1,104 @@
+import time
+import tracemalloc
+from collections import deque
+
+
+def count_artists(fig):
+    # Every artist reachable from the figure (axes, lines, texts, ticks, ...)
+    return len(fig.findobj())
+
+
+class MemoryMonitor:
+    """Periodic tracemalloc and artist-count readout for long sessions.
+
+    ``poll`` is cheap enough to call every frame: it only takes a snapshot every
+    ``interval`` seconds and diffs it against the snapshot taken at startup, so
+    anything that keeps growing over hours shows up in ``top_growth``. Only the
+    last ``history`` readings are kept, so the monitor itself stays bounded.
+    """
+
+    def __init__(self, interval=60.0, top=3, history=120):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.interval = interval
+        self.top = top
+        self._filters = [tracemalloc.Filter(False, tracemalloc.__file__)]
+        self._baseline = tracemalloc.take_snapshot().filter_traces(self._filters)
+        self._last_poll = time.monotonic()
+        self.readout = "memory: waiting for first snapshot"
+        self.top_growth = []
+        self.history = deque(maxlen=history)  # (monotonic time, traced bytes, artist count)
+
+    def poll(self, fig=None):
+        now = time.monotonic()
+        if now - self._last_poll < self.interval:
+            return None
+        self._last_poll = now
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot().filter_traces(self._filters)
+        self.top_growth = [str(stat) for stat in snapshot.compare_to(self._baseline, 'lineno')[:self.top]]
+        artists = count_artists(fig) if fig is not None else 0
+        self.history.append((now, current, artists))
+        self.readout = f"memory: {current / 1e6:.1f} MB (peak {peak / 1e6:.1f} MB), artists: {artists}"
+        return self.readout
+
+    def report(self):
+        return "\n".join([self.readout] + [f"  {line}" for line in self.top_growth])
+
+    def stop(self):
+        tracemalloc.stop()
+
+
+class StageAllocations:
+    """Bytes allocated per call of named pipeline stages, from tracemalloc's peak.
+
+    ``wrap(name, fn)`` returns ``fn`` measured as stage ``name``: the most
+    memory allocated above the starting point at any time during the call
+    (the transient churn the allocator and GC have to deal with) and what is
+    still held after it. Stages can be nested; an outer stage includes its
+    inner ones. tracemalloc has to be tracing (``start``) for anything to be
+    recorded.
+    """
+
+    def __init__(self):
+        self.stages = {}  # name -> [calls, total peak bytes, max peak bytes, total retained bytes]
+        self._stack = []  # [traced bytes at entry, highest traced bytes seen] per active stage
+
+    def start(self):
+        tracemalloc.start()
+
+    def stop(self):
+        tracemalloc.stop()
+
+    def wrap(self, name, fn):
+        def measured(*args, **kwargs):
+            if not tracemalloc.is_tracing():
+                return fn(*args, **kwargs)
+            current, peak = tracemalloc.get_traced_memory()
+            if self._stack:
+                # The reset below would lose the enclosing stage's peak so far
+                self._stack[-1][1] = max(self._stack[-1][1], peak)
+            tracemalloc.reset_peak()
+            self._stack.append([current, current])
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                end, peak = tracemalloc.get_traced_memory()
+                start, seen = self._stack.pop()
+                highest = max(seen, peak)
+                if self._stack:
+                    self._stack[-1][1] = max(self._stack[-1][1], highest)
+                stage = self.stages.setdefault(name, [0, 0, 0, 0])
+                stage[0] += 1
+                stage[1] += highest - start
+                stage[2] = max(stage[2], highest - start)
+                stage[3] += end - start
+
+        return measured
+
+    def report(self):
+        return {name: {'calls': calls,
+                       'mean_peak_bytes': total / calls,
+                       'max_peak_bytes': largest,
+                       'mean_retained_bytes': retained / calls}
+                for name, (calls, total, largest, retained) in self.stages.items()}
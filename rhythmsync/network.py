@@ -0,0 +1,515 @@
+"""ECG over the network: UDP datagrams from ESP32 sensors instead of a USB cable.
+
+ECG_code.ino built with UDP_STREAM batches its binary frames (see
+``rhythmsync.protocol``) into datagrams behind a short header:
+
+    "RSYN" | version u8 | sample rate u16 | id length u8 | device id | frames...
+
+One ``UdpReceiver`` socket serves any number of senders. Frames from each
+sender are put back in sequence order, loss, late and duplicate frames are
+counted, and the samples feed an ``EcgSession`` per sender through a
+``NetworkReader``. ``send`` is a stand-in for the firmware, for trying it on
+loopback without hardware:
+
+    python -m rhythmsync.network receive --port 5005
+    python -m rhythmsync.network send --devices 4 --loss 0.02 --reorder 0.05
+"""
+import argparse
+import logging
+import os
+import queue
+import random
+import socket
+import struct
+import sys
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from rhythmsync.latency import no_timing
+from rhythmsync.protocol import LEAD_OFF, encode_frame, split_frames
+
+MAGIC = b'RSYN'
+VERSION = 1
+DATAGRAM = struct.Struct('<4sBHB')
+DEFAULT_PORT = 5005
+
+log = logging.getLogger('rhythmsync.network')
+
+
+def encode_datagram(device_id, rate, frames):
+    device_id = device_id.encode('ascii')
+    return DATAGRAM.pack(MAGIC, VERSION, int(rate), len(device_id)) + device_id + b''.join(frames)
+
+
+def parse_datagram(data):
+    # (device id, sample rate, frame bytes), or None for anything else arriving on the port
+    if len(data) < DATAGRAM.size:
+        return None
+    magic, version, rate, id_length = DATAGRAM.unpack_from(data)
+    if magic != MAGIC or version != VERSION or len(data) < DATAGRAM.size + id_length:
+        return None
+    device_id = data[DATAGRAM.size:DATAGRAM.size + id_length].decode('ascii', 'replace')
+    return device_id, rate, memoryview(data)[DATAGRAM.size + id_length:]
+
+
+class ReorderBuffer:
+    """Puts frames back in 16-bit sequence order.
+
+    A frame that arrives ahead of a gap is held until the gap fills. A gap is
+    declared lost, and the frames after it are released, once more than
+    ``max_hold`` frames are waiting or the oldest has waited ``max_delay``
+    seconds (see ``expire``). With ``fill``, ``fill(count, previous)`` is
+    released in place of the ``count`` lost frames, ``previous`` being the
+    last item released before them. A frame behind the released sequence is
+    a duplicate if it was released already, otherwise it is dropped as late.
+    ``max_hold`` late frames in a row, or a jump of more than ``max_gap``
+    frames, mean the sender restarted, and the sequence is picked up from
+    there without counting the jump as lost.
+    """
+
+    def __init__(self, max_hold=16, max_delay=0.5, max_gap=1024, fill=None):
+        self.max_hold = max_hold
+        self.max_delay = max_delay
+        self.max_gap = max_gap
+        self.fill = fill
+        self.next = None
+        self.held = {}  # seq -> (arrival, item)
+        self.previous = None  # last item released
+        self._released = bytearray(0x10000)  # 1 where the latest frame with that seq was released
+        self.lost = 0
+        self.late = 0
+        self.duplicates = 0
+        self.reordered = 0
+        self.restarts = 0
+        self._late_run = 0
+
+    def push(self, seq, item, now):
+        if self.next is None:
+            self.next = seq
+        ahead = (seq - self.next) & 0xFFFF
+        if ahead >= 0x8000 and self._released[seq]:
+            self.duplicates += 1
+            return []
+        if ahead >= 0x8000:
+            self.late += 1
+            self._late_run += 1
+            if self._late_run < self.max_hold:
+                return []
+        if ahead >= 0x8000 or ahead > self.max_gap:
+            # The sender restarted its sequence; start over from this frame
+            self.restarts += 1
+            self.held.clear()
+            self._released[:] = bytes(len(self._released))
+            self.next = seq
+        self._late_run = 0
+        if seq in self.held:
+            self.duplicates += 1
+            return []
+        if seq == self.next and self.held:
+            self.reordered += 1  # filled a gap that later frames were waiting on
+        self.held[seq] = (now, item)
+        released = self._drain()
+        if len(self.held) > self.max_hold:
+            released += self._skip()
+        return released
+
+    def expire(self, now):
+        released = []
+        while self.held and now - min(arrival for arrival, _ in self.held.values()) >= self.max_delay:
+            released += self._skip()
+        return released
+
+    def _drain(self):
+        released = []
+        while self.next in self.held:
+            self.previous = self.held.pop(self.next)[1]
+            released.append(self.previous)
+            self._released[self.next] = 1
+            self.next = (self.next + 1) & 0xFFFF
+        return released
+
+    def _skip(self):
+        # Give up on the gap before the nearest held frame
+        nearest = min(self.held, key=lambda s: (s - self.next) & 0xFFFF)
+        count = (nearest - self.next) & 0xFFFF
+        self.lost += count
+        released = []
+        if self.fill is not None and count and self.previous is not None:
+            released.append(self.fill(count, self.previous))
+        while self.next != nearest:
+            self._released[self.next] = 0
+            self.next = (self.next + 1) & 0xFFFF
+        return released + self._drain()
+
+
+class NetworkReader:
+    """One network sender as a drop-in for ``SerialReader`` in an ``EcgSession``.
+
+    ``UdpReceiver`` delivers frames from its thread; ``read`` returns the
+    samples released in order since the last call, waiting up to ``timeout``
+    seconds with ``block=True``. ``dropped`` counts lost frames and
+    ``backlog`` the frames held for reordering. A lost frame is released as
+    the last received sample held for a frame's length, so the window keeps
+    its duration; ``gap_samples`` counts those samples. ``lead_off`` is the sender's
+    last reported lead-off state, and ``last_arrival``/``timer`` are as on
+    ``SerialReader``; samples arrive when the reorder buffer releases them.
+    """
+
+    def __init__(self, device_id, rate, max_hold=16, max_delay=0.5, timeout=1.0, rate_interval=1.0):
+        self.device_id = device_id
+        self.rate = rate
+        self.timeout = timeout
+        self.rate_interval = rate_interval
+        self.reorder = ReorderBuffer(max_hold, max_delay, fill=self._fill)
+        self.gap_samples = 0
+        self.beats = deque(maxlen=1024)
+        self.lead_off = None
+        self.lost_beats = 0
+        self.corrupt_frames = 0
+        self.datagrams = 0
+        self.last_seen = time.monotonic()
+        self.last_arrival = None
+        self.timer = no_timing
+        self.ingest_rate = 0.0
+        self._ready = []
+        self._last_beat_seq = None
+        self._condition = threading.Condition()
+        self._window_start = time.monotonic()
+        self._window_samples = 0
+
+    @property
+    def dropped(self):
+        return self.reorder.lost
+
+    @property
+    def backlog(self):
+        return len(self.reorder.held)
+
+    def _fill(self, count, previous):
+        # Hold-last rather than NaN: a NaN would stay in the filters' state for good
+        gap = np.full(count * len(previous), previous[-1] if len(previous) else 0.0)
+        self.gap_samples += len(gap)
+        return gap
+
+    def deliver(self, frames, beats, corrupt, status, now):
+        # Called from the receiver thread with one datagram's frames
+        with self._condition:
+            self.datagrams += 1
+            self.corrupt_frames += corrupt
+            self.last_seen = now
+            if status is not None:
+                self.lead_off = bool(status & LEAD_OFF)
+            for seq, _, samples in frames:
+                self._ready += self.reorder.push(seq, samples, now)
+            for seq, timestamp, amplitude in beats:
+                if self._last_beat_seq is not None:
+                    self.lost_beats += (seq - self._last_beat_seq - 1) & 0xFFFF
+                self._last_beat_seq = seq
+                self.beats.append((timestamp, amplitude))
+            if self._ready:
+                self.last_arrival = now
+                self._condition.notify()
+
+    def expire(self, now):
+        with self._condition:
+            released = self.reorder.expire(now)
+            if released:
+                self._ready += released
+                self.last_arrival = now
+                self._condition.notify()
+
+    def read(self, block=False):
+        with self._condition:
+            if block and not self._ready:
+                self._condition.wait(self.timeout)
+            ready, self._ready = self._ready, []
+        if ready:
+            with self.timer('read'):
+                samples = np.concatenate(ready)
+        else:
+            samples = np.empty(0)
+        self._window_samples += len(samples)
+        now = time.monotonic()
+        if now - self._window_start >= self.rate_interval:
+            self.ingest_rate = self._window_samples / (now - self._window_start)
+            self._window_start = now
+            self._window_samples = 0
+        return samples
+
+    def rate_text(self):
+        r = self.reorder
+        return (f"{self.ingest_rate:.0f} samples/s, {r.lost} lost/{r.late} late/{r.duplicates} duplicate/"
+                f"{r.reordered} reordered/{self.corrupt_frames} bad frames, {self.gap_samples} samples filled")
+
+    def stats(self):
+        r = self.reorder
+        return {'device': self.device_id, 'rate': self.rate, 'datagrams': self.datagrams, 'lost_frames': r.lost,
+                'late_frames': r.late, 'duplicate_frames': r.duplicates, 'reordered_frames': r.reordered,
+                'gap_samples': self.gap_samples, 'restarts': r.restarts, 'corrupt_frames': self.corrupt_frames,
+                'lost_beats': self.lost_beats}
+
+
+class UdpReceiver:
+    """One UDP socket receiving datagrams from any number of senders.
+
+    A ``NetworkReader`` is created for each new device id, and
+    ``on_device(device_id, reader)`` is called for it on a separate
+    ``udp-devices`` thread, so building a session there does not hold up the
+    socket; the reader buffers the device's samples meanwhile. Datagrams
+    that are not RhythmSync datagrams are counted in ``ignored``.
+    """
+
+    def __init__(self, host='0.0.0.0', port=DEFAULT_PORT, on_device=None, max_hold=16, max_delay=0.5,
+                 poll_interval=0.05):
+        self.on_device = on_device
+        self.max_hold = max_hold
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.readers = {}
+        self.ignored = 0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        self.sock.bind((host, port))
+        self.sock.settimeout(poll_interval)
+        self.address = self.sock.getsockname()
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='udp-receiver', daemon=True)
+        self._new_devices = queue.Queue()
+        self._device_thread = threading.Thread(target=self._add_devices, name='udp-devices', daemon=True)
+
+    def start(self):
+        self._device_thread.start()
+        self._thread.start()
+
+    def _add_devices(self):
+        while True:
+            reader = self._new_devices.get()
+            if reader is None:
+                return
+            try:
+                self.on_device(reader.device_id, reader)
+            except Exception:
+                log.exception("Could not add device %s", reader.device_id)
+
+    def _run(self):
+        last_expire = time.monotonic()
+        while not self._stop_event.is_set():
+            try:
+                data, _ = self.sock.recvfrom(65535)
+            except socket.timeout:
+                data = None
+            except OSError:
+                break
+            now = time.monotonic()
+            if data is not None:
+                self._handle(data, now)
+            if now - last_expire >= self.poll_interval:
+                last_expire = now
+                for reader in list(self.readers.values()):
+                    reader.expire(now)
+
+    def _handle(self, data, now):
+        parsed = parse_datagram(data)
+        if parsed is None:
+            self.ignored += 1
+            return
+        device_id, rate, payload = parsed
+        reader = self.readers.get(device_id)
+        if reader is None:
+            reader = self.readers[device_id] = NetworkReader(device_id, rate, self.max_hold, self.max_delay)
+            if self.on_device is not None:
+                self._new_devices.put(reader)
+        elif rate != reader.rate:
+            # The session's filters are built for one rate; frames at another are not usable
+            self.ignored += 1
+            return
+        reader.deliver(*split_frames(payload), now)
+
+    def stop(self, timeout=2.0):
+        self._stop_event.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+        self._new_devices.put(None)
+        if self._device_thread.is_alive():
+            self._device_thread.join(timeout)
+        self.sock.close()
+
+
+class UdpSender:
+    """Stand-in for ECG_code.ino with UDP_STREAM: sends ``samples`` in real time.
+
+    ``loss``, ``reorder`` and ``duplicate`` are per-datagram probabilities of
+    dropping it, holding it back behind the next one, or sending it twice.
+    """
+
+    def __init__(self, address, device_id, samples, rate=100, samples_per_frame=10, frames_per_datagram=5,
+                 loss=0.0, reorder=0.0, duplicate=0.0, speed=1.0, seed=None):
+        self.address = address
+        self.device_id = device_id
+        self.samples = np.asarray(samples)
+        self.rate = int(rate)
+        self.samples_per_frame = samples_per_frame
+        self.frames_per_datagram = frames_per_datagram
+        self.loss = loss
+        self.reorder = reorder
+        self.duplicate = duplicate
+        self.speed = speed
+        self.rng = random.Random(seed)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sent = 0
+        self.lost = 0
+        self._seq = 0
+        self._position = 0
+        self._held = None
+
+    def next_datagram(self):
+        frames = []
+        period_us = 1e6 / self.rate
+        for _ in range(self.frames_per_datagram):
+            index = (self._position + np.arange(self.samples_per_frame)) % len(self.samples)
+            values = np.clip(np.round(self.samples[index]), 0, 4095).astype(np.int64)
+            frames.append(encode_frame(self._seq, int(self._position * period_us), values))
+            self._seq = (self._seq + 1) & 0xFFFF
+            self._position += self.samples_per_frame
+        return encode_datagram(self.device_id, self.rate, frames)
+
+    def send_one(self):
+        datagram = self.next_datagram()
+        if self.rng.random() < self.loss:
+            self.lost += 1
+            return
+        if self._held is None and self.rng.random() < self.reorder:
+            self._held = datagram
+            return
+        copies = 2 if self.rng.random() < self.duplicate else 1
+        for _ in range(copies):
+            self.sock.sendto(datagram, self.address)
+        self.sent += 1
+        if self._held is not None:
+            self.sock.sendto(self._held, self.address)
+            self.sent += 1
+            self._held = None
+
+    def run(self, duration=None, stop_event=None):
+        interval = self.samples_per_frame * self.frames_per_datagram / self.rate / self.speed
+        start = next_send = time.monotonic()
+        while duration is None or time.monotonic() - start < duration:
+            if stop_event is not None and stop_event.is_set():
+                break
+            self.send_one()
+            next_send += interval
+            delay = next_send - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+
+def receive(args):
+    from rhythmsync.ingest import IngestService, format_stats
+    from rhythmsync.session import EcgSession
+
+    service = IngestService({}, args.workers or os.cpu_count(), args.poll)
+
+    def add_device(device_id, reader):
+        record = os.path.join(args.record, device_id.replace(':', '')) if args.record else None
+        session = EcgSession(None, reader.rate, engine=args.engine, swt_hop=args.swt_hop, rules=args.rules,
+                             record=record, reader=reader)
+        service.add_device(device_id, session)
+        log.info("New device %s at %d Hz", device_id, reader.rate)
+
+    receiver = UdpReceiver(args.host, args.port, add_device, args.max_hold, args.max_delay)
+    log.info("Listening on %s:%d", *receiver.address)
+    service.start()
+    receiver.start()
+    deadline = time.monotonic() + args.duration if args.duration is not None else None
+    try:
+        while deadline is None or time.monotonic() < deadline:
+            remaining = deadline - time.monotonic() if deadline is not None else args.interval
+            time.sleep(max(min(args.interval, remaining), 0))
+            if service.devices:
+                log.info("\n%s", format_stats(service.stats()))
+                for reader in list(receiver.readers.values()):
+                    log.info("%s: %s", reader.device_id, reader.rate_text())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        receiver.stop()
+        service.stop()
+    return 0
+
+
+def send(args):
+    from rhythmsync.simulator import load_record, synthetic_ecg
+
+    stop_event = threading.Event()
+    senders = []
+    for i in range(args.devices):
+        if args.record:
+            samples = load_record(args.record, args.rate, args.source_rate)
+        else:
+            samples = synthetic_ecg(args.rate, heart_rate=args.heart_rate + 10 * i,
+                                    seed=None if args.seed is None else args.seed + i)
+        senders.append(UdpSender((args.host, args.port), f"sim-{i}", samples, args.rate,
+                                 frames_per_datagram=args.frames, loss=args.loss, reorder=args.reorder,
+                                 duplicate=args.duplicate, speed=args.speed,
+                                 seed=None if args.seed is None else args.seed + i))
+    threads = [threading.Thread(target=s.run, args=(args.duration, stop_event), daemon=True) for s in senders]
+    for thread in threads:
+        thread.start()
+    log.info("Sending %d devices to %s:%d", len(senders), args.host, args.port)
+    try:
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(0.5)
+    except KeyboardInterrupt:
+        stop_event.set()
+    for sender in senders:
+        log.info("%s: %d datagrams sent, %d dropped on purpose", sender.device_id, sender.sent, sender.lost)
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m rhythmsync.network',
+                                     description="Receive ECG from networked sensors, or simulate them.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    rx = commands.add_parser('receive', help="receive, reorder and analyse datagrams from any number of sensors")
+    rx.add_argument('--host', default='0.0.0.0', help="address to listen on")
+    rx.add_argument('--port', type=int, default=DEFAULT_PORT, help="UDP port")
+    rx.add_argument('--engine', choices=('swt', 'pan-tompkins'), default='swt', help="R-peak detector")
+    rx.add_argument('--swt-hop', type=int, default=100, help="samples between SWT updates")
+    rx.add_argument('--rules', choices=('count', 'rr'), default='count', help="SWT heart-rate rules")
+    rx.add_argument('--workers', type=int, help="DSP threads (default: CPU count)")
+    rx.add_argument('--max-hold', type=int, default=16, help="frames held waiting for a missing one")
+    rx.add_argument('--max-delay', type=float, default=0.5, help="seconds to wait for a missing frame")
+    rx.add_argument('--poll', type=float, default=0.1, help="seconds between dispatches")
+    rx.add_argument('--interval', type=float, default=5.0, help="seconds between status tables")
+    rx.add_argument('--record', metavar='DIR', help="record each device under DIR/<device>")
+    rx.add_argument('--duration', type=float, help="stop after this many seconds")
+
+    tx = commands.add_parser('send', help="stand-in sensors streaming a synthetic ECG or a record")
+    tx.add_argument('--host', default='127.0.0.1', help="receiver address")
+    tx.add_argument('--port', type=int, default=DEFAULT_PORT, help="receiver UDP port")
+    tx.add_argument('--devices', type=int, default=1, help="number of simulated sensors")
+    tx.add_argument('--record', help=".mat record to send (default: synthetic ECG)")
+    tx.add_argument('--source-rate', type=float, help="native rate of the record in Hz")
+    tx.add_argument('--heart-rate', type=float, default=65.0, help="synthetic heart rate of the first sensor; "
+                                                                   "each next sensor is 10 BPM faster")
+    tx.add_argument('--rate', type=int, default=100, help="sampling rate in Hz")
+    tx.add_argument('--frames', type=int, default=5, help="10-sample frames per datagram")
+    tx.add_argument('--loss', type=float, default=0.0, help="probability of dropping a datagram")
+    tx.add_argument('--reorder', type=float, default=0.0, help="probability of delaying a datagram by one")
+    tx.add_argument('--duplicate', type=float, default=0.0, help="probability of sending a datagram twice")
+    tx.add_argument('--speed', type=float, default=1.0, help="playback multiplier")
+    tx.add_argument('--duration', type=float, help="stop after this many seconds")
+    tx.add_argument('--seed', type=int, help="random seed")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s', stream=sys.stdout)
+    return receive(args) if args.command == 'receive' else send(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
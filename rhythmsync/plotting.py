@@ -0,0 +1,102 @@
+import time
+
+import numpy as np
+
+
+class LivePlotRenderer:
+    """Redraws the live ECG and processed-signal axes by updating existing artists.
+
+    ``set_ecg``/``set_processed`` only hand the latest arrays to the line artists
+    created at startup, and all R peaks share a single marker artist. ``draw``
+    renders at most ``fps`` times a second by restoring the cached axes
+    backgrounds and blitting the animated artists. A full ``canvas.draw()`` only
+    happens on the first frame, after a resize, or on a y-rescale of the
+    processed axes: it at least doubles, with 50% headroom over the signal,
+    when the signal outgrows it, and shrinks only once the signal has stayed
+    below a quarter of it for ``shrink_after`` seconds.
+    ``clock`` supplies the time in seconds used for that
+    throttling; replays and benchmarks can pass a simulated one.
+    """
+
+    def __init__(self, canvas, ecg_ax, ecg_line, processed_ax, processed_line, window, fps=30,
+                 clock=time.monotonic, shrink_after=3.0):
+        self.canvas = canvas
+        self.ecg_ax = ecg_ax
+        self.processed_ax = processed_ax
+        self.ecg_line = ecg_line
+        self.processed_line = processed_line
+        self.peak_markers, = processed_ax.plot([], [], 'ro')
+        for artist in (ecg_line, processed_line, self.peak_markers):
+            artist.set_animated(True)
+        self._x = np.arange(window, dtype=np.float64)  # shared x data for both lines
+        self.frame_interval = 1.0 / fps
+        self.clock = clock
+        self.frames = 0
+        self._last_draw = 0.0
+        self._dirty = True
+        self._backgrounds = None
+        self.shrink_after = shrink_after
+        self.rescales = 0
+        self._small_since = None  # when the signal dropped far below the y-range
+        self._small_peak = 0.0  # largest value since then
+        canvas.mpl_connect('draw_event', self._on_draw)
+
+    def set_ecg(self, y):
+        self.ecg_line.set_data(self._x[:len(y)], y)
+        self._dirty = True
+
+    def set_processed(self, y, peaks):
+        self.processed_line.set_data(self._x[:len(y)], y)
+        self.peak_markers.set_data(peaks, y[peaks])
+        self._dirty = True
+        if not len(y):
+            return
+        # A rescale needs a full redraw, so the range grows with headroom and shrinks reluctantly
+        peak = float(y.max())
+        if not peak > 0:
+            return  # an all-zero (or NaN) window has no range to fit
+        _, current = self.processed_ax.get_ylim()
+        if peak > current:
+            self._rescale(max(peak * 1.5, current * 2))
+        elif peak < 0.25 * current:
+            now = self.clock()
+            if self._small_since is None:
+                self._small_since, self._small_peak = now, peak
+            self._small_peak = max(self._small_peak, peak)
+            if now - self._small_since >= self.shrink_after:
+                self._rescale(self._small_peak * 1.5)
+        else:
+            self._small_since = None
+
+    def _rescale(self, top):
+        self.processed_ax.set_ylim(0, top)
+        self._backgrounds = None
+        self._small_since = None
+        self.rescales += 1
+
+    def draw(self, force=False):
+        now = self.clock()
+        if not self._dirty or (not force and now - self._last_draw < self.frame_interval):
+            return False
+        if self._backgrounds is None:
+            self.canvas.draw()  # _on_draw caches the new backgrounds
+        else:
+            for background in self._backgrounds:
+                self.canvas.restore_region(background)
+            self._draw_artists()
+            self.canvas.blit(self.ecg_ax.bbox)
+            self.canvas.blit(self.processed_ax.bbox)
+        self._last_draw = now
+        self._dirty = False
+        self.frames += 1
+        return True
+
+    def _on_draw(self, event):
+        # Called after every full redraw (first frame, resize, rescale)
+        self._backgrounds = [self.canvas.copy_from_bbox(ax.bbox) for ax in (self.ecg_ax, self.processed_ax)]
+        self._draw_artists()
+
+    def _draw_artists(self):
+        self.ecg_ax.draw_artist(self.ecg_line)
+        self.processed_ax.draw_artist(self.processed_line)
+        self.processed_ax.draw_artist(self.peak_markers)
@@ -0,0 +1,271 @@
+import binascii
+import re
+import struct
+
+import numpy as np
+
+# Binary frame sent by ECG_code.ino when built with BINARY_FRAMES:
+#   A5 5A | seq u16 | first-sample time u32 (micros) | n u8 | n packed 12-bit samples | CRC16
+# Multi-byte fields are little-endian. The CRC is CRC-16/CCITT-FALSE over everything
+# between the sync word and the CRC itself.
+#
+# In STREAM_BEATS/STREAM_BOTH mode the sketch also sends beat events detected on the device:
+#   A5 5B | beat seq u16 | R-peak time u32 (micros) | amplitude u16 | CRC16
+#
+# The AD8232's lead-off state is sent when it changes, and every second while leads are off:
+#   A5 5C | flags u8 (bit 0: leads off) | CRC16
+SYNC = b'\xa5\x5a'
+BEAT_SYNC = b'\xa5\x5b'
+STATUS_SYNC = b'\xa5\x5c'
+ANY_SYNC = re.compile(b'|'.join(re.escape(sync) for sync in (SYNC, BEAT_SYNC, STATUS_SYNC)))
+HEADER = struct.Struct('<HIB')
+BEAT = struct.Struct('<HIH')
+STATUS = struct.Struct('<B')
+LEAD_OFF = 0x01
+CRC_SIZE = 2
+MAX_SAMPLES_PER_FRAME = 64
+
+
+def payload_size(n):
+    return (n * 3 + 1) // 2
+
+
+def pack12(samples):
+    # Two 12-bit samples per three bytes: lo(a), hi(a) | lo(b) << 4, hi(b)
+    samples = np.asarray(samples, dtype=np.uint16) & 0x0FFF
+    n = len(samples)
+    if n % 2:
+        samples = np.append(samples, 0)
+    a, b = samples[0::2], samples[1::2]
+    packed = np.empty((len(a), 3), dtype=np.uint8)
+    packed[:, 0] = a & 0xFF
+    packed[:, 1] = (a >> 8) | ((b & 0x0F) << 4)
+    packed[:, 2] = b >> 4
+    return packed.tobytes()[:payload_size(n)]
+
+
+def unpack12(payload):
+    # Inverse of pack12 for a payload padded to a multiple of three bytes
+    triples = np.frombuffer(payload, dtype=np.uint8).reshape(-1, 3).astype(np.uint16)
+    out = np.empty(2 * len(triples), dtype=np.float64)
+    out[0::2] = triples[:, 0] | ((triples[:, 1] & 0x0F) << 8)
+    out[1::2] = (triples[:, 1] >> 4) | (triples[:, 2] << 4)
+    return out
+
+
+def encode_frame(seq, timestamp_us, samples):
+    body = HEADER.pack(seq & 0xFFFF, timestamp_us & 0xFFFFFFFF, len(samples)) + pack12(samples)
+    return SYNC + body + struct.pack('<H', binascii.crc_hqx(body, 0xFFFF))
+
+
+def encode_beat(seq, timestamp_us, amplitude):
+    body = BEAT.pack(seq & 0xFFFF, timestamp_us & 0xFFFFFFFF, int(amplitude) & 0xFFFF)
+    return BEAT_SYNC + body + struct.pack('<H', binascii.crc_hqx(body, 0xFFFF))
+
+
+def encode_status(flags):
+    body = STATUS.pack(flags & 0xFF)
+    return STATUS_SYNC + body + struct.pack('<H', binascii.crc_hqx(body, 0xFFFF))
+
+
+def split_frames(data):
+    """Parse a buffer of whole frames, e.g. one UDP datagram, without any stream state.
+
+    Returns ``(frames, beats, corrupt, status)``: ``frames`` as ``(seq,
+    timestamp_us, samples)``, ``beats`` as ``(seq, timestamp_us, amplitude)``,
+    the number of frames whose length or CRC was wrong, and the flags of the
+    last status frame (``None`` without one). Parsing stops at the first bad
+    frame, since its length can't be trusted to find the next one.
+    """
+    frames = []
+    beats = []
+    status = None
+    pos = 0
+    while pos + len(SYNC) <= len(data):
+        sync = data[pos:pos + len(SYNC)]
+        body_start = pos + len(SYNC)
+        if sync == BEAT_SYNC:
+            crc_start = body_start + BEAT.size
+        elif sync == STATUS_SYNC:
+            crc_start = body_start + STATUS.size
+        elif sync == SYNC and len(data) >= body_start + HEADER.size:
+            n = data[body_start + HEADER.size - 1]
+            crc_start = body_start + HEADER.size + payload_size(n)
+            if not 0 < n <= MAX_SAMPLES_PER_FRAME:
+                return frames, beats, 1, status
+        else:
+            return frames, beats, 1, status
+        end = crc_start + CRC_SIZE
+        if end > len(data) or not FrameDecoder._crc_ok(data, body_start, crc_start):
+            return frames, beats, 1, status
+        if sync == BEAT_SYNC:
+            beats.append(BEAT.unpack_from(data, body_start))
+        elif sync == STATUS_SYNC:
+            status, = STATUS.unpack_from(data, body_start)
+        else:
+            seq, timestamp, n = HEADER.unpack_from(data, body_start)
+            payload = bytes(data[body_start + HEADER.size:crc_start])
+            frames.append((seq, timestamp, unpack12(payload + b'\x00' * (-len(payload) % 3))[:n]))
+        pos = end
+    return frames, beats, 0, status
+
+
+class FrameDecoder:
+    """Incremental decoder for the sketch's binary frames.
+
+    ``feed`` accepts arbitrary byte chunks and returns the samples of every complete,
+    CRC-valid frame. Bytes outside frames (e.g. the startup banner) are skipped,
+    corrupt frames are counted and resynchronised past, and sequence gaps are
+    counted as lost frames. Frame timestamps give the real sample period and its
+    jitter. Beat frames are collected in ``beats`` as ``(timestamp_us, amplitude)``
+    for the caller to drain. ``lead_off`` is the last reported lead-off state,
+    ``None`` until a status frame arrives.
+    """
+
+    def __init__(self, max_samples=MAX_SAMPLES_PER_FRAME):
+        self.max_samples = max_samples
+        self._buffer = bytearray()
+        self.frames = 0
+        self.corrupt_frames = 0
+        self.lost_frames = 0
+        self.skipped_bytes = 0
+        self.beats = []
+        self.lost_beats = 0
+        self.lead_off = None
+        self._last_beat_seq = None
+        self._last_seq = None
+        self._last_timestamp = None
+        self._last_count = 0
+        # Welford running stats of the per-sample period derived from frame timestamps
+        self._periods = 0
+        self._period_mean = 0.0
+        self._period_m2 = 0.0
+
+    def feed(self, data):
+        buf = self._buffer
+        buf += data
+        payloads = []
+        counts = []
+        pos = 0
+        while True:
+            match = ANY_SYNC.search(buf, pos)
+            if match is None:
+                # Keep a trailing first sync byte, it may complete on the next read
+                keep = 1 if buf.endswith(SYNC[:1]) else 0
+                self.skipped_bytes += len(buf) - pos - keep
+                pos = len(buf) - keep
+                break
+            start = match.start()
+            self.skipped_bytes += start - pos
+            body_start = start + len(SYNC)
+            if buf[start + 1] == STATUS_SYNC[1]:
+                end = body_start + STATUS.size + CRC_SIZE
+                if len(buf) < end:
+                    pos = start
+                    break
+                if not self._crc_ok(buf, body_start, end - CRC_SIZE):
+                    self.corrupt_frames += 1
+                    pos = start + 1
+                    continue
+                self.lead_off = bool(buf[body_start] & LEAD_OFF)
+                pos = end
+                continue
+            if buf[start + 1] == BEAT_SYNC[1]:
+                end = body_start + BEAT.size + CRC_SIZE
+                if len(buf) < end:
+                    pos = start
+                    break
+                if not self._crc_ok(buf, body_start, end - CRC_SIZE):
+                    self.corrupt_frames += 1
+                    pos = start + 1
+                    continue
+                self._track_beat(*BEAT.unpack_from(buf, body_start))
+                pos = end
+                continue
+            if len(buf) - body_start < HEADER.size:
+                pos = start
+                break
+            seq, timestamp, n = HEADER.unpack_from(buf, body_start)
+            if not 0 < n <= self.max_samples:
+                self.corrupt_frames += 1
+                pos = start + 1
+                continue
+            crc_start = body_start + HEADER.size + payload_size(n)
+            end = crc_start + CRC_SIZE
+            if len(buf) < end:
+                pos = start
+                break
+            if not self._crc_ok(buf, body_start, crc_start):
+                self.corrupt_frames += 1
+                pos = start + 1
+                continue
+            payload = bytes(buf[body_start + HEADER.size:crc_start])
+            if len(payload) % 3:
+                payload += b'\x00'
+            payloads.append(payload)
+            counts.append(n)
+            self._track(seq, timestamp, n)
+            pos = end
+        del buf[:pos]
+
+        if not payloads:
+            return np.empty(0)
+        values = unpack12(b''.join(payloads))
+        if any(n % 2 for n in counts):
+            # Drop the padding sample of odd-sized frames
+            keep = np.ones(len(values), dtype=bool)
+            offset = 0
+            for n in counts:
+                if n % 2:
+                    keep[offset + n] = False
+                offset += n + n % 2
+            values = values[keep]
+        return values
+
+    @staticmethod
+    def _crc_ok(buf, body_start, crc_start):
+        crc = buf[crc_start] | (buf[crc_start + 1] << 8)
+        return binascii.crc_hqx(buf[body_start:crc_start], 0xFFFF) == crc
+
+    def _track_beat(self, seq, timestamp, amplitude):
+        if self._last_beat_seq is not None:
+            self.lost_beats += (seq - self._last_beat_seq - 1) & 0xFFFF
+        self._last_beat_seq = seq
+        self.beats.append((timestamp, amplitude))
+
+    def _track(self, seq, timestamp, n):
+        self.frames += 1
+        if self._last_seq is not None:
+            gap = (seq - self._last_seq - 1) & 0xFFFF
+            self.lost_frames += gap
+            if gap == 0:
+                period = ((timestamp - self._last_timestamp) & 0xFFFFFFFF) / self._last_count
+                self._periods += 1
+                delta = period - self._period_mean
+                self._period_mean += delta / self._periods
+                self._period_m2 += delta * (period - self._period_mean)
+        self._last_seq = seq
+        self._last_timestamp = timestamp
+        self._last_count = n
+
+    @property
+    def sample_period_us(self):
+        return self._period_mean
+
+    @property
+    def jitter_us(self):
+        # Standard deviation of the per-frame sample period
+        if self._periods < 2:
+            return 0.0
+        return (self._period_m2 / (self._periods - 1)) ** 0.5
+
+    def stats(self):
+        return {
+            'frames': self.frames,
+            'lost_frames': self.lost_frames,
+            'corrupt_frames': self.corrupt_frames,
+            'skipped_bytes': self.skipped_bytes,
+            'lost_beats': self.lost_beats,
+            'sample_period_us': self.sample_period_us,
+            'jitter_us': self.jitter_us,
+        }
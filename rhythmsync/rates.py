@@ -0,0 +1,24 @@
+import math
+
+# Rates ECG_code.ino can sample at; the pipeline was originally tuned for 100 Hz
+SUPPORTED_RATES = (100, 250, 500, 1000)
+BASE_RATE = 100.0
+WINDOW_SECONDS = 10.0  # 1000 samples at 100 Hz
+BASE_SWT_LEVEL = 3
+BASE_SAVGOL_SECONDS = 0.15  # window_length=15 at 100 Hz
+
+
+def swt_level(fs):
+    # One extra decomposition level per doubling of the rate keeps the same bands
+    return BASE_SWT_LEVEL + max(int(round(math.log2(fs / BASE_RATE))), 0)
+
+
+def window_size(fs, seconds=WINDOW_SECONDS):
+    # pywt.swt needs the length to be a multiple of 2 ** level
+    step = 2 ** swt_level(fs)
+    return int(math.ceil(seconds * fs / step)) * step
+
+
+def savgol_window(fs):
+    # Odd Savitzky-Golay window covering the same duration at any rate
+    return int(round(BASE_SAVGOL_SECONDS * fs)) | 1
@@ -0,0 +1,303 @@
+"""Full-session recording of raw ECG, arrival times, R peaks and heart rate.
+
+A session is a directory of append-only streams, each split into fixed-size
+binary chunks (``samples-000000.bin``, ``samples-000001.bin``, ...) plus an
+``index.json`` describing them. ``SessionRecorder`` writes from its own
+thread; ``RecordedSession`` memory-maps a session, so hours of data can be
+sliced or replayed without reading it all into memory:
+
+    python -m rhythmsync.recorder sessions/20240501-101500 --start 3600 --end 3660 -o minute.csv
+"""
+import argparse
+import csv
+import glob
+import json
+import os
+import queue
+import sys
+import threading
+import time
+
+import numpy as np
+
+STREAMS = {
+    'samples': np.dtype('<f4'),  # raw samples; NaN where samples were lost
+    'arrivals': np.dtype([('sample', '<i8'), ('time', '<f8')]),  # first sample of each read, wall-clock time
+    'peaks': np.dtype('<i8'),  # R-peak sample indices
+    'heart_rate': np.dtype([('sample', '<i8'), ('bpm', '<f8')]),  # sample index at which the heart rate was reported
+}
+DEFAULT_CHUNK_BYTES = 4 << 20
+_CLOSE = ('close', None, None)
+
+
+class ChunkWriter:
+    """One stream of fixed-size records, rotated into a new file every ``chunk_records``."""
+
+    def __init__(self, directory, name, dtype, chunk_records):
+        self.directory = directory
+        self.name = name
+        self.dtype = dtype
+        self.chunk_records = chunk_records
+        self.records = 0
+        self.chunks = 0
+        self._file = None
+
+    def _open_next(self):
+        if self._file is not None:
+            self._file.close()
+        self._file = open(os.path.join(self.directory, f"{self.name}-{self.chunks:06d}.bin"), 'wb')
+        self.chunks += 1
+
+    def write(self, records):
+        records = np.ascontiguousarray(records, dtype=self.dtype)
+        while len(records):
+            if self._file is None or self.records >= self.chunks * self.chunk_records:
+                self._open_next()
+            room = self.chunks * self.chunk_records - self.records
+            self._file.write(records[:room].tobytes())
+            self.records += min(room, len(records))
+            records = records[room:]
+
+    def flush(self):
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def describe(self):
+        return {"dtype": np.lib.format.dtype_to_descr(self.dtype), "chunk_records": self.chunk_records,
+                "chunks": self.chunks, "records": self.records}
+
+
+class SessionRecorder:
+    """Appends a session to ``directory`` on a background writer thread.
+
+    ``add_samples``, ``add_peaks`` and ``add_heart_rate`` only queue their
+    data and may be called from any thread. At most ``max_pending`` items
+    wait for the writer. When it falls behind, new items are dropped and
+    counted in ``dropped``, and lost samples are written as NaN, so sample
+    indices stay aligned. ``index.json`` is rewritten every
+    ``flush_interval`` seconds, so a live session can be read.
+    """
+
+    def __init__(self, directory, sampling_rate, chunk_bytes=DEFAULT_CHUNK_BYTES, max_pending=4096,
+                 flush_interval=1.0):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.sampling_rate = sampling_rate
+        self.started = time.time()
+        self.flush_interval = flush_interval
+        self.writers = {name: ChunkWriter(directory, name, dtype, max(chunk_bytes // dtype.itemsize, 1))
+                        for name, dtype in STREAMS.items()}
+        self.sample_count = 0  # samples handed to add_samples
+        self.dropped = 0
+        self._queue = queue.Queue(max_pending)
+        self._closed = False
+        self._write_index()
+        self._thread = threading.Thread(target=self._run, name='session-recorder', daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def create(cls, root, sampling_rate, **kwargs):
+        # A new timestamped session directory under root
+        return cls(os.path.join(root, time.strftime('%Y%m%d-%H%M%S')), sampling_rate, **kwargs)
+
+    def _put(self, item):
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+
+    def add_samples(self, samples, arrival=None):
+        start = self.sample_count
+        self.sample_count += len(samples)
+        arrival = time.time() if arrival is None else arrival
+        self._put(('samples', start, np.array(samples, dtype=STREAMS['samples'])))
+        self._put(('arrivals', start, np.array([(start, arrival)], dtype=STREAMS['arrivals'])))
+
+    def add_peaks(self, peaks):
+        if len(peaks):
+            self._put(('peaks', None, np.array(peaks, dtype=STREAMS['peaks'])))
+
+    def add_heart_rate(self, bpm, sample=None):
+        sample = self.sample_count if sample is None else sample
+        self._put(('heart_rate', None, np.array([(sample, bpm)], dtype=STREAMS['heart_rate'])))
+
+    def _run(self):
+        samples = self.writers['samples']
+        last_index = time.monotonic()
+        while True:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                item = None
+            if item is not None:
+                name, start, records = item
+                if item is _CLOSE:
+                    name, start, records = 'samples', self.sample_count, ()
+                if name == 'samples' and start > samples.records:
+                    # Batches dropped while the writer was behind; keep later indices aligned
+                    samples.write(np.full(start - samples.records, np.nan, dtype=samples.dtype))
+                if item is _CLOSE:
+                    break
+                self.writers[name].write(records)
+            now = time.monotonic()
+            if item is None or now - last_index >= self.flush_interval:
+                last_index = now
+                for writer in self.writers.values():
+                    writer.flush()
+                self._write_index()
+
+    def _write_index(self, closed=False):
+        index = {"version": 1, "sampling_rate": self.sampling_rate, "started": self.started,
+                 "closed": closed, "dropped": self.dropped,
+                 "streams": {name: writer.describe() for name, writer in self.writers.items()}}
+        path = os.path.join(self.directory, 'index.json')
+        with open(path + '.partial', 'w') as f:
+            json.dump(index, f, indent=1)
+        os.replace(path + '.partial', path)
+
+    def close(self, timeout=5.0):
+        # Writes what is queued, then the final index
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self._queue.put(_CLOSE, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+        for writer in self.writers.values():
+            writer.close()
+        self._write_index(closed=True)
+
+
+class ChunkedArray:
+    """Read-only 1-D view over a stream's memory-mapped chunks.
+
+    Supports ``len``, integer indexing and slicing; a slice only reads the
+    chunks it covers. ``chunks`` yields the memory maps in order.
+    """
+
+    def __init__(self, maps, dtype):
+        self.maps = maps
+        self.dtype = dtype
+        self.offsets = np.cumsum([0] + [len(m) for m in maps])
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def chunks(self):
+        return iter(self.maps)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step != 1:
+                return self[start:stop][::step] if step > 0 else self[:][key]
+            if stop <= start:
+                return np.empty(0, self.dtype)
+            first = np.searchsorted(self.offsets, start, side='right') - 1
+            last = np.searchsorted(self.offsets, stop, side='left')
+            parts = [self.maps[i][max(start - self.offsets[i], 0):stop - self.offsets[i]]
+                     for i in range(first, last)]
+            return parts[0] if len(parts) == 1 else np.concatenate(parts)
+        index = int(key)
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(key)
+        i = np.searchsorted(self.offsets, index, side='right') - 1
+        return self.maps[i][index - self.offsets[i]]
+
+    def __array__(self, dtype=None, copy=None):
+        out = self[:]
+        return out.astype(dtype) if dtype is not None else out
+
+
+class RecordedSession:
+    """A recorded session, memory-mapped. Streams are ``ChunkedArray``s named as in ``STREAMS``.
+
+    Chunks are mapped when the session is opened; a session that is still
+    being recorded can be reopened to see newer data.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, 'index.json')) as f:
+            self.index = json.load(f)
+        self.sampling_rate = self.index["sampling_rate"]
+        self.started = self.index["started"]
+        for name, info in self.index["streams"].items():
+            setattr(self, name, self._open_stream(name, np.lib.format.descr_to_dtype(info["dtype"])))
+
+    def _open_stream(self, name, dtype):
+        # Chunk lengths come from the file sizes, so data written after the last index update is included
+        maps = []
+        for path in sorted(glob.glob(os.path.join(glob.escape(self.directory), f"{name}-*.bin"))):
+            records = os.path.getsize(path) // dtype.itemsize
+            if records:
+                maps.append(np.memmap(path, dtype=dtype, mode='r', shape=(records,)))
+        return ChunkedArray(maps, dtype)
+
+    @property
+    def duration(self):
+        return len(self.samples) / self.sampling_rate
+
+    def window(self, start, end):
+        """Samples, R peaks and heart rates between ``start`` and ``end`` seconds.
+
+        Peak and heart-rate sample indices are relative to the window.
+        """
+        a = max(int(start * self.sampling_rate), 0)
+        b = min(int(end * self.sampling_rate), len(self.samples))
+        peaks = self.peaks[:]
+        heart_rate = self.heart_rate[:]
+        peaks = peaks[(peaks >= a) & (peaks < b)] - a
+        heart_rate = heart_rate[(heart_rate['sample'] >= a) & (heart_rate['sample'] < b)].copy()
+        heart_rate['sample'] -= a
+        return self.samples[a:b], peaks, heart_rate
+
+    def replay(self, block=None):
+        # Sample blocks in order (one second each by default), for feeding a detector or a virtual device
+        block = block or int(self.sampling_rate)
+        for start in range(0, len(self.samples), block):
+            yield self.samples[start:start + block]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m rhythmsync.recorder',
+                                     description="Summarise a recorded session or export part of it.")
+    parser.add_argument('session', help="session directory")
+    parser.add_argument('--start', type=float, default=0.0, help="window start in seconds")
+    parser.add_argument('--end', type=float, help="window end in seconds (default: end of session)")
+    parser.add_argument('-o', '--output', help="write the window's samples as CSV (time, sample, R peak, heart rate)")
+    args = parser.parse_args(argv)
+
+    session = RecordedSession(args.session)
+    end = session.duration if args.end is None else args.end
+    samples, peaks, heart_rate = session.window(args.start, end)
+    lost = int(np.isnan(samples).sum())
+    print(f"{args.session}: {session.duration / 3600:.2f} h at {session.sampling_rate:g} Hz, "
+          f"{len(session.peaks)} R peaks, {len(session.heart_rate)} heart rates, "
+          f"{session.index['dropped']} dropped writes{'' if session.index['closed'] else ' (still recording)'}")
+    print(f"{args.start:g}-{end:g} s: {len(samples)} samples ({lost} lost), {len(peaks)} R peaks")
+    if args.output:
+        is_peak = np.zeros(len(samples), dtype=bool)
+        is_peak[peaks] = True
+        bpm = np.full(len(samples), np.nan)
+        bpm[heart_rate['sample']] = heart_rate['bpm']
+        with open(args.output, 'w', newline='') as f:
+            out = csv.writer(f)
+            out.writerow(['time_s', 'sample', 'r_peak', 'heart_rate'])
+            for i in range(len(samples)):
+                out.writerow([f"{args.start + i / session.sampling_rate:.4f}", samples[i], int(is_peak[i]),
+                              '' if np.isnan(bpm[i]) else f"{bpm[i]:.2f}"])
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
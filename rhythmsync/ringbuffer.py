@@ -0,0 +1,71 @@
+import numpy as np
+
+
+class RingBuffer:
+    """Fixed-size sample ring whose most recent window is always a contiguous view.
+
+    Every sample is written twice (at ``i`` and ``i + size``) so that the latest
+    ``n`` samples can be returned as a slice of the backing array without copying.
+
+    One producer thread may ``append``/``extend`` while one consumer thread calls
+    ``view``/``since``: data is written before ``count`` is published, and a view
+    of ``n`` samples stays intact until the producer writes ``size - n`` more.
+    Size the ring with that headroom in mind.
+    """
+
+    def __init__(self, size, dtype=np.float64):
+        self.size = int(size)
+        self.dtype = np.dtype(dtype)
+        self._data = np.zeros(2 * self.size, dtype=self.dtype)
+        self.count = 0  # total samples written since the last reset
+
+    def __len__(self):
+        return min(self.count, self.size)
+
+    def is_full(self):
+        return self.count >= self.size
+
+    def append(self, value):
+        head = self.count % self.size
+        self._data[head] = value
+        self._data[head + self.size] = value
+        self.count += 1
+
+    def extend(self, values):
+        values = np.asarray(values, dtype=self.dtype).ravel()
+        total = len(values)
+        if total > self.size:
+            values = values[-self.size:]
+        n = len(values)
+        head = (self.count + total - n) % self.size
+        first = min(n, self.size - head)
+        rest = n - first
+        self._data[head:head + first] = values[:first]
+        self._data[head + self.size:head + self.size + first] = values[:first]
+        self._data[:rest] = values[first:]
+        self._data[self.size:self.size + rest] = values[first:]
+        self.count += total
+
+    def rewind(self, n):
+        # Forget the last n samples so they can be rewritten (used for provisional output)
+        self.count -= min(int(n), len(self))
+
+    def view(self, n=None, count=None):
+        # Read-only view of the latest n samples (as of `count`), oldest first
+        count = self.count if count is None else count
+        available = min(count, self.size)
+        n = available if n is None else min(int(n), available)
+        end = count % self.size + self.size
+        window = self._data[end - n:end]
+        window.flags.writeable = False
+        return window
+
+    def since(self, cursor):
+        # Samples written after `cursor` (a previous `count`) and the new cursor.
+        # If the reader fell more than `size` behind, only the latest `size` are returned.
+        count = self.count
+        return self.view(count - cursor, count=count), count
+
+    def reset(self):
+        self._data[:] = 0
+        self.count = 0
@@ -0,0 +1,262 @@
+import functools
+import time
+
+import numpy as np
+
+from rhythmsync.acquisition import AcquisitionThread, SerialReader, negotiate_sampling_rate
+from rhythmsync.beats import BeatAggregator
+from rhythmsync.hrv import RRStore
+from rhythmsync.latency import LatencyMonitor
+from rhythmsync.quality import SignalQuality
+from rhythmsync.rates import savgol_window, swt_level, window_size
+from rhythmsync.ringbuffer import RingBuffer
+
+
+class EcgSession:
+    """One ECG device: serial reader, acquisition thread, streaming filter and detector.
+
+    ``engine`` is ``'swt'`` (``swt_hop`` > 1 reruns the SWT every ``swt_hop``
+    samples, 1 reruns the whole window each update) or ``'pan-tompkins'``;
+    ``rules`` names the SWT R-peak rule set in ``rhythmsync.heart_rate.RULES``.
+    ``poll`` is the consumer side of the apps' update loop. Nothing is read
+    until ``start``, or on each ``pump`` when no acquisition thread is used.
+    With ``record`` set to a directory, raw samples, R peaks and heart rates
+    are recorded to a new session under it (see ``rhythmsync.recorder``).
+    ``reader`` replaces the serial reader with another source of the same
+    interface, e.g. ``rhythmsync.network.NetworkReader``; ``ser`` is then None.
+    With ``telemetry`` set to a bulk-update URL, heart rate, RR interval and
+    dropped lines are published there (see ``rhythmsync.telemetry``).
+    Every R peak, from the host detector or the device, goes into ``hrv``,
+    an ``rhythmsync.hrv.RRStore`` holding the session's RR intervals.
+    ``quality`` (``rhythmsync.quality.SignalQuality``) checks the raw signal and
+    the device's lead-off state before the filters; with ``gate`` set, the
+    filter and detector are skipped while it fails and start over once the
+    signal is usable again, and device beats are discarded meanwhile.
+    ``precision`` (``'float64'`` or ``'float32'``) is the dtype of the filter
+    and detector; their work buffers are preallocated and reused, so ``y`` in
+    a result is only valid until the next ``poll``.
+    ``latency`` (``rhythmsync.latency.LatencyMonitor``) times the read, quality,
+    filter, SWT and peak-search stages, the time from a sample's arrival to
+    the heart rate computed from it, and the reader's backlog; with
+    ``latency_export`` set to a path, it is written there every few seconds.
+    """
+
+    def __init__(self, ser, sampling_rate, protocol='ascii', mode='raw', engine='swt', swt_hop=25,
+                 rules='count', cutoff=20, record=None, reader=None, telemetry=None, telemetry_key=None,
+                 gate=True, precision='float64', latency_export=None):
+        self.ser = ser
+        self.sampling_rate = sampling_rate
+        self.mode = mode
+        # Drain everything waiting on each tick so a slow redraw can't build up a backlog
+        self.reader = reader if reader is not None else SerialReader(ser, drain=True, protocol=protocol)
+        self.latency = LatencyMonitor(latency_export)
+        self.reader.timer = self.latency.stage
+        self.window = window_size(sampling_rate)  # ~10 s of samples, sized for the SWT level
+        # Raw samples are written by the acquisition thread; the ring is larger than the
+        # analysis window so the UI can hold a view while new samples keep arriving
+        self.ring = RingBuffer(4 * self.window)
+        self.cursor = 0
+        self.recorder = None
+        if record:
+            from rhythmsync.recorder import SessionRecorder
+
+            self.recorder = SessionRecorder.create(record, sampling_rate)
+        self.telemetry = None
+        if telemetry:
+            from rhythmsync.telemetry import TelemetryPublisher, default_spill_dir
+
+            # One spill file per device, as several sessions can publish to the same URL
+            name = getattr(self.reader, 'device_id', None) or getattr(ser, 'port', None)
+            self.telemetry = TelemetryPublisher(telemetry, telemetry_key, spill_dir=default_spill_dir(), name=name)
+        self.hrv = RRStore()
+        self.quality = SignalQuality(sampling_rate)
+        self.gate = gate
+        self._stale = False  # samples were skipped; the filter and detector need a fresh start
+        self._last_peak = -1  # last R peak taken; overlapping windows report it again
+        self._detector_start = 0  # session sample index of the detector's first sample
+        self._last_beat_us = None  # device clock of the last beat event, unwrapped into _beat_time
+        self._beat_time = 0.0
+        self.acquisition = AcquisitionThread(self.reader, self.ring,
+                                             self.recorder.add_samples if self.recorder else None)
+        # In 'beats'/'both' mode the sketch detects R peaks itself and the host only verifies them
+        self.beat_aggregator = BeatAggregator()
+        self.engine = engine
+        self.swt_hop = swt_hop
+        self.rules = rules
+        self.cutoff = cutoff
+        self.dtype = np.dtype(precision)
+        self._build_pipeline()
+
+    def _build_pipeline(self):
+        # scipy and pywt are only needed from here on
+        from rhythmsync.detectors import HopSwtDetector, PanTompkinsDetector, SwtDetector
+        from rhythmsync.filters import StreamingFilter
+        from rhythmsync.heart_rate import RULES, compute_heart_rate
+        from rhythmsync.wavelets import SwtBandEnergy
+
+        # Filter state persists across ticks so each tick only filters the new samples
+        self.filter = StreamingFilter(self.cutoff, self.sampling_rate,
+                                      window_length=savgol_window(self.sampling_rate), polyorder=3,
+                                      size=self.window, dtype=self.dtype)
+        timer = self.latency.stage
+
+        # All engines return (heart_rate, y, Rpeaks); the SWT ones need a full window first
+        if self.engine == 'pan-tompkins':
+            self.detector = PanTompkinsDetector(self.sampling_rate, self.window, dtype=self.dtype, timer=timer)
+        elif self.swt_hop > 1:
+            self.detector = HopSwtDetector(self.filter, self.sampling_rate, self.window, self.swt_hop,
+                                           *RULES[self.rules], dtype=self.dtype, timer=timer)
+        else:
+            band_energy = SwtBandEnergy(swt_level(self.sampling_rate), dtype=self.dtype)
+            self.detector = SwtDetector(functools.partial(compute_heart_rate, rules=self.rules,
+                                                          band_energy=band_energy, timer=timer),
+                                        self.filter, self.sampling_rate, self.window, timer=timer)
+        self._stale = False
+
+    @classmethod
+    def open(cls, port, requested_rate=100, protocol='ascii', baudrate=115200, **settings):
+        import serial
+
+        ser = serial.Serial(port, baudrate, timeout=1)
+        ser.flush()
+        # The sketch reports its rate and output format; firmware without the handshake stays at 100 Hz
+        sampling_rate, device_protocol, mode = negotiate_sampling_rate(ser, requested_rate)
+        return cls(ser, sampling_rate, device_protocol or protocol, mode, **settings)
+
+    @property
+    def started(self):
+        return self.acquisition.ident is not None
+
+    @property
+    def error(self):
+        return self.acquisition.error
+
+    def start(self):
+        # The reader thread only starts once; later calls are no-ops
+        if not self.started:
+            self.acquisition.start()
+
+    def pump(self):
+        # Read what is waiting on the port straight into the ring, for single-threaded
+        # callers that poll instead of running the acquisition thread
+        samples = self.reader.read()
+        if len(samples):
+            self.ring.extend(samples)
+            if self.recorder is not None:
+                self.recorder.add_samples(samples)
+        return len(samples)
+
+    def poll(self):
+        """Take the samples added since the last call and return ``(samples, ecg_window, result)``.
+
+        ``ecg_window`` is a view of the latest raw window (``None`` when nothing
+        arrived) and ``result`` is the detector's ``(heart_rate, y, Rpeaks)``,
+        or ``None`` between updates, while the signal quality gate is closed or
+        when the device detects beats itself.
+        """
+        # Taken before the samples, so a read landing in between can only overstate the latency
+        arrival = self.reader.last_arrival
+        samples, self.cursor = self.ring.since(self.cursor)
+        self.latency.maybe_export()
+        if not len(samples):
+            return samples, None, None
+        self.latency.backlog.add(self.reader.backlog)
+        ecg_window = self.ring.view(self.window)
+        with self.latency.stage('quality'):
+            usable = self.quality.update(self.ring, self.cursor, self.reader.lead_off)
+        if not usable and self.gate:
+            # The window is not worth filtering; the detector would only report noise as beats
+            self._stale = True
+            if self.telemetry is not None:
+                self.telemetry.publish(None, None, self.reader.dropped, quality=0.0)
+            return samples, ecg_window, None
+        if self._stale and self.mode == 'raw':
+            self._build_pipeline()
+            self._detector_start = self.cursor - len(samples)
+        result = None
+        if self.mode == 'raw':
+            with self.latency.stage('detector'):
+                result = self.detector.push(samples)
+        if result is not None and result[1] is not None:
+            heart_rate, y, Rpeaks = result
+            peaks = self._new_peaks(y, Rpeaks)
+            for peak in peaks:
+                self.hrv.add_beat(peak / self.sampling_rate)
+            if self.recorder is not None:
+                self.recorder.add_peaks(peaks)
+                self.recorder.add_heart_rate(heart_rate, self.cursor)
+            if self.telemetry is not None:
+                rr = (Rpeaks[-1] - Rpeaks[-2]) / self.sampling_rate if len(Rpeaks) > 1 else None
+                self.telemetry.publish(heart_rate, rr, self.reader.dropped, quality=self.quality.score)
+            if arrival is not None:
+                self.latency.end_to_end.add(time.monotonic() - arrival)
+        return samples, ecg_window, result
+
+    def _new_peaks(self, y, Rpeaks):
+        # The squared detail coefficients have a lobe on each side of the R wave, and the peak
+        # can move between them from one window to the next; that would show up as RR jitter,
+        # so each peak is moved to the largest raw sample within 150 ms
+        raw = self.ring.view(len(y), count=self.cursor)
+        radius = max(int(0.15 * self.sampling_rate), 1)
+        confirmed = getattr(self.detector, 'new_peaks', None)
+        if confirmed is not None:
+            # HopSwtDetector reports each peak once, when it has settled
+            local = np.array([self._detector_start + peak for peak in confirmed], dtype=np.int64)
+            confirmed.clear()
+            local += len(raw) - self.cursor
+            local = local[local >= 0]
+            gap = 0
+        else:
+            # The detector's window ends at the newest sample, so its peaks map back to sample indices.
+            # Peaks within half a second of either end of the window are distorted by the SWT's
+            # periodic extension; those near the end are taken from a later window instead
+            edge = int(0.5 * self.sampling_rate)
+            local = np.asarray(Rpeaks, dtype=np.int64) + len(raw) - len(y)
+            local = local[(local >= edge) & (local < len(raw) - edge)]
+            gap = int(0.25 * self.sampling_rate)  # the same peak again from an overlapping window
+        for k, i in enumerate(local):
+            lo, hi = max(i - radius, 0), min(i + radius + 1, len(raw))
+            if lo < hi:
+                local[k] = lo + int(np.argmax(raw[lo:hi]))
+        peaks = self.cursor - len(raw) + local
+        new = peaks[peaks > self._last_peak + gap]
+        if len(new):
+            self._last_peak = int(new[-1])
+        return new
+
+    def consume_beats(self):
+        # Feed the device's beat events to the aggregator; its heart rate, or None without events
+        if not self.reader.beats:
+            return None
+        if self.gate and (self.reader.lead_off or not self.quality.ok):
+            self.reader.beats.clear()
+            return None
+        while self.reader.beats:
+            timestamp_us, amplitude = self.reader.beats.popleft()
+            if self.beat_aggregator.add(timestamp_us, amplitude):
+                if self._last_beat_us is not None:
+                    self._beat_time += ((timestamp_us - self._last_beat_us) & 0xFFFFFFFF) / 1e6
+                self._last_beat_us = timestamp_us
+                self.hrv.add_beat(self._beat_time)
+        heart_rate = self.beat_aggregator.heart_rate
+        if self.recorder is not None and heart_rate:
+            self.recorder.add_heart_rate(heart_rate)
+        if self.telemetry is not None and heart_rate:
+            rr_intervals = self.beat_aggregator.rr_intervals
+            self.telemetry.publish(heart_rate, rr_intervals[-1] if rr_intervals else None, self.reader.dropped,
+                                   quality=self.quality.score)
+        return heart_rate
+
+    def close(self):
+        self.acquisition.stop()
+        if self.ser:
+            self.ser.close()
+        if self.recorder is not None:
+            self.recorder.close()
+        if self.telemetry is not None:
+            self.telemetry.close()
+        if self.latency.export:
+            try:
+                self.latency.write()
+            except OSError:
+                pass
@@ -0,0 +1,368 @@
+"""Virtual ECG device on a pseudo-terminal, for running the apps without the ESP32 rig.
+
+Replays an ``ECG Data`` record (or a synthetic ECG) in ECG_code.ino's output
+format and answers the ``RATE``/``HELLO`` handshake like the sketch does.
+Playback can run faster than real time, and noise, dropped lines, garbage
+lines and lead-off intervals can be injected to soak-test the acquisition path:
+
+    python -m rhythmsync.simulator --record "ECG Data/100m_MIT_BIH.mat" --speed 10 --garbage 0.001 --lead-off 20-30
+    RHYTHMSYNC_PORT=/dev/pts/5 python app.py
+
+POSIX only (``os.openpty``).
+"""
+import argparse
+import os
+import select
+import sys
+import threading
+import time
+import tty
+
+import numpy as np
+from scipy.io import loadmat
+from scipy.signal import resample_poly
+
+from rhythmsync.protocol import LEAD_OFF, encode_frame, encode_status
+from rhythmsync.rates import SUPPORTED_RATES
+
+ADC_MAX = 4095  # ESP32 analogRead is 12-bit
+ADC_CENTER = 2048
+SAMPLES_PER_FRAME = 10  # as in ECG_code.ino
+BANNER = b'AD8232 ECG Sensor Test\r\n'
+
+
+def to_adc(signal, span=1000.0):
+    # Records come in different units; centre them and stretch the range to AD8232-like counts
+    signal = np.asarray(signal, dtype=np.float64)
+    low, high = np.percentile(signal, [0.5, 99.5])
+    scale = span / (high - low) if high > low else 1.0
+    return ADC_CENTER + (signal - np.median(signal)) * scale
+
+
+def load_record(path, rate, source_rate=None, key='val'):
+    signal = loadmat(path)[key].astype(np.float64).ravel()
+    if source_rate and int(source_rate) != int(rate):
+        signal = resample_poly(signal, int(rate), int(source_rate))
+    return to_adc(signal)
+
+
+def load_session(path, rate):
+    # A recorded session is already in ADC counts; lost samples (NaN) are held at the centre
+    from rhythmsync.recorder import RecordedSession
+
+    session = RecordedSession(path)
+    signal = np.nan_to_num(np.asarray(session.samples[:], dtype=np.float64), nan=ADC_CENTER)
+    if int(session.sampling_rate) != int(rate):
+        signal = resample_poly(signal, int(rate), int(session.sampling_rate))
+    return signal
+
+
+def synthetic_ecg(rate, seconds=60.0, heart_rate=72.0, rr_jitter=0.03, seed=None):
+    """Sum-of-Gaussians P-QRS-T beats with a little RR variability, in ADC counts."""
+    rng = np.random.default_rng(seed)
+    # (offset from R in seconds, width in seconds, amplitude in counts)
+    waves = ((-0.2, 0.025, 60.0), (-0.025, 0.01, -80.0), (0.0, 0.012, 700.0),
+             (0.03, 0.01, -150.0), (0.25, 0.04, 150.0))
+    n = int(seconds * rate)
+    t = np.arange(n) / rate
+    out = np.full(n, float(ADC_CENTER))
+    rr = 60.0 / heart_rate
+    beat = 0.5
+    while beat < seconds + 0.5:
+        for offset, width, amplitude in waves:
+            out += amplitude * np.exp(-0.5 * ((t - beat - offset) / width) ** 2)
+        beat += rr * (1.0 + rr_jitter * rng.standard_normal())
+    return out
+
+
+class VirtualEcgDevice:
+    """Pseudo-terminal that streams samples like ECG_code.ino.
+
+    ``port`` is the slave side for ``serial.Serial``. Samples are emitted at
+    ``rate * speed`` per second in ``'ascii'`` (one ``println`` per sample) or
+    ``'binary'`` (BINARY_FRAMES) format. Each line or frame is dropped with
+    probability ``drop_rate``. A garbage line is inserted with probability
+    ``garbage_rate``. ``noise`` is the standard deviation of added Gaussian
+    noise in ADC counts. If the host stops reading, up to ``max_pending`` bytes
+    are held back and anything beyond that is discarded and counted in
+    ``overflow_bytes``, like a full receive buffer. During each ``(start, end)``
+    of ``lead_off`` (seconds of playback), the output is pinned to the rail and
+    the lead-off state is reported like the sketch does. A ``RATE`` command
+    resamples ``samples`` to the new rate and carries on from the same point
+    of the record.
+    """
+
+    def __init__(self, samples, rate=100, speed=1.0, noise=0.0, drop_rate=0.0, garbage_rate=0.0,
+                 protocol='ascii', loop=True, seed=None, max_pending=1 << 16, lead_off=()):
+        if protocol not in ('ascii', 'binary'):
+            raise ValueError(f"Unknown serial protocol: {protocol!r}")
+        if speed <= 0:
+            raise ValueError("speed must be positive")
+        self.samples = np.asarray(samples, dtype=np.float64)
+        self.rate = int(rate)
+        self._source = self.samples
+        self._source_rate = self.rate
+        self.speed = speed
+        self.noise = noise
+        self.drop_rate = drop_rate
+        self.garbage_rate = garbage_rate
+        self.protocol = protocol
+        self.loop = loop
+        self.max_pending = max_pending
+        self.lead_off = list(lead_off)
+        self.rng = np.random.default_rng(seed)
+        self.master = None
+        self.slave = None
+        self.port = None
+        self.sent_samples = 0
+        self.dropped = 0
+        self.garbage = 0
+        self.overflow_bytes = 0
+        self.leads_off = False
+        self._position = 0
+        self._seq = 0
+        self._pending = bytearray()
+        self._commands = b''
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def open(self):
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)  # no echo or newline translation, like a USB CDC port
+        os.set_blocking(self.master, False)
+        self.port = os.ttyname(self.slave)
+        return self.port
+
+    def close(self):
+        for fd in (self.master, self.slave):
+            if fd is not None:
+                os.close(fd)
+        self.master = self.slave = None
+
+    def __enter__(self):
+        if self.master is None:
+            self.open()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+        self.close()
+
+    @property
+    def finished(self):
+        return not self.loop and self._position >= len(self.samples)
+
+    def start(self):
+        # Serve from a daemon thread, e.g. inside a benchmark or soak test
+        if self.master is None:
+            self.open()
+        self._thread = threading.Thread(target=self.run, name='virtual-ecg', daemon=True)
+        self._thread.start()
+        return self.port
+
+    def stop(self, timeout=2.0):
+        self._stop_event.set()
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join(timeout)
+
+    def run(self, duration=None, poll_interval=0.001):
+        if self.master is None:
+            self.open()
+        self._queue(BANNER)
+        self._queue(self.handshake())
+        start = time.monotonic()
+        sent = 0
+        while not self._stop_event.is_set() and not self.finished:
+            now = time.monotonic()
+            if duration is not None and now - start >= duration:
+                break
+            if self._read_commands():
+                start, sent = now, 0  # the rate changed; restart the schedule
+            due = int((now - start) * self.rate * self.speed)
+            if due > sent:
+                self._emit(due - sent)
+                sent = due
+            self._flush()
+            select.select([self.master], [], [], poll_interval)
+        self._flush()
+
+    def handshake(self):
+        return b'RHYTHMSYNC RATE=%d FORMAT=%s MODE=raw\r\n' % (self.rate, self.protocol.encode('ascii'))
+
+    def _read_commands(self):
+        try:
+            self._commands += os.read(self.master, 256)
+        except (BlockingIOError, OSError):
+            return False
+        rate_changed = False
+        *lines, self._commands = self._commands.replace(b'\r', b'\n').split(b'\n')
+        for line in lines:
+            if line.startswith(b'RATE '):
+                try:
+                    rate = int(line[5:])
+                except ValueError:
+                    rate = None
+                if rate in SUPPORTED_RATES and rate != self.rate:
+                    self._set_rate(rate)
+                    rate_changed = True
+            if line.startswith(b'RATE ') or line == b'HELLO':
+                self._queue(self.handshake())
+        return rate_changed
+
+    def _set_rate(self, rate):
+        # Resampled from the original record each time, so switching back and forth loses nothing
+        if rate == self._source_rate:
+            samples = self._source
+        else:
+            samples = resample_poly(self._source, rate, self._source_rate)
+        self._position = self._position * rate // self.rate
+        self.samples = samples
+        self.rate = rate
+
+    def _next_samples(self, n):
+        if self.loop:
+            index = (self._position + np.arange(n)) % len(self.samples)
+        else:
+            index = np.arange(self._position, min(self._position + n, len(self.samples)))
+        self._position += len(index)
+        values = self.samples[index]
+        if self.noise:
+            values = values + self.rng.normal(0.0, self.noise, len(values))
+        return np.clip(np.round(values), 0, ADC_MAX).astype(np.int64)
+
+    def _garbage(self):
+        self.garbage += 1
+        junk = self.rng.integers(0x21, 0x7F, int(self.rng.integers(1, 12)), dtype=np.uint8).tobytes()
+        return junk.replace(b'\n', b'') + b'\r\n'
+
+    def _leads_off_at(self, sample):
+        t = sample / self.rate
+        return any(start <= t < end for start, end in self.lead_off)
+
+    def _status(self, off):
+        self.leads_off = off
+        if self.protocol == 'binary':
+            return encode_status(LEAD_OFF if off else 0)
+        return b'LEADS OFF\r\n' if off else b'LEADS ON\r\n'
+
+    def _emit(self, n):
+        if self.lead_off:
+            # Split at lead-off changes so each status goes out between the right samples
+            start = self.sent_samples
+            for i in range(n):
+                off = self._leads_off_at(start + i)
+                if off != self.leads_off:
+                    if i:
+                        self._emit_samples(i)
+                    self._queue(self._status(off))
+                    return self._emit(n - i)
+        self._emit_samples(n)
+
+    def _emit_samples(self, n):
+        values = self._next_samples(n)
+        if self.leads_off:
+            values[:] = ADC_MAX  # the AD8232 output saturates with a lead off
+        start = self.sent_samples
+        self.sent_samples += len(values)
+        if self.protocol == 'binary':
+            chunks = [values[i:i + SAMPLES_PER_FRAME] for i in range(0, len(values), SAMPLES_PER_FRAME)]
+            offsets = range(start, start + len(values), SAMPLES_PER_FRAME)
+            out = []
+            for offset, chunk in zip(offsets, chunks):
+                frame = encode_frame(self._seq, int(offset * 1e6 / self.rate), chunk)
+                self._seq += 1
+                if self.drop_rate and self.rng.random() < self.drop_rate:
+                    self.dropped += 1
+                    continue
+                out.append(frame)
+                if self.garbage_rate and self.rng.random() < self.garbage_rate:
+                    out.append(self._garbage())
+            self._queue(b''.join(out))
+            return
+        keep = np.ones(len(values), dtype=bool)
+        if self.drop_rate:
+            keep = self.rng.random(len(values)) >= self.drop_rate
+            self.dropped += int((~keep).sum())
+        lines = [b'%d\r\n' % v for v in values[keep]]
+        if self.garbage_rate:
+            for i in np.flatnonzero(self.rng.random(len(lines)) < self.garbage_rate)[::-1]:
+                lines.insert(i, self._garbage())
+        self._queue(b''.join(lines))
+
+    def _queue(self, data):
+        room = self.max_pending - len(self._pending)
+        if len(data) > room:
+            self.overflow_bytes += len(data) - max(room, 0)
+            data = data[:max(room, 0)]
+        self._pending += data
+
+    def _flush(self):
+        while self._pending:
+            try:
+                written = os.write(self.master, self._pending)
+            except BlockingIOError:
+                return  # the host is not keeping up; retry on the next pass
+            del self._pending[:written]
+
+    def stats(self):
+        return {
+            'port': self.port,
+            'rate': self.rate,
+            'speed': self.speed,
+            'sent_samples': self.sent_samples,
+            'dropped': self.dropped,
+            'garbage': self.garbage,
+            'pending_bytes': len(self._pending),
+            'overflow_bytes': self.overflow_bytes,
+            'leads_off': self.leads_off,
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m rhythmsync.simulator',
+                                     description="Replay ECG on a pseudo-terminal in ECG_code.ino's serial format.")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--record', help=".mat record to replay (default: synthetic ECG)")
+    source.add_argument('--session', help="session directory recorded with rhythmsync.recorder to replay")
+    source.add_argument('--synthetic', action='store_true', help="generate a synthetic ECG")
+    parser.add_argument('--source-rate', type=float,
+                        help="native rate of the record in Hz; resampled to --rate when given")
+    parser.add_argument('--heart-rate', type=float, default=72.0, help="synthetic heart rate in BPM")
+    parser.add_argument('--rate', type=int, default=100, choices=SUPPORTED_RATES, help="device sampling rate in Hz")
+    parser.add_argument('--speed', type=float, default=1.0, help="playback multiplier, e.g. 1 to 50")
+    parser.add_argument('--noise', type=float, default=0.0, help="Gaussian noise in ADC counts")
+    parser.add_argument('--drop', type=float, default=0.0, help="probability of dropping a line or frame")
+    parser.add_argument('--garbage', type=float, default=0.0, help="probability of inserting a garbage line")
+    parser.add_argument('--format', choices=('ascii', 'binary'), default='ascii', help="serial output format")
+    parser.add_argument('--lead-off', action='append', default=[], metavar='START-END',
+                        help="seconds of playback with a lead off, e.g. 20-30; can be repeated")
+    parser.add_argument('--once', action='store_true', help="stop at the end of the record instead of looping")
+    parser.add_argument('--duration', type=float, help="stop after this many seconds")
+    parser.add_argument('--seed', type=int, help="random seed for noise, drops and garbage")
+    args = parser.parse_args(argv)
+    try:
+        lead_off = [tuple(float(t) for t in interval.split('-', 1)) for interval in args.lead_off]
+    except ValueError:
+        parser.error("--lead-off takes START-END in seconds, e.g. 20-30")
+
+    if args.record:
+        samples = load_record(args.record, args.rate, args.source_rate)
+    elif args.session:
+        samples = load_session(args.session, args.rate)
+    else:
+        samples = synthetic_ecg(args.rate, heart_rate=args.heart_rate, seed=args.seed)
+    device = VirtualEcgDevice(samples, args.rate, args.speed, args.noise, args.drop, args.garbage,
+                              args.format, loop=not args.once, seed=args.seed, lead_off=lead_off)
+    with device:
+        print(f"Virtual ECG device on {device.port}; run the apps with RHYTHMSYNC_PORT={device.port}",
+              flush=True)
+        try:
+            device.run(args.duration)
+        except KeyboardInterrupt:
+            pass
+        print(device.stats())
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
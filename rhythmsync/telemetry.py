@@ -0,0 +1,417 @@
+"""Heart-rate telemetry published to ThingSpeak, or any endpoint that takes its bulk-update JSON.
+
+``TelemetryPublisher.publish`` only queues a metric, so the DSP and UI
+threads never wait for the network. A background thread sends queued
+metrics in bulk over one kept-alive connection. When the endpoint is slow or
+down it backs off exponentially and keeps the backlog; past ``max_memory``
+entries, the oldest are spilled to a file and sent once the endpoint is back,
+also by a later run. A local stand-in endpoint is included for testing:
+
+    python -m rhythmsync.telemetry serve --port 8080 --fail 0.3
+    python -m rhythmsync.headless --telemetry-url http://127.0.0.1:8080/channels/1/bulk_update.json
+"""
+import argparse
+import hashlib
+import http.client
+import json
+import logging
+import os
+import queue
+import random
+import shutil
+import sys
+import threading
+import time
+import urllib.parse
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+log = logging.getLogger('rhythmsync.telemetry')
+
+# Metric -> ThingSpeak channel field
+FIELDS = {'heart_rate': 'field1', 'rr': 'field2', 'dropped': 'field3', 'quality': 'field4'}
+THINGSPEAK_URL = 'https://api.thingspeak.com/channels/{channel}/bulk_update.json'
+_RETRY_STATUS = (408, 429)  # and every 5xx: the batch is kept and sent again
+
+
+def default_spill_dir():
+    return os.environ.get('RHYTHMSYNC_SPILL') or os.path.join(os.path.expanduser('~'), '.cache', 'rhythmsync',
+                                                             'telemetry')
+
+
+class TelemetryPublisher:
+    """Sends metrics to ``url`` in batches from a background thread.
+
+    ``publish`` never blocks: updates closer than ``min_interval`` seconds
+    are skipped, and when ``max_pending`` updates wait for the thread, new
+    ones are dropped and counted. A batch goes out every ``flush_interval``
+    seconds, or as soon as ``batch_size`` entries are waiting. Failed sends
+    are retried after ``min_backoff`` seconds, doubling up to
+    ``max_backoff``; a batch the endpoint rejects with another 4xx status is
+    dropped. With ``spill_dir`` set, entries beyond ``max_memory`` and those
+    unsent at ``close`` go to a JSON-lines file of at most
+    ``max_spill_bytes``, one per URL and ``name`` (e.g. the device), so
+    publishers for several devices never share one. Spilled entries are read
+    back at most ``max_memory`` at a time, the rest staying on disk in order.
+    """
+
+    def __init__(self, url, api_key=None, batch_size=100, flush_interval=15.0, min_interval=1.0, max_pending=1024,
+                 max_memory=10000, spill_dir=None, max_spill_bytes=16 << 20, timeout=5.0, min_backoff=1.0,
+                 max_backoff=300.0, fields=FIELDS, name=None):
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme not in ('http', 'https') or not parts.hostname:
+            raise ValueError(f"Not an http(s) URL: {url!r}")
+        self.url = url
+        self.api_key = api_key
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.min_interval = min_interval
+        self.max_memory = max_memory
+        self.max_spill_bytes = max_spill_bytes
+        self.timeout = timeout
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.fields = fields
+        self._connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self._address = (parts.hostname, parts.port)
+        self._path = parts.path + ('?' + parts.query if parts.query else '')
+        self.spill_path = None
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+            key = url if name is None else f"{url}\n{name}"
+            digest = hashlib.sha1(key.encode()).hexdigest()[:12]
+            self.spill_path = os.path.join(spill_dir, f"telemetry-{digest}.jsonl")
+
+        self.sent = 0
+        self.batches = 0
+        # Each counter has one writing thread, so neither needs a lock; ``dropped`` is their sum
+        self._refused = 0  # full queue; caller thread only
+        self._lost = 0  # full spill file or rejected batch; publisher thread only
+        self.failures = 0  # failed sends
+        self.connections = 0
+        self.backoff = 0.0
+        self.last_error = None
+        self._last_publish = None
+        self._queue = queue.Queue(max_pending)
+        self._backlog = deque()  # taken from the queue, not yet sent; publisher thread only
+        self._connection = None
+        self._next_send = time.monotonic() + flush_interval
+        self._wake = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='telemetry', daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def for_thingspeak(cls, channel, write_key, **kwargs):
+        return cls(THINGSPEAK_URL.format(channel=channel), write_key, **kwargs)
+
+    def publish(self, heart_rate=None, rr=None, dropped=None, timestamp=None, quality=None):
+        """Queue one update; ``rr`` is the latest RR interval in seconds and ``quality`` the signal score.
+
+        Returns False if it was not queued.
+        """
+        now = time.monotonic()
+        if self._last_publish is not None and now - self._last_publish < self.min_interval:
+            return False
+        self._last_publish = now
+        timestamp = time.time() if timestamp is None else timestamp
+        entry = {'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(timestamp))}
+        for name, value in (('heart_rate', heart_rate), ('rr', rr), ('dropped', dropped), ('quality', quality)):
+            if value is not None and name in self.fields:
+                entry[self.fields[name]] = round(float(value), 3)
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            self._refused += 1
+            return False
+        if self._queue.qsize() >= self.batch_size:
+            self._wake.set()
+        return True
+
+    @property
+    def dropped(self):
+        # Lost to a full queue, a full spill file or a rejected batch
+        return self._refused + self._lost
+
+    @property
+    def pending(self):
+        return self._queue.qsize() + len(self._backlog)
+
+    def stats(self):
+        spilled = 0
+        if self.spill_path and os.path.exists(self.spill_path):
+            spilled = os.path.getsize(self.spill_path)
+        return {'sent': self.sent, 'batches': self.batches, 'pending': self.pending, 'spilled_bytes': spilled,
+                'dropped': self.dropped, 'failures': self.failures, 'connections': self.connections,
+                'backoff_s': self.backoff, 'error': str(self.last_error) if self.last_error else ''}
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            self._wake.wait(max(self._next_send - time.monotonic(), 0))
+            self._wake.clear()
+            self._take()
+            now = time.monotonic()
+            if now >= self._next_send or (len(self._backlog) >= self.batch_size and not self.backoff):
+                self._send_pending()
+        # Closing: one last attempt, then keep what is left for the next run
+        self._take()
+        self._send_pending(final=True)
+        self._spill(len(self._backlog))
+        self._close_connection()
+
+    def _take(self):
+        while True:
+            try:
+                self._backlog.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if len(self._backlog) > self.max_memory:
+            # Spill in large steps so the file is not appended to on every update
+            self._spill(len(self._backlog) - self.max_memory // 2)
+
+    def _spill(self, count):
+        if count <= 0:
+            return
+        entries = [self._backlog.popleft() for _ in range(count)]
+        if self.spill_path is None:
+            self._lost += count
+            return
+        data = ''.join(json.dumps(entry, separators=(',', ':')) + '\n' for entry in entries)
+        try:
+            size = os.path.getsize(self.spill_path) if os.path.exists(self.spill_path) else 0
+            if size + len(data) > self.max_spill_bytes:
+                self._lost += count
+                return
+            with open(self.spill_path, 'a') as f:
+                f.write(data)
+        except OSError as e:
+            log.error("Could not spill telemetry to %s: %s", self.spill_path, e)
+            self._lost += count
+
+    def _unspill(self):
+        # Spilled entries are older than everything in memory, so they go first
+        room = self.max_memory - len(self._backlog)
+        if self.spill_path is None or room <= 0 or not os.path.exists(self.spill_path):
+            return
+        try:
+            lines = []
+            with open(self.spill_path, 'rb') as f:
+                while len(lines) < room:
+                    line = f.readline()
+                    if not line:
+                        break
+                    lines.append(line)
+                rest = f.tell() < os.fstat(f.fileno()).st_size
+                if rest:
+                    # The remainder is copied as is, without parsing or holding it in memory
+                    with open(self.spill_path + '.partial', 'wb') as partial:
+                        shutil.copyfileobj(f, partial)
+            if rest:
+                os.replace(self.spill_path + '.partial', self.spill_path)
+            else:
+                os.remove(self.spill_path)
+        except OSError as e:
+            log.error("Could not read spilled telemetry from %s: %s", self.spill_path, e)
+            return
+        entries = []
+        for line in lines:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:  # a line cut short by a crash
+                self._lost += 1
+        self._backlog.extendleft(reversed(entries))
+
+    def _send_pending(self, final=False):
+        deadline = time.monotonic() + self.timeout
+        while not self._stop_event.is_set() or final:
+            if len(self._backlog) < self.batch_size:
+                self._unspill()
+            if not self._backlog:
+                break
+            batch = [self._backlog[i] for i in range(min(self.batch_size, len(self._backlog)))]
+            try:
+                status = self._post(batch)
+            except (OSError, http.client.HTTPException) as e:
+                self._failed(e)
+                return
+            if status >= 500 or status in _RETRY_STATUS:
+                self._failed(f"HTTP {status}")
+                return
+            for _ in batch:
+                self._backlog.popleft()
+            if status >= 300:
+                log.error("Telemetry endpoint rejected %d entries with HTTP %d", len(batch), status)
+                self._lost += len(batch)
+            else:
+                self.sent += len(batch)
+                self.batches += 1
+            if self.backoff:
+                log.info("Telemetry endpoint is back; %d entries waiting", self.pending)
+            self.backoff = 0.0
+            self.last_error = None
+            if final and time.monotonic() > deadline:
+                break
+        self._next_send = time.monotonic() + self.flush_interval
+
+    def _failed(self, error):
+        self.failures += 1
+        if not self.backoff:
+            log.warning("Telemetry endpoint %s unavailable (%s); retrying with backoff", self.url, error)
+        self.last_error = error
+        self.backoff = min(max(2 * self.backoff, self.min_backoff), self.max_backoff)
+        # Jitter so several devices do not retry in step
+        self._next_send = time.monotonic() + self.backoff * random.uniform(0.5, 1.0)
+
+    def _post(self, entries):
+        # One connection is reused for every batch until the server or an error closes it
+        payload = {'updates': entries}
+        if self.api_key:
+            payload['write_api_key'] = self.api_key
+        body = json.dumps(payload, separators=(',', ':')).encode()
+        if self._connection is None:
+            self._connection = self._connection_class(*self._address, timeout=self.timeout)
+            self.connections += 1
+        try:
+            self._connection.request('POST', self._path, body, {'Content-Type': 'application/json'})
+            response = self._connection.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            self._close_connection()
+            raise
+        if response.will_close:
+            self._close_connection()
+        return response.status
+
+    def _close_connection(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def flush(self):
+        # Send what is waiting now instead of at the next flush interval
+        self._next_send = time.monotonic()
+        self._wake.set()
+
+    def close(self):
+        # Waits for the last send (up to about twice ``timeout``); unsent entries are spilled
+        self._stop_event.set()
+        self._wake.set()
+        self._thread.join(2 * self.timeout + 1)
+
+
+class StandInServer(ThreadingHTTPServer):
+    """A local bulk-update endpoint that keeps what it receives, for testing publishers.
+
+    ``fail`` is the fraction of requests answered with HTTP 503 and
+    ``delay`` the seconds each response is held back.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0, fail=0.0, delay=0.0):
+        super().__init__((host, port), _StandInHandler)
+        self.fail = fail
+        self.delay = delay
+        self.received = []
+        self.requests = 0
+        self.connections = 0
+        self.lock = threading.Lock()
+
+    def url(self, channel=1):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/channels/{channel}/bulk_update.json"
+
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, like the real endpoint
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if server.delay:
+            time.sleep(server.delay)
+        with server.lock:
+            server.requests += 1
+        if random.random() < server.fail:
+            self._reply(503, {'error': 'unavailable'})
+            return
+        try:
+            updates = json.loads(body)['updates']
+        except (ValueError, KeyError, TypeError):
+            self._reply(400, {'error': 'bad request'})
+            return
+        with server.lock:
+            server.received.extend(updates)
+        log.info("%s: %d updates", self.path, len(updates))
+        self._reply(202, {'success': True})
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        log.debug(format, *args)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m rhythmsync.telemetry',
+                                     description="Stand-in telemetry endpoint, and a test publisher for it.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve = commands.add_parser('serve', help="run a local bulk-update endpoint")
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8080)
+    serve.add_argument('--fail', type=float, default=0.0, help="fraction of requests answered with HTTP 503")
+    serve.add_argument('--delay', type=float, default=0.0, help="seconds before each response")
+    send = commands.add_parser('send', help="publish a synthetic heart rate")
+    send.add_argument('url')
+    send.add_argument('--key', default=os.environ.get('RHYTHMSYNC_TELEMETRY_KEY'),
+                      help="write API key (default: $RHYTHMSYNC_TELEMETRY_KEY)")
+    send.add_argument('--rate', type=float, default=10.0, help="updates per second")
+    send.add_argument('--flush', type=float, default=2.0, help="seconds between batches")
+    send.add_argument('--duration', type=float, default=10.0)
+    send.add_argument('--spill', metavar='DIR', default=default_spill_dir(), help="spill directory")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s', stream=sys.stdout)
+
+    if args.command == 'serve':
+        server = StandInServer(args.host, args.port, args.fail, args.delay)
+        log.info("Listening on %s", server.url())
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            log.info("%d updates in %d requests over %d connections", len(server.received), server.requests,
+                     server.connections)
+        return 0
+
+    publisher = TelemetryPublisher(args.url, args.key, flush_interval=args.flush, min_interval=0,
+                                   spill_dir=args.spill)
+    start = time.monotonic()
+    count = 0
+    try:
+        while time.monotonic() - start < args.duration:
+            heart_rate = 70 + 10 * random.random()
+            publisher.publish(heart_rate, 60 / heart_rate, 0)
+            count += 1
+            time.sleep(1 / args.rate)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        publisher.close()
+    log.info("Published %d: %s", count, publisher.stats())
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
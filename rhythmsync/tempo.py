@@ -0,0 +1,523 @@
+"""Playback whose tempo follows the heart rate, from precomputed time-stretched renditions.
+
+Time-stretching a song takes seconds of CPU per tempo, far too slow to do
+per beat. Each playlist entry is instead rendered once at every tempo in a
+grid (50-180 BPM in 10 BPM steps by default) and kept in an on-disk cache,
+and playback switches to the rendition nearest the current heart rate. The
+cache evicts least recently played renditions once it outgrows its size
+limit. Renditions can be rendered ahead of time, e.g. on a faster machine
+whose cache directory is then copied over:
+
+    python -m rhythmsync.tempo low.mp3 high.mp3 --cache ~/.cache/rhythmsync/renditions
+
+A playlist entry may give the song's tempo as ``"bpm"``; otherwise it is
+estimated from the audio.
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+from rhythmsync.audio import AudioBank
+
+DEFAULT_TEMPOS = tuple(range(50, 181, 10))
+DEFAULT_CACHE_BYTES = 1 << 30
+MAX_STRETCH = 2.0  # renditions further than 2x from the song's own tempo sound too poor to play
+
+
+def default_cache_dir():
+    return os.environ.get('RHYTHMSYNC_CACHE') or os.path.join(os.path.expanduser('~'), '.cache', 'rhythmsync',
+                                                             'renditions')
+
+
+def time_stretch(samples, rate, n_fft=2048, hop=512, block=256):
+    """Phase-vocoder time stretch of ``samples`` (``(n,)`` or ``(n, channels)``) by ``rate``.
+
+    ``rate`` > 1 plays faster. Pitch is unchanged. The STFT is computed
+    ``block`` frames at a time, so memory stays flat for long songs. Returns
+    an array of the input's shape and dtype, about ``n / rate`` samples long.
+    """
+    samples = np.asarray(samples)
+    x = samples.astype(np.float32)
+    if x.ndim == 1:
+        x = x[:, None]
+    half = n_fft // 2
+    padded = np.pad(x, ((half, half + n_fft), (0, 0)))
+    n_frames = 1 + (len(padded) - n_fft) // hop
+    window = np.hanning(n_fft + 1)[:-1].astype(np.float32)
+    phase_advance = (2 * np.pi * hop / n_fft) * np.arange(half + 1, dtype=np.float32)
+
+    steps = np.arange(0, n_frames - 1, rate)  # output frames, in (fractional) input frames
+    out = np.zeros(((len(steps) + 1) * hop + n_fft, x.shape[1]), dtype=np.float32)
+    norm = np.zeros(len(out), dtype=np.float32)
+    phase = None
+    for begin in range(0, len(steps), block):
+        chunk = steps[begin:begin + block]
+        first = int(chunk[0])
+        last = int(chunk[-1]) + 2
+        frames = np.lib.stride_tricks.sliding_window_view(
+            padded[first * hop:(last - 1) * hop + n_fft], n_fft, axis=0)[::hop]  # (frames, channels, n_fft)
+        spectrum = np.fft.rfft(frames * window, axis=-1)
+        index = chunk.astype(int) - first
+        alpha = (chunk % 1.0).astype(np.float32)[:, None, None]
+        left, right = spectrum[index], spectrum[index + 1]
+        magnitude = (1 - alpha) * np.abs(left) + alpha * np.abs(right)
+
+        # Phase advance between neighbouring input frames, unwrapped around the bin's expected advance
+        delta = np.angle(right) - np.angle(left) - phase_advance
+        delta = delta - 2 * np.pi * np.round(delta / (2 * np.pi)) + phase_advance
+        if phase is None:
+            phase = np.angle(left[0])
+        phases = phase + np.concatenate([np.zeros_like(delta[:1]), np.cumsum(delta[:-1], axis=0)])
+        phase = phases[-1] + delta[-1]
+
+        frames_out = np.fft.irfft(magnitude * np.exp(1j * phases), n_fft, axis=-1).astype(np.float32) * window
+        for k, frame in enumerate(frames_out):
+            start = (begin + k) * hop
+            out[start:start + n_fft] += frame.T
+            norm[start:start + n_fft] += window ** 2
+
+    out /= np.maximum(norm, 1e-3)[:, None]
+    out = out[half:half + int(round(len(x) / rate))]
+    if np.issubdtype(samples.dtype, np.integer):
+        info = np.iinfo(samples.dtype)
+        out = np.clip(np.round(out), info.min, info.max)
+    out = out.astype(samples.dtype)
+    return out[:, 0] if samples.ndim == 1 else out
+
+
+def estimate_tempo(samples, frequency, low=60.0, high=180.0, hop=512):
+    # Autocorrelation of the onset envelope (rises in frame energy), peak between low and high BPM
+    x = np.asarray(samples, dtype=np.float32)
+    if x.ndim > 1:
+        x = x.mean(axis=1)
+    n = len(x) // hop
+    energy = np.log1p(np.square(x[:n * hop].reshape(n, hop)).sum(axis=1))
+    onset = np.maximum(np.diff(energy), 0)
+    onset -= onset.mean()
+    spectrum = np.fft.rfft(onset, 2 * len(onset))
+    autocorr = np.fft.irfft(np.abs(spectrum) ** 2)[:len(onset)]
+    frame_rate = frequency / hop
+    lags = np.arange(int(60 * frame_rate / high), int(60 * frame_rate / low) + 1)
+    lags = lags[(lags > 0) & (lags < len(autocorr))]
+    if not len(lags):
+        return 120.0
+    return 60 * frame_rate / lags[np.argmax(autocorr[lags])]
+
+
+class RenditionCache:
+    """Directory of time-stretched renditions as ``.npy`` files, evicted least recently used first.
+
+    A song's renditions share a prefix derived from its path, size, mtime and
+    the mixer format, so an edited song or another mixer format misses the
+    cache. Loading a rendition memory-maps it and marks it as used.
+    """
+
+    def __init__(self, directory=None, max_bytes=DEFAULT_CACHE_BYTES):
+        self.directory = directory or default_cache_dir()
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+        self._bytes = sum(size for _, size, _ in self.entries())  # kept up to date by store() and evict()
+
+    def prefix(self, path, frequency, channels):
+        st = os.stat(path)
+        key = f"{os.path.abspath(path)}|{st.st_size}|{st.st_mtime_ns}|{frequency}|{channels}"
+        stem = os.path.splitext(os.path.basename(path))[0]
+        return f"{stem}-{hashlib.sha1(key.encode()).hexdigest()[:12]}"
+
+    def path(self, prefix, tempo):
+        return os.path.join(self.directory, f"{prefix}-{tempo:g}bpm.npy")
+
+    def tempos(self, prefix):
+        # Cached tempo -> file for one song
+        found = {}
+        for path in glob.glob(os.path.join(glob.escape(self.directory), glob.escape(prefix) + '-*bpm.npy')):
+            try:
+                found[float(os.path.basename(path)[len(prefix) + 1:-len('bpm.npy')])] = path
+            except ValueError:
+                pass
+        return found
+
+    def load(self, prefix, tempo):
+        # Raises FileNotFoundError when the rendition was evicted
+        path = self.path(prefix, tempo)
+        samples = np.load(path, mmap_mode='r')
+        os.utime(path)
+        return samples
+
+    def store(self, prefix, tempo, samples):
+        path = self.path(prefix, tempo)
+        partial = path + '.partial'
+        with open(partial, 'wb') as f:
+            np.save(f, samples)
+        replaced = os.path.getsize(path) if os.path.exists(path) else 0
+        os.replace(partial, path)
+        self._bytes += os.path.getsize(path) - replaced
+        if self._bytes > self.max_bytes:
+            self.evict(keep=path)
+        return path
+
+    def read_meta(self, prefix):
+        try:
+            with open(os.path.join(self.directory, prefix + '.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def write_meta(self, prefix, meta):
+        with open(os.path.join(self.directory, prefix + '.json'), 'w') as f:
+            json.dump(meta, f)
+
+    def entries(self):
+        # (last use, size, path) of every rendition, least recently used first
+        entries = []
+        for path in glob.glob(os.path.join(glob.escape(self.directory), '*.npy')):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        return sorted(entries)
+
+    def size(self):
+        # Bytes cached as of the last store or eviction, without scanning the directory
+        return self._bytes
+
+    def evict(self, keep=None):
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+        self._bytes = total
+
+
+def decode(path):
+    # The song as the mixer would play it, (n,) or (n, channels) samples; needs pygame.mixer.init()
+    import pygame
+    import pygame.sndarray
+
+    return pygame.sndarray.array(pygame.mixer.Sound(path))
+
+
+def song_meta(cache, prefix, entry, samples, frequency):
+    # Tempo and length of a decoded song, stored next to its renditions
+    meta = {"bpm": round(float(entry.get("bpm") or estimate_tempo(samples, frequency)), 1), "samples": len(samples)}
+    cache.write_meta(prefix, meta)
+    return meta
+
+
+def grid_for(meta, tempos):
+    # Grid tempos within MAX_STRETCH of the song's own tempo
+    return [t for t in tempos if 1 / MAX_STRETCH <= t / meta["bpm"] <= MAX_STRETCH]
+
+
+class TempoEngine(AudioBank):
+    """``AudioBank`` whose songs play at the tempo nearest the heart rate.
+
+    The heart-rate zone still picks the song. The heart rate, clipped to
+    ``tempos``, picks the rendition; it changes once the heart rate is more
+    than half a grid step plus ``tempo_hysteresis`` BPM from the playing
+    tempo. A tempo change keeps the position in the song and crossfades over
+    ``tempo_crossfade`` seconds. Until a song's grid is rendered the nearest
+    cached rendition plays, starting with the song at its own tempo.
+
+    A background thread decodes the songs (only those without cached
+    metadata) and renders missing renditions, nearest to the current heart
+    rate first. Once the cache is full it only renders the rendition nearest
+    the current heart rate, evicting the least recently used ones.
+
+    Starting a rendition mid-song means copying megabytes out of the
+    memory-mapped cache into new ``Sound`` buffers, so a second thread
+    prepares them. The position is aimed at when they will be ready, and
+    ``update`` (or the next ``play``) on the caller's thread only swaps the
+    mixer channels.
+    """
+
+    def __init__(self, playlist, on_status=None, hysteresis=5.0, crossfade=2.0, tempos=DEFAULT_TEMPOS,
+                 cache=None, tempo_hysteresis=2.0, tempo_crossfade=0.25):
+        import pygame
+        import pygame.sndarray
+
+        self.sndarray = pygame.sndarray
+        self.cache = cache or RenditionCache()
+        self.tempos = tuple(sorted(tempos))
+        self.step = float(min(np.diff(self.tempos))) if len(self.tempos) > 1 else 0.0
+        self.tempo_hysteresis = tempo_hysteresis
+        self.tempo_crossfade = tempo_crossfade
+        self.target = None  # heart rate clipped to the grid
+        self.tempo = None  # tempo of the playing rendition
+        self.prefixes = [None] * len(playlist)
+        self.meta = [None] * len(playlist)  # {"bpm": song tempo, "samples": length}
+        self.available = [{} for _ in playlist]  # cached tempo -> path, per song
+        self._started = None  # (song position in seconds, monotonic start, rendition tempo / song tempo)
+        self._paused_at = None
+        self._stopped = False
+        self._failed = set()  # (song, tempo) renditions that could not be rendered
+        self._wake = threading.Event()
+        self._requested = None  # (song, tempo) being prepared or waiting to be swapped in
+        self._request = None  # next start for the preparer: (song, tempo, fade_ms, keep_position, announce)
+        self._prepared = None  # ready to swap in: (song, tempo, fade_ms, sound, rest, position, ratio, announce)
+        self._prepare_seconds = 0.05  # running estimate of the preparation time, to aim the position
+        self._prepare_condition = threading.Condition()
+        super().__init__(playlist, on_status, hysteresis, crossfade)
+        self._preparer = threading.Thread(target=self._prepare_loop, name='tempo-prepare', daemon=True)
+        self._preparer.start()
+
+    def _decode_all(self):
+        frequency, _, channels = self.mixer.get_init()
+        sources = {}
+        for index, entry in enumerate(self.playlist):
+            try:
+                prefix = self.cache.prefix(entry["path"], frequency, channels)
+                meta = self.cache.read_meta(prefix)
+                available = self.cache.tempos(prefix)
+                if meta is None or not available:
+                    sources[index] = decode(entry["path"])
+                    meta = song_meta(self.cache, prefix, entry, sources[index], frequency)
+                    available[meta["bpm"]] = self.cache.store(prefix, meta["bpm"], sources[index])
+            except Exception as e:  # pygame.error for undecodable files, OSError/FileNotFoundError
+                self.errors[index] = e
+                continue
+            self.prefixes[index], self.meta[index] = prefix, meta
+            self.available[index].update(available)
+        self.loaded.set()
+        self._render_loop(sources, frequency)
+
+    def _missing(self, index):
+        meta = self.meta[index]
+        if meta is None:
+            return []
+        return [t for t in grid_for(meta, self.tempos)
+                if t not in self.available[index] and (index, t) not in self._failed]
+
+    def _next_job(self):
+        # Nearest missing grid tempo to the heart rate, current song first; only that one once the cache is full
+        zone = self.current_song_index if self.current_song_index >= 0 else 0
+        target = self.target
+        candidates = []
+        for index in range(len(self.playlist)):
+            for tempo in self._missing(index):
+                distance = abs(tempo - (target if target is not None else self.meta[index]["bpm"]))
+                candidates.append((index != zone, distance, index, tempo))
+        if not candidates:
+            return None
+        job = min(candidates)
+        if self.cache.size() >= self.cache.max_bytes and (job[0] or job[1] > self.step / 2):
+            return None
+        return job[2], job[3]
+
+    def _render_loop(self, sources, frequency):
+        while True:
+            job = self._next_job()
+            if job is None:
+                self._wake.wait(5.0)
+                self._wake.clear()
+                continue
+            index, tempo = job
+            try:
+                if index not in sources:
+                    sources[index] = decode(self.playlist[index]["path"])
+                rendition = time_stretch(sources[index], tempo / self.meta[index]["bpm"])
+                self.available[index][tempo] = self.cache.store(self.prefixes[index], tempo, rendition)
+            except Exception:  # out of disk space, or the file changed underneath us; keep what is cached
+                self._failed.add((index, tempo))
+
+    def _nearest(self, index):
+        tempos = list(self.available[index])
+        if not tempos:
+            return None
+        target = self.target if self.target is not None else self.meta[index]["bpm"]
+        return min(tempos, key=lambda t: abs(t - target))
+
+    def position(self, at=None):
+        # Seconds into the playing song, in the song's own time, now or at the monotonic time ``at``
+        if self._started is None:
+            return 0.0
+        start, since, ratio = self._started
+        now = self._paused_at or at or time.monotonic()
+        length = self.meta[self.current_song_index]["samples"] / self.mixer.get_init()[0]
+        return (start + (now - since) * ratio) % length
+
+    def _start(self, index, tempo, fade_ms, keep_position=False, announce=False):
+        # Hand the start to the preparer; update() swaps it in once its sounds are built
+        with self._prepare_condition:
+            self._requested = (index, tempo)
+            self._request = (index, tempo, fade_ms, keep_position, announce)
+            self._prepared = None
+            self._prepare_condition.notify()
+
+    def _prepare_loop(self):
+        while True:
+            with self._prepare_condition:
+                while self._request is None:
+                    self._prepare_condition.wait()
+                request, self._request = self._request, None
+            began = time.monotonic()
+            try:
+                prepared = self._prepare(*request)
+            except Exception:  # evicted since it was listed, or out of memory; pick again on the next call
+                self.available[request[0]].pop(request[1], None)
+                prepared = None
+            with self._prepare_condition:
+                if self._request is not None or self._requested != request[:2]:
+                    continue  # superseded while it was being built
+                if prepared is None:
+                    self._requested = None
+                    continue
+                self._prepared = prepared
+                self._prepare_seconds = 0.8 * self._prepare_seconds + 0.2 * (time.monotonic() - began)
+
+    def _prepare(self, index, tempo, fade_ms, keep_position, announce):
+        rendition = self.cache.load(self.prefixes[index], tempo)
+        frequency = self.mixer.get_init()[0]
+        ratio = tempo / self.meta[index]["bpm"]
+        position = self.position(time.monotonic() + self._prepare_seconds) if keep_position else 0.0
+        offset = int(position / ratio * frequency) % len(rendition)
+        sound = self.sndarray.make_sound(np.ascontiguousarray(rendition[offset:]))
+        # The rest of the song, then the whole song; a silent channel is restarted by the next update
+        rest = self.sndarray.make_sound(np.ascontiguousarray(rendition)) if offset else None
+        return index, tempo, fade_ms, sound, rest, offset * ratio / frequency, ratio, announce
+
+    def update(self):
+        # Swap in a prepared rendition; the only mixer work done on the caller's thread
+        with self._prepare_condition:
+            if self._paused_at is not None:
+                return False  # starts once resumed
+            prepared, self._prepared = self._prepared, None
+            if prepared is not None:
+                self._requested = None
+        if prepared is None:
+            return False
+        index, tempo, fade_ms, sound, rest, position, ratio, announce = prepared
+        old = self.channels[self._active]
+        self._active ^= 1
+        if fade_ms:
+            old.fadeout(fade_ms)
+        else:
+            old.stop()
+        channel = self.channels[self._active]
+        channel.play(sound, fade_ms=fade_ms)
+        if rest is not None:
+            channel.queue(rest)
+        self._started = (position, time.monotonic(), ratio)
+        self._paused_at = None
+        self._stopped = False
+        self.current_song_index, self.tempo = index, tempo
+        if announce:
+            self.on_status(f"Playing: {os.path.basename(self.playlist[index]['path'])} at {tempo:g} BPM")
+        return True
+
+    def play(self, index):
+        # Raises IndexError for an index outside the playlist
+        song_path = self.playlist[index]["path"]
+        self._wake.set()
+        self.update()
+        same_song = index == self.current_song_index
+        if same_song and self._stopped:
+            return
+        tempo = self._nearest(index) if self.meta[index] else None
+        if tempo is None:
+            if index in self.errors and index not in self._reported:
+                self._reported.add(index)
+                self.on_status(f"Cannot play {os.path.basename(song_path)}: {self.errors[index]}")
+            return  # still decoding, or unplayable; the next call retries
+        if self._requested == (index, tempo):
+            return  # being prepared
+        if same_song and tempo == self.tempo:
+            if not self.channels[self._active].get_busy() and self._paused_at is None:
+                self._start(index, tempo, 0, keep_position=True)
+            return
+        fade_ms = int((self.tempo_crossfade if same_song else self.crossfade) * 1000)
+        self._start(index, tempo, fade_ms, keep_position=same_song, announce=True)
+
+    def play_for_heart_rate(self, hr, hrv=None):
+        index = self.zones.select(hr, hrv)
+        self.target = min(max(hr, self.tempos[0]), self.tempos[-1])
+        if (index == self.current_song_index and self.tempo is not None
+                and abs(self.target - self.tempo) <= self.step / 2 + self.tempo_hysteresis):
+            self.target = self.tempo  # keep the playing rendition
+        self.play(index)
+
+    def pause(self):
+        if self._paused_at is None:
+            self._paused_at = time.monotonic()
+        super().pause()
+
+    def resume(self):
+        if self._paused_at is not None and self._started is not None:
+            start, since, ratio = self._started
+            self._started = (start, since + time.monotonic() - self._paused_at, ratio)
+        self._paused_at = None
+        super().resume()
+
+    def stop(self):
+        self._stopped = True
+        with self._prepare_condition:
+            self._request = self._prepared = self._requested = None
+        super().stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m rhythmsync.tempo',
+                                     description="Render time-stretched renditions of songs into the tempo cache.")
+    parser.add_argument('songs', nargs='+', help="audio files, e.g. low.mp3 high.mp3")
+    parser.add_argument('--tempos', default='50:180:10', help="grid as START:STOP:STEP in BPM (default: 50:180:10)")
+    parser.add_argument('--bpm', type=float, nargs='+', help="tempo of each song (default: estimated)")
+    parser.add_argument('--cache', default=default_cache_dir(),
+                        help="cache directory (default: $RHYTHMSYNC_CACHE or ~/.cache/rhythmsync/renditions)")
+    parser.add_argument('--cache-size', type=float, default=DEFAULT_CACHE_BYTES / 2 ** 20, help="cache limit in MB")
+    parser.add_argument('--frequency', type=int, default=44100, help="mixer sample rate of the player")
+    parser.add_argument('--channels', type=int, default=2, help="mixer channels of the player")
+    args = parser.parse_args(argv)
+
+    start, stop, step = (float(v) for v in args.tempos.split(':'))
+    tempos = np.arange(start, stop + step / 2, step).tolist()
+    if args.bpm and len(args.bpm) != len(args.songs):
+        parser.error("--bpm needs one tempo per song")
+
+    # Decoding needs the mixer, not a sound card
+    os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+    import pygame
+
+    pygame.mixer.init(args.frequency, -16, args.channels)
+    cache = RenditionCache(args.cache, int(args.cache_size * 2 ** 20))
+    status = 0
+    for i, path in enumerate(args.songs):
+        try:
+            prefix = cache.prefix(path, args.frequency, args.channels)
+            samples = decode(path)
+        except Exception as e:
+            print(f"{path}: {e}", file=sys.stderr)
+            status = 1
+            continue
+        meta = song_meta(cache, prefix, {"bpm": args.bpm[i] if args.bpm else None}, samples, args.frequency)
+        cache.store(prefix, meta["bpm"], samples)
+        print(f"{path}: {meta['bpm']:.1f} BPM, {len(samples) / args.frequency:.0f} s")
+        cached = cache.tempos(prefix)
+        for tempo in grid_for(meta, tempos):
+            if tempo in cached:
+                continue
+            begin = time.perf_counter()
+            cache.store(prefix, tempo, time_stretch(samples, tempo / meta["bpm"]))
+            print(f"  {tempo:g} BPM in {time.perf_counter() - begin:.1f} s")
+    if cache.size() > cache.max_bytes:
+        print("Cache limit reached; least recently used renditions were evicted", file=sys.stderr)
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,183 @@
+import time
+
+from rhythmsync import preload
+from rhythmsync.hrv import format_hrv
+from rhythmsync.latency import format_latency
+from rhythmsync.quality import format_quality
+from rhythmsync.session import EcgSession
+
+# Imported on a background thread while the serial handshake runs
+HEAVY_MODULES = ('rhythmsync.detectors', 'rhythmsync.filters', 'rhythmsync.heart_rate', 'rhythmsync.wavelets',
+                 'matplotlib.figure', 'matplotlib.backends.backend_tkagg', 'pygame')
+
+
+class EcgMusicApp:
+    """The Tk window of app.py and DAFRR.py: live plots, heart-rate status and music controls.
+
+    ``update_data`` runs every 10 ms on the Tk thread once Start is pressed,
+    consuming what the session's acquisition thread has read. The status bar
+    says when the signal-quality gate pauses or resumes the heart rate. With
+    ``show_latency``, a second bar shows the session's stage latencies once a second.
+    """
+
+    def __init__(self, session, playlist, title="Real-Time ECG and Music Player", audio_engine='bank',
+                 crossfade=2.0, hysteresis=5.0, stress_lf_hf=None, show_latency=False):
+        from tkinter import BOTH, BOTTOM, SUNKEN, TOP, W, X, Frame, Label, Tk, ttk
+
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+        from matplotlib.figure import Figure
+
+        from rhythmsync.audio import make_player
+        from rhythmsync.plotting import LivePlotRenderer
+
+        self.session = session
+        self._quality_changes = 0
+        window = session.window
+
+        # GUI setup
+        self.root = root = Tk()
+        root.geometry("900x700")
+        root.title(title)
+
+        self.statusbar = Label(root, text="Welcome to the ECG Music App", relief=SUNKEN, anchor=W,
+                               font='Times 10 italic')
+        self.statusbar.pack(side=BOTTOM, fill=X)
+        self.latency_bar = None
+        self._latency_shown = 0.0
+        if show_latency:
+            self.latency_bar = Label(root, text=format_latency(session.latency), relief=SUNKEN, anchor=W,
+                                     font='Courier 9')
+            self.latency_bar.pack(side=BOTTOM, fill=X)
+
+        # Music Player Initialization; the bank decodes the playlist in the background
+        self.player = make_player(playlist, audio_engine, self.set_status, hysteresis, crossfade, stress_lf_hf)
+
+        self.fig = fig = Figure(figsize=(8, 6))
+        ax = fig.subplots(2, 1)
+        ax[0].set_ylim(1250, 3000)
+        ax[0].set_xlim(0, window)
+        ecg_line, = ax[0].plot([], [], lw=0.5)
+        ax[0].set_title("Real-Time ECG Signal")
+        ax[0].set_xlabel("Time (samples)")
+        ax[0].set_ylabel("Amplitude")
+        ax[0].grid(True)
+
+        ax[1].set_xlim(0, window)
+        ax[1].set_ylim(0, 100)
+        processed_line, = ax[1].plot([], [], lw=0.5)
+        ax[1].set_title("Heart Rate Peaks")
+        ax[1].set_xlabel("Time (samples)")
+        ax[1].grid(True)
+
+        canvas = FigureCanvasTkAgg(fig, master=root)
+        canvas_widget = canvas.get_tk_widget()
+        canvas_widget.pack(side=TOP, fill=BOTH, expand=True)
+        # Lines are updated in place and blitted at a fixed display rate, independent of the sample rate
+        self.renderer = LivePlotRenderer(canvas, ax[0], ecg_line, ax[1], processed_line, window, fps=30)
+
+        button_frame = Frame(root)
+        button_frame.pack(pady=20)
+
+        start_button = ttk.Button(button_frame, text="Start", command=self.start_measurement)
+        start_button.grid(row=0, column=0, padx=10)
+
+        pause_button = ttk.Button(button_frame, text="Pause Music", command=self.player.pause)
+        pause_button.grid(row=0, column=1, padx=10)
+
+        resume_button = ttk.Button(button_frame, text="Resume Music", command=self.player.resume)
+        resume_button.grid(row=0, column=2, padx=10)
+
+        stop_button = ttk.Button(button_frame, text="Stop Music", command=self.player.stop)
+        stop_button.grid(row=0, column=3, padx=10)
+
+        root.protocol("WM_DELETE_WINDOW", self.on_closing)
+
+    def set_status(self, text):
+        self.statusbar['text'] = text
+
+    def play_song(self, heart_rate, hrv=None):
+        import tkinter.messagebox
+
+        try:
+            with self.session.latency.stage('play_song'):
+                self.player.play_for_heart_rate(heart_rate, hrv)
+        except IndexError:
+            tkinter.messagebox.showerror("Error", "Invalid song index or playlist is empty.")
+
+    def consume_beats(self):
+        # Beat events from the device replace the SWT detector for heart rate and song choice
+        heart_rate = self.session.consume_beats()
+        if heart_rate:
+            hrv = self.session.hrv.metrics()
+            self.play_song(heart_rate, hrv)
+            self.set_status(f"Heart Rate: {heart_rate:.2f} BPM "
+                            f"(on-device, {self.session.beat_aggregator.rejected} rejected) | {format_hrv(hrv)}")
+
+    def update_data(self):
+        session = self.session
+        started = time.perf_counter()
+        if session.reader.beats:
+            self.consume_beats()
+        samples, ecg_window, result = session.poll()
+        if session.quality.changes != self._quality_changes:
+            self._quality_changes = session.quality.changes
+            if session.quality.ok:
+                self.set_status(f"{format_quality(session.quality)}, heart rate resumes after a full window")
+            else:
+                self.set_status(f"{format_quality(session.quality)}, heart rate paused")
+        if len(samples):
+            if result is not None:
+                heart_rate, processed_signal, Rpeaks = result
+                if processed_signal is not None:
+                    hrv = session.hrv.metrics()
+                    self.play_song(heart_rate, hrv)
+                    self.renderer.set_processed(processed_signal, Rpeaks)
+                    self.set_status(f"Heart Rate: {heart_rate:.2f} BPM ({session.reader.rate_text()}) | "
+                                    f"{format_hrv(hrv)} | {format_quality(session.quality)}")
+
+            self.renderer.set_ecg(ecg_window)
+        elif session.error is not None:
+            self.set_status(f"Serial error: {session.error}")
+
+        self.player.update()
+        drawing = time.perf_counter()
+        if self.renderer.draw():
+            # Most ticks skip the frame; only the ones that drew are timed
+            session.latency.observe('draw', time.perf_counter() - drawing)
+        session.latency.observe('update', time.perf_counter() - started)
+
+        if self.latency_bar is not None and time.monotonic() - self._latency_shown >= 1.0:
+            self._latency_shown = time.monotonic()
+            self.latency_bar['text'] = format_latency(session.latency)
+
+        self.root.after(10, self.update_data)
+
+    def start_measurement(self):
+        # The reader thread and the UI loop only start once; later clicks are no-ops
+        if not self.session.started:
+            self.session.start()
+            self.update_data()
+
+    def on_closing(self):
+        self.session.close()
+        self.player.stop()
+        self.root.destroy()
+
+    def mainloop(self):
+        self.root.mainloop()
+
+
+def run(port, playlist, requested_rate=100, protocol='ascii', title="Real-Time ECG and Music Player",
+        audio_engine='bank', crossfade=2.0, hysteresis=5.0, stress_lf_hf=None, show_latency=False, **settings):
+    """Open the device on ``port`` and run the Tk app until its window is closed.
+
+    ``audio_engine``, ``crossfade``, ``hysteresis`` and ``stress_lf_hf``
+    configure the player (see ``rhythmsync.audio.make_player``); ``show_latency``
+    adds the latency bar; ``settings`` go to ``EcgSession``
+    (``engine``, ``swt_hop``, ``rules``, ``cutoff``, ``record``, ``telemetry``,
+    ``telemetry_key``, ``precision``, ``latency_export``).
+    """
+    preload(*HEAVY_MODULES)
+    session = EcgSession.open(port, requested_rate, protocol, **settings)
+    EcgMusicApp(session, playlist, title, audio_engine, crossfade, hysteresis, stress_lf_hf,
+                show_latency).mainloop()
@@ -0,0 +1,85 @@
+import math
+
+import numpy as np
+
+
+def _band_reconstruction(ecg_signal, level, keep, wavelet):
+    import pywt
+
+    coeffs = pywt.swt(ecg_signal, wavelet, level=level)
+    zeros = np.zeros_like(coeffs[0][0])  # iswt only reads the dropped bands, so one array serves them all
+    coeffs_for_reconstruction = [(zeros, d if i in keep else zeros) for i, (a, d) in enumerate(coeffs)]
+    return pywt.iswt(coeffs_for_reconstruction, wavelet)
+
+
+def swt_band_energy(ecg_signal, level, keep=(2, 3), wavelet='sym4'):
+    # Squared reconstruction from the kept detail coefficients only
+    reconstructed_signal = _band_reconstruction(ecg_signal, level, keep, wavelet)
+    return np.square(reconstructed_signal, out=reconstructed_signal)
+
+
+def boundary_margin(level, keep=(2, 3), wavelet='sym4'):
+    # Samples at each end of a segment disturbed by swt/iswt's periodic extension.
+    # Only the kept details contribute, so the coarsest kept level sets the
+    # analysis plus synthesis support; round up to the 2 ** level multiple swt needs.
+    import pywt
+
+    coarsest = level - min(i for i in keep if i < level)
+    support = 2 * (pywt.Wavelet(wavelet).dec_len - 1) * (2 ** coarsest - 1)
+    step = 2 ** level
+    return int(math.ceil(support / step)) * step
+
+
+def band_kernel(level, keep=(2, 3), wavelet='sym4'):
+    """Taps of the filter that ``swt_band_energy`` applies before squaring, centred on the middle tap.
+
+    swt followed by iswt of only some detail bands is linear and commutes with
+    circular shifts, so it is a circular convolution; its taps are the
+    transform's response to an impulse, taken on a segment long enough that
+    the response does not wrap onto itself.
+    """
+    step = 2 ** level
+    length = step * -(-(4 * boundary_margin(level, keep, wavelet) + 1) // step)
+    impulse = np.zeros(length)
+    impulse[0] = 1.0
+    response = _band_reconstruction(impulse, level, keep, wavelet)
+    offsets = np.flatnonzero(response)
+    offsets = np.where(offsets >= length // 2, offsets - length, offsets)
+    half = int(np.abs(offsets).max())
+    taps = np.zeros(2 * half + 1)
+    taps[offsets + half] = response[offsets]
+    return taps
+
+
+class SwtBandEnergy:
+    """``swt_band_energy`` as a precomputed FIR filter that writes into reused buffers.
+
+    The taps come from ``band_kernel`` and are applied with a wrapping
+    ``convolve1d``, which gives swt/iswt's periodic extension; the result
+    matches ``swt_band_energy`` to rounding. Calls allocate nothing but
+    return the same buffer for every signal of a given length, so the
+    previous result is overwritten. ``dtype`` float32 halves the memory
+    traffic, at about 1e-7 relative error. Signals shorter than the kernel
+    go through pywt.
+    """
+
+    def __init__(self, level, keep=(2, 3), wavelet='sym4', dtype=np.float64):
+        self.level = level
+        self.keep = keep
+        self.wavelet = wavelet
+        self.dtype = np.dtype(dtype)
+        self.taps = band_kernel(level, keep, wavelet).astype(self.dtype)
+        self._buffers = {}  # signal length -> output buffer
+
+    def __call__(self, ecg_signal):
+        from scipy.ndimage import convolve1d
+
+        n = len(ecg_signal)
+        out = self._buffers.get(n)
+        if out is None:
+            out = self._buffers[n] = np.empty(n, dtype=self.dtype)
+        if n < len(self.taps):
+            out[:] = swt_band_energy(ecg_signal, self.level, self.keep, self.wavelet)
+            return out
+        convolve1d(ecg_signal, self.taps, output=out, mode='wrap')
+        return np.square(out, out=out)
@@ -0,0 +1,84 @@
+import functools
+
+import numpy as np
+import pytest
+
+from rhythmsync.detectors import HopSwtDetector, PanTompkinsDetector, SwtDetector
+from rhythmsync.filters import StreamingFilter
+from rhythmsync.heart_rate import RULES, compute_heart_rate
+from rhythmsync.rates import savgol_window, swt_level, window_size
+from rhythmsync.simulator import synthetic_ecg
+from rhythmsync.wavelets import SwtBandEnergy
+
+FS = 100
+
+
+def make_filter(window, dtype=np.float64):
+    return StreamingFilter(20, FS, window_length=savgol_window(FS), polyorder=3, size=window, dtype=dtype)
+
+
+@pytest.mark.parametrize('rules', sorted(RULES))
+@pytest.mark.parametrize('hop', [1, 25])
+def test_hop_detector_matches_whole_window_detector(rules, hop):
+    window = window_size(FS)
+    signal = synthetic_ecg(FS, seconds=40, heart_rate=75, seed=4)
+    band_energy = SwtBandEnergy(swt_level(FS))
+    whole = SwtDetector(functools.partial(compute_heart_rate, rules=rules, band_energy=band_energy),
+                        make_filter(window), FS, window)
+    hopping = HopSwtDetector(make_filter(window), FS, window, hop, *RULES[rules])
+
+    compared = 0
+    for start in range(0, len(signal), hop):
+        chunk = signal[start:start + hop]
+        expected = whole.push(chunk)
+        result = hopping.push(chunk)
+        assert (result is None) == (expected is None)
+        if result is None:
+            continue
+        assert result[0] == expected[0]
+        np.testing.assert_array_equal(result[1], expected[1])
+        np.testing.assert_array_equal(result[2], expected[2])
+        compared += 1
+    assert compared > 10
+
+
+def test_pan_tompkins_reports_only_changes():
+    window = window_size(FS)
+    signal = synthetic_ecg(FS, seconds=30, heart_rate=60, rr_jitter=0.0, seed=5)
+    detector = PanTompkinsDetector(FS, window)
+    results = [detector.push(signal[i:i + 5]) for i in range(0, len(signal), 5)]
+    updates = [r for r in results if r is not None]
+
+    assert 20 <= len(updates) < len(results) // 4
+    assert updates[-1][0] == pytest.approx(60, abs=3)
+    # new_beats holds the same indices as beats, also after refractory replacements
+    assert [index for index, _ in detector.new_beats] == list(detector.beats)
+
+
+def test_pan_tompkins_replaces_a_beat_within_the_refractory_period():
+    detector = PanTompkinsDetector(FS, window_size(FS))
+    detector.spki, detector.npki = 10.0, 1.0
+    assert detector._classify(100, 8.0)
+    assert detector._classify(110, 12.0)  # same QRS complex, larger peak
+    assert not detector._classify(115, 9.0)
+    assert list(detector.beats) == [110]
+    assert list(detector.new_beats) == [(110, 12.0)]
+
+
+def test_hop_detector_confirms_each_peak_once():
+    window = window_size(FS)
+    signal = synthetic_ecg(FS, seconds=60, heart_rate=75, rr_jitter=0.0, seed=6)  # R peaks at 50 + 80k
+    detector = HopSwtDetector(make_filter(window), FS, window, 25, *RULES['count'])
+    reported = []
+    for start in range(0, len(signal), 10):
+        detector.push(signal[start:start + 10])
+        assert all(peak < detector.count - detector.margin for peak in detector.new_peaks)
+        reported += detector.new_peaks
+        detector.new_peaks.clear()
+
+    reported = np.array(reported)
+    assert np.all(np.diff(reported) >= 50)
+    beats = (reported - 50) / 80
+    np.testing.assert_allclose(beats, np.round(beats), atol=3 / 80)
+    assert len(reported) >= 60 * 75 / 60 - 3
+    assert list(detector.confirmed) == list(reported[-len(detector.confirmed):])
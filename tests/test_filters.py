@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+from scipy.signal import savgol_filter
+
+from rhythmsync.filters import StreamingFilter, butter_lowpass_filter
+from rhythmsync.simulator import synthetic_ecg
+
+
+@pytest.mark.parametrize('dtype, tolerance', [(np.float64, 1e-9), (np.float32, 0.05)])
+@pytest.mark.parametrize('batch', [1, 7, 40, 600])
+def test_streaming_filter_matches_whole_signal_filters(dtype, tolerance, batch):
+    fs = 100
+    signal = synthetic_ecg(fs, seconds=30, seed=1) + np.random.default_rng(2).normal(0, 20, 30 * fs)
+    streaming = StreamingFilter(20, fs, window_length=15, polyorder=3, size=len(signal), dtype=dtype)
+    for start in range(0, len(signal), batch):
+        streaming.push(signal[start:start + batch])
+
+    # lfilter starts from rest and the streaming filter in steady state; compare after the transient
+    expected = savgol_filter(butter_lowpass_filter(signal, 20, fs), 15, 3)
+    np.testing.assert_allclose(streaming.window()[200:], expected[200:], rtol=0, atol=tolerance)
+
+
+def test_streaming_filter_keeps_the_latest_window():
+    signal = synthetic_ecg(100, seconds=20, seed=3)
+    streaming = StreamingFilter(20, 100, size=500)
+    for start in range(0, len(signal), 9):
+        streaming.push(signal[start:start + 9])
+    expected = savgol_filter(butter_lowpass_filter(signal, 20, 100), 15, 3)
+    assert len(streaming) == 500
+    np.testing.assert_allclose(streaming.window(), expected[-500:], atol=1e-9)
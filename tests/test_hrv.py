@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+from scipy.signal import lombscargle
+
+from rhythmsync.hrv import HF_BAND, LF_BAND, RRStore
+
+
+def beat_times(seconds, seed=0):
+    # ~70 BPM with a 0.1 Hz (LF) and a 0.25 Hz (HF) rhythm and some noise
+    rng = np.random.default_rng(seed)
+    times = [0.0]
+    while times[-1] < seconds:
+        t = times[-1]
+        times.append(t + 0.85 + 0.04 * np.sin(2 * np.pi * 0.1 * t) + 0.03 * np.sin(2 * np.pi * 0.25 * t)
+                     + rng.normal(0, 0.01))
+    return np.array(times)
+
+
+def expected_metrics(store, missed_after):
+    # From scratch over the accepted beats: the window's last `window` seconds, and the whole session
+    times, rr = store.times, store.intervals * 1000
+    diffs = np.diff(rr, prepend=np.nan)
+    # The first interval after the missed beat has no neighbour to take a difference with
+    first_after = np.flatnonzero(times > missed_after)
+    if len(first_after):
+        diffs[first_after[0]] = np.nan
+    inside = times >= times[-1] - store.window
+    window, window_diffs = rr[inside], diffs[inside]
+    window_diffs = window_diffs[~np.isnan(window_diffs)]
+    session_diffs = diffs[~np.isnan(diffs)]
+
+    span = times[inside][-1] - times[inside][0]
+    psd = lombscargle(times[inside], window - window.mean(), 2 * np.pi * store.freqs) * 2 * span / len(window)
+    step = store.freqs[1] - store.freqs[0]
+    lf = psd[(store.freqs >= LF_BAND[0]) & (store.freqs < LF_BAND[1])].sum() * step
+    hf = psd[(store.freqs >= HF_BAND[0]) & (store.freqs <= HF_BAND[1])].sum() * step
+    return {
+        'mean_rr': window.mean(),
+        'sdnn': window.std(ddof=1),
+        'rmssd': np.sqrt(np.mean(window_diffs ** 2)),
+        'pnn50': 100 * np.mean(np.abs(window_diffs) > 50),
+        'session_sdnn': rr.std(ddof=1),
+        'session_rmssd': np.sqrt(np.mean(session_diffs ** 2)),
+        'lf': lf,
+        'hf': hf,
+        'lf_hf': lf / hf,
+    }
+
+
+def check(store, missed_after):
+    metrics = store.metrics()
+    for name, value in expected_metrics(store, missed_after).items():
+        assert metrics[name] == pytest.approx(value, rel=1e-6), name
+
+
+@pytest.mark.parametrize('rebuild_every', [10000, 50])
+def test_incremental_hrv_matches_a_full_recomputation(rebuild_every):
+    times = beat_times(900)
+    missed = 400  # a missed beat: the doubled interval is rejected and breaks the successive differences
+    store = RRStore(window=120.0, rebuild_every=rebuild_every)
+    for i, t in enumerate(times):
+        if i == missed:
+            continue
+        store.add_beat(t)
+        if i in (150, 300, 500, len(times) - 1):  # before and after window evictions and the missed beat
+            check(store, times[missed])
+    assert store.rejected == 1
+    assert len(store) == len(times) - 3  # the first beat only starts the first interval
+
+
+def test_forced_rebuild_keeps_the_statistics():
+    store = RRStore(window=90.0)
+    for t in beat_times(600, seed=1):
+        store.add_beat(t)
+    before = store.metrics()
+    store._rebuild()
+    after = store.metrics()
+    for name, value in before.items():
+        assert after[name] == pytest.approx(value, rel=1e-9), name
+    check(store, missed_after=np.inf)
+
+
+def test_rejects_extra_beats_without_breaking_adjacency():
+    store = RRStore()
+    for t in (0.0, 0.8, 1.0, 1.6, 2.4):  # 1.0 is 0.2 s after a beat: an extra detection
+        store.add_beat(t)
+    np.testing.assert_allclose(store.intervals, [0.8, 0.8, 0.8])
+    assert store.rejected == 1
+    assert store.metrics()['rmssd'] == pytest.approx(0.0, abs=1e-6)
@@ -0,0 +1,84 @@
+import json
+import time
+
+import pytest
+
+from rhythmsync.latency import TIME_BUCKETS, Histogram, LatencyMonitor, format_latency, no_timing
+
+
+def test_histogram_buckets_by_upper_bound():
+    histogram = Histogram((1, 2, 5))
+    for value in (0.5, 1, 1.5, 2, 4, 5, 7, 100):
+        histogram.add(value)
+    assert histogram.counts == [2, 2, 2, 2]  # <=1, <=2, <=5, +Inf
+    assert histogram.count == 8
+    assert histogram.sum == pytest.approx(121.0)
+    assert histogram.max == 100
+    assert histogram.quantile(0.25) == pytest.approx(1.0)
+    assert histogram.quantile(0.5) == pytest.approx(2.0)
+    assert histogram.quantile(1.0) == 100
+    histogram.reset()
+    assert histogram.count == 0 and histogram.quantile(0.5) is None
+
+
+def test_time_buckets_step_1_2_5_from_10_us_to_10_s():
+    assert TIME_BUCKETS[:4] == pytest.approx((1e-5, 2e-5, 5e-5, 1e-4))
+    assert TIME_BUCKETS[-1] == 10.0
+    assert list(TIME_BUCKETS) == sorted(TIME_BUCKETS)
+
+
+def test_stages_are_timed_and_observed():
+    monitor = LatencyMonitor()
+    for _ in range(3):
+        with monitor.stage('filter'):
+            time.sleep(0.001)
+    monitor.observe('draw', 0.03)
+    monitor.end_to_end.add(0.004)
+    monitor.backlog.add(20)
+    assert monitor.stage('filter') is monitor.stage('filter')
+    with no_timing('filter'):
+        pass
+
+    summary = monitor.summary()
+    assert summary['filter']['count'] == 3 and 0.001 <= summary['filter']['max'] < 0.5
+    assert summary['draw']['count'] == 1 and summary['draw']['max'] == 0.03
+    assert summary['backlog']['max'] == 20
+    text = format_latency(monitor)
+    assert text.startswith("Latency p50/p99: e2e ") and "filter " in text and "backlog max 20" in text
+
+
+def test_prometheus_text_has_cumulative_buckets_and_labels():
+    monitor = LatencyMonitor(labels={'device': 'ttyUSB0'})
+    for seconds in (0.00001, 0.0003, 0.0003, 20.0):
+        monitor.observe('swt', seconds)
+    lines = monitor.to_prometheus().splitlines()
+
+    assert "# TYPE rhythmsync_stage_seconds histogram" in lines
+    buckets = [line for line in lines if line.startswith('rhythmsync_stage_seconds_bucket')]
+    assert buckets[0] == 'rhythmsync_stage_seconds_bucket{device="ttyUSB0",stage="swt",le="1e-05"} 1'
+    assert 'rhythmsync_stage_seconds_bucket{device="ttyUSB0",stage="swt",le="0.0005"} 3' in buckets
+    assert buckets[-1] == 'rhythmsync_stage_seconds_bucket{device="ttyUSB0",stage="swt",le="+Inf"} 4'
+    counts = [int(line.rsplit(' ', 1)[1]) for line in buckets]
+    assert counts == sorted(counts)
+    assert 'rhythmsync_stage_seconds_count{device="ttyUSB0",stage="swt"} 4' in lines
+    assert any(line.startswith('rhythmsync_stage_seconds_sum{device="ttyUSB0",stage="swt"} 20.0006') for line in lines)
+    assert 'rhythmsync_input_backlog_count{device="ttyUSB0"} 0' in lines
+
+
+def test_export_writes_json_and_prometheus_files(tmp_path):
+    monitor = LatencyMonitor(export=str(tmp_path / 'out' / 'latency.json'), export_interval=0)
+    monitor.observe('peaks', 0.002)
+    monitor.observe('peaks', 0.004)
+    assert monitor.maybe_export()
+    data = json.loads((tmp_path / 'out' / 'latency.json').read_text())
+    assert data['stages']['peaks']['count'] == 2
+    assert sum(data['stages']['peaks']['counts']) == 2
+    assert data['summary']['peaks']['max'] == 0.004
+    assert not list((tmp_path / 'out').glob('*.tmp'))
+
+    monitor.write(str(tmp_path / 'latency.prom'))
+    assert (tmp_path / 'latency.prom').read_text().startswith("# HELP rhythmsync_stage_seconds ")
+
+    monitor.export_interval = 60
+    assert not monitor.maybe_export()
+    assert not LatencyMonitor().maybe_export()
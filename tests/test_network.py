@@ -0,0 +1,115 @@
+import socket
+import threading
+import time
+
+import numpy as np
+
+from rhythmsync.network import NetworkReader, ReorderBuffer, UdpReceiver, encode_datagram
+from rhythmsync.protocol import LEAD_OFF, encode_beat, encode_frame, encode_status, split_frames
+
+
+def frame(seq, n=10):
+    return seq, seq * 100000, np.arange(n, dtype=float) + 10 * seq
+
+
+def test_split_frames_round_trip():
+    samples = [np.arange(10) * 400, np.array([0, 4095, 2048]), np.array([7])]
+    data = b''.join(encode_frame(seq, seq * 1000, s) for seq, s in enumerate(samples))
+    data += encode_beat(3, 123456, 2000) + encode_status(LEAD_OFF)
+
+    frames, beats, corrupt, status = split_frames(data)
+
+    assert corrupt == 0
+    assert [(seq, timestamp) for seq, timestamp, _ in frames] == [(0, 0), (1, 1000), (2, 2000)]
+    for (_, _, decoded), sent in zip(frames, samples):
+        np.testing.assert_array_equal(decoded, sent)
+    assert beats == [(3, 123456, 2000)]
+    assert status == LEAD_OFF
+
+
+def test_split_frames_stops_at_bad_crc():
+    good = encode_frame(0, 0, [1, 2, 3])
+    bad = bytearray(encode_frame(1, 10, [4, 5, 6]))
+    bad[-1] ^= 0xFF
+    frames, _, corrupt, _ = split_frames(good + bytes(bad) + encode_frame(2, 20, [7, 8, 9]))
+    assert [seq for seq, _, _ in frames] == [0]
+    assert corrupt == 1
+
+
+def test_reorder_buffer_releases_in_order():
+    buffer = ReorderBuffer(max_hold=4)
+    released = []
+    for seq in (0, 2, 1, 4, 3, 5):
+        released += buffer.push(seq, seq, now=0.0)
+    assert released == [0, 1, 2, 3, 4, 5]
+    assert buffer.reordered == 2
+    assert (buffer.lost, buffer.late, buffer.duplicates) == (0, 0, 0)
+
+
+def test_reorder_buffer_counts_released_duplicates_apart_from_late_frames():
+    buffer = ReorderBuffer(max_hold=2, fill=lambda count, previous: ('gap', count))
+    released = []
+    for seq in (0, 1, 3, 4, 5):  # 2 is given up once more than max_hold frames wait
+        released += buffer.push(seq, seq, now=0.0)
+    assert released == [0, 1, ('gap', 1), 3, 4, 5]
+    assert buffer.push(1, 1, now=0.0) == []  # released already: a duplicate
+    assert buffer.push(5, 5, now=0.0) == []
+    assert buffer.push(2, 2, now=0.0) == []  # given up: late
+    assert (buffer.lost, buffer.late, buffer.duplicates, buffer.restarts) == (1, 1, 2, 0)
+
+
+def test_reorder_buffer_wraps_and_detects_restarts():
+    buffer = ReorderBuffer(max_hold=4, max_gap=100)
+    released = []
+    for seq in (0xFFFE, 0xFFFF, 0, 1):
+        released += buffer.push(seq, seq, now=0.0)
+    assert released == [0xFFFE, 0xFFFF, 0, 1]
+    assert buffer.push(5000, 'restarted', now=0.0) == ['restarted']
+    assert buffer.restarts == 1 and buffer.lost == 0
+
+
+def test_network_reader_fills_lost_frames_and_expires_them():
+    reader = NetworkReader('sensor', 100, max_hold=16, max_delay=0.5)
+    reader.deliver([frame(0), frame(1), frame(3)], [], 0, None, now=0.0)
+    assert len(reader.read()) == 20
+    reader.deliver([frame(1)], [], 0, None, now=0.1)
+    reader.expire(0.2)
+    assert len(reader.read()) == 0  # frame 2 may still arrive
+    reader.expire(0.6)
+
+    samples = reader.read()
+    np.testing.assert_array_equal(samples[:10], np.full(10, 19.0))  # frame 1's last sample, held
+    np.testing.assert_array_equal(samples[10:], frame(3)[2])
+    stats = reader.stats()
+    assert (stats['lost_frames'], stats['gap_samples'], stats['duplicate_frames']) == (1, 10, 1)
+
+
+def test_receiver_adds_devices_off_its_thread():
+    added = threading.Event()
+    threads = []
+
+    def on_device(device_id, reader):
+        threads.append(threading.current_thread().name)
+        time.sleep(0.3)  # e.g. building an EcgSession
+        added.set()
+
+    receiver = UdpReceiver('127.0.0.1', 0, on_device, poll_interval=0.01)
+    receiver.start()
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        for seq in range(20):
+            sender.sendto(encode_datagram('sensor', 100, [encode_frame(*frame(seq))]), receiver.address)
+        deadline = time.monotonic() + 2
+        while time.monotonic() < deadline and receiver.readers.get('sensor') is None:
+            time.sleep(0.01)
+        reader = receiver.readers['sensor']
+        # All datagrams are taken in while on_device is still busy
+        while time.monotonic() < deadline and reader.datagrams < 20:
+            time.sleep(0.01)
+        assert reader.datagrams == 20 and not added.is_set()
+        assert added.wait(2)
+        assert threads == ['udp-devices']
+        assert len(reader.read()) == 200
+    finally:
+        receiver.stop()
+        sender.close()
@@ -0,0 +1,51 @@
+import numpy as np
+
+from rhythmsync.protocol import FrameDecoder, encode_beat, encode_frame, encode_status, pack12, payload_size, unpack12
+
+
+def test_pack12_round_trip():
+    for n in (1, 2, 9, 64):
+        samples = np.random.default_rng(n).integers(0, 4096, n)
+        payload = pack12(samples)
+        assert len(payload) == payload_size(n)
+        np.testing.assert_array_equal(unpack12(payload + b'\x00' * (-len(payload) % 3))[:n], samples)
+
+
+def test_decoder_byte_by_byte_with_noise_and_loss():
+    sent = [np.arange(n) + 100 * seq for seq, n in enumerate((10, 9, 10, 1))]
+    corrupted = bytearray(encode_frame(9, 0, [1, 2]))
+    corrupted[5] ^= 0x01
+    stream = b'AD8232 ECG Sensor Test\r\n' + bytes(corrupted)
+    for seq, s in enumerate(sent):
+        if seq != 2:  # lost on the wire
+            stream += encode_frame(seq, seq * 100000, s)
+    stream += encode_beat(0, 5, 6) + encode_status(0)
+
+    decoder = FrameDecoder()
+    values = np.concatenate([decoder.feed(stream[i:i + 1]) for i in range(len(stream))])
+
+    np.testing.assert_array_equal(values, np.concatenate([sent[0], sent[1], sent[3]]))
+    assert decoder.frames == 3
+    assert decoder.lost_frames == 1
+    assert decoder.corrupt_frames == 1
+    assert decoder.beats == [(5, 6)]
+    assert decoder.lead_off is False
+
+
+def test_decoder_in_random_chunks_measures_the_sample_period():
+    rng = np.random.default_rng(0)
+    sent = [rng.integers(0, 4096, 10) for _ in range(50)]
+    stream = b''.join(encode_frame(seq, 5000 + seq * 100000 + int(rng.integers(-50, 50)), s)
+                      for seq, s in enumerate(sent))
+    decoder = FrameDecoder()
+    values = []
+    pos = 0
+    while pos < len(stream):
+        step = int(rng.integers(1, 40))
+        values.append(decoder.feed(stream[pos:pos + step]))
+        pos += step
+
+    np.testing.assert_array_equal(np.concatenate(values), np.concatenate(sent))
+    assert (decoder.frames, decoder.lost_frames, decoder.corrupt_frames, decoder.skipped_bytes) == (50, 0, 0, 0)
+    assert abs(decoder.sample_period_us - 10000) < 10
+    assert 0 < decoder.jitter_us < 10
@@ -0,0 +1,94 @@
+import numpy as np
+import pytest
+
+from rhythmsync.quality import SignalQuality, format_quality
+from rhythmsync.ringbuffer import RingBuffer
+from rhythmsync.simulator import synthetic_ecg
+
+FS = 100
+
+
+def feed(quality, ring, samples, lead_off=None, step=10):
+    # Like EcgSession.poll: new samples into the ring, then a check; the states seen along the way
+    seen = []
+    for start in range(0, len(samples), step):
+        ring.extend(samples[start:start + step])
+        quality.update(ring, ring.count, lead_off)
+        seen.append(quality.reason)
+    return seen
+
+
+@pytest.fixture
+def ecg():
+    return synthetic_ecg(FS, seconds=60, seed=6)
+
+
+def test_clean_ecg_is_usable_after_a_window(ecg):
+    quality = SignalQuality(FS)
+    ring = RingBuffer(4 * quality.size)
+    seen = feed(quality, ring, ecg[:1000])
+    assert seen[0] == 'waiting' and quality.ok
+    assert seen[-1] == 'ok'
+    assert quality.score > 0.5 and quality.noise_ratio < quality.max_noise_ratio
+    assert quality.changes == 0
+    assert format_quality(quality).startswith("Signal: ok (")
+
+
+@pytest.mark.parametrize('bad, reason', [
+    (np.full(300, 4095.0), 'saturated'),
+    (np.full(300, 0.0), 'saturated'),
+    (np.full(300, 2048.0), 'flatline'),
+    (2048.0 + np.random.default_rng(7).uniform(-5, 5, 300), 'flatline'),
+])
+def test_rail_and_flat_input_close_the_gate_until_the_signal_returns(ecg, bad, reason):
+    quality = SignalQuality(FS)
+    ring = RingBuffer(4 * quality.size)
+    feed(quality, ring, ecg[:500])
+    assert quality.ok
+
+    feed(quality, ring, bad)
+    assert quality.reason == reason and not quality.ok and quality.score == 0.0
+    assert quality.changes == 1
+
+    feed(quality, ring, ecg[500:1000])
+    assert quality.reason == 'ok'
+    assert quality.changes == 2
+
+
+def test_noise_closes_the_gate(ecg):
+    quality = SignalQuality(FS)
+    ring = RingBuffer(4 * quality.size)
+    feed(quality, ring, ecg[:500])
+    noisy = ecg[500:800] + np.random.default_rng(8).normal(0, 150, 300)
+    feed(quality, ring, noisy)
+    assert quality.reason == 'noisy' and not quality.ok
+    assert quality.noise_ratio > quality.max_noise_ratio and quality.score == 0.0
+    assert quality.changes == 1
+
+
+def test_some_rail_samples_are_tolerated(ecg):
+    quality = SignalQuality(FS)
+    ring = RingBuffer(4 * quality.size)
+    clipped = ecg[:600].copy()
+    clipped[::50] = 4095.0  # 2% of samples on the rail
+    feed(quality, ring, clipped)
+    assert quality.reason == 'ok'
+    assert 0 < quality.saturated <= quality.max_saturated
+
+
+def test_lead_off_fails_at_once_and_clears_with_the_next_check(ecg):
+    quality = SignalQuality(FS)
+    ring = RingBuffer(4 * quality.size)
+    feed(quality, ring, ecg[:500])
+    assert feed(quality, ring, ecg[500:510], lead_off=True) == ['leads off']
+    assert not quality.ok and quality.changes == 1
+    assert feed(quality, ring, ecg[510:520], lead_off=False) == ['ok']
+    assert quality.changes == 2
+
+
+def test_nan_samples_are_ignored(ecg):
+    quality = SignalQuality(FS)
+    samples = ecg[:300].copy()
+    samples[100:150] = np.nan
+    assert quality.assess(samples)[0] == 'ok'
+    assert quality.assess(np.full(300, np.nan))[0] == 'waiting'
@@ -0,0 +1,83 @@
+import glob
+import os
+import queue
+
+import numpy as np
+import pytest
+
+from rhythmsync.recorder import ChunkedArray, RecordedSession, SessionRecorder
+
+
+def full(item):
+    raise queue.Full
+
+
+def record(directory, batches, monkeypatch, lost=()):
+    # Batches whose index is in lost are dropped as if the writer's queue were full
+    recorder = SessionRecorder(str(directory), 100, chunk_bytes=64)  # 16 samples per chunk
+    for i, batch in enumerate(batches):
+        if i in lost:
+            with monkeypatch.context() as m:
+                m.setattr(recorder._queue, 'put_nowait', full)
+                recorder.add_samples(batch, arrival=1000.0 + i)
+        else:
+            recorder.add_samples(batch, arrival=1000.0 + i)
+    return recorder
+
+
+def test_round_trip_across_chunks(tmp_path, monkeypatch):
+    signal = np.arange(100, dtype=np.float32)
+    recorder = record(tmp_path, [signal[i:i + 7] for i in range(0, 100, 7)], monkeypatch)
+    recorder.add_peaks([5, 40, 41, 95])
+    recorder.add_heart_rate(61.5, 50)
+    recorder.close()
+
+    assert len(glob.glob(os.path.join(tmp_path, 'samples-*.bin'))) == 7  # 100 samples, 16 per chunk
+    session = RecordedSession(str(tmp_path))
+    assert session.index['closed'] and session.index['dropped'] == 0
+    assert session.index['streams']['samples'] == {'dtype': '<f4', 'chunk_records': 16, 'chunks': 7,
+                                                  'records': 100}
+    assert len(session.samples.maps) == 7
+    np.testing.assert_array_equal(session.samples[:], signal)
+    np.testing.assert_array_equal(session.arrivals[:]['sample'], np.arange(0, 100, 7))
+    np.testing.assert_array_equal(session.peaks[:], [5, 40, 41, 95])
+    assert session.duration == 1.0
+
+    samples, peaks, heart_rate = session.window(0.3, 0.6)
+    np.testing.assert_array_equal(samples, signal[30:60])
+    np.testing.assert_array_equal(peaks, [10, 11])
+    assert heart_rate['sample'].tolist() == [20] and heart_rate['bpm'].tolist() == [61.5]
+    assert [len(block) for block in session.replay(40)] == [40, 40, 20]
+
+
+def test_dropped_batches_are_padded_with_nan(tmp_path, monkeypatch):
+    batches = [np.full(10, i, dtype=np.float32) for i in range(5)]
+    recorder = record(tmp_path, batches, monkeypatch, lost={1, 4})
+    recorder.close()
+
+    session = RecordedSession(str(tmp_path))
+    samples = session.samples[:]
+    assert session.index['dropped'] == 4  # samples and arrival time of each lost batch
+    assert len(samples) == 50
+    assert np.isnan(samples[10:20]).all() and np.isnan(samples[40:]).all()
+    np.testing.assert_array_equal(samples[20:40], np.repeat([2, 3], 10))
+    np.testing.assert_array_equal(session.arrivals[:]['sample'], [0, 20, 30])
+
+
+@pytest.mark.parametrize('key', [slice(None), slice(3, 4), slice(5, 40), slice(16, 32), slice(15, 17),
+                                 slice(-20, None), slice(None, None, 3), slice(2, 45, 7), slice(None, None, -1),
+                                 slice(40, 5, -4), slice(30, 10)])
+def test_chunked_array_slices_like_an_array(key):
+    data = np.arange(50)
+    chunked = ChunkedArray([data[0:16], data[16:32], data[32:48], data[48:50]], data.dtype)
+    np.testing.assert_array_equal(chunked[key], data[key])
+
+
+def test_chunked_array_indexing():
+    data = np.arange(20)
+    chunked = ChunkedArray([data[:8], data[8:]], data.dtype)
+    assert len(chunked) == 20
+    assert [chunked[i] for i in (0, 7, 8, 19, -1, -20)] == [0, 7, 8, 19, 19, 0]
+    with pytest.raises(IndexError):
+        chunked[20]
+    np.testing.assert_array_equal(np.asarray(chunked), data)
@@ -0,0 +1,93 @@
+import json
+import os
+import threading
+import time
+
+import pytest
+
+from rhythmsync.telemetry import StandInServer, TelemetryPublisher
+
+
+@pytest.fixture
+def server():
+    server = StandInServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_backs_off_while_the_endpoint_fails_and_keeps_the_backlog(server):
+    server.fail = 1.0
+    publisher = TelemetryPublisher(server.url(), flush_interval=0.02, min_interval=0, min_backoff=0.02,
+                                   max_backoff=0.08, timeout=1.0)
+    try:
+        for i in range(5):
+            publisher.publish(60 + i, timestamp=1000 + i)
+        assert wait_for(lambda: publisher.failures >= 4)
+        assert publisher.backoff == 0.08  # doubled from min_backoff up to max_backoff
+        assert publisher.pending == 5 and publisher.sent == 0
+
+        server.fail = 0.0
+        assert wait_for(lambda: publisher.sent == 5)
+        assert publisher.backoff == 0.0
+        assert [entry['field1'] for entry in server.received] == [60, 61, 62, 63, 64]
+    finally:
+        publisher.close()
+
+
+def test_spills_unsent_entries_and_sends_them_in_order_later(server, tmp_path):
+    server.fail = 1.0
+    first = TelemetryPublisher(server.url(), flush_interval=60, min_interval=0, spill_dir=tmp_path, name='a',
+                               timeout=0.5)
+    for i in range(30):
+        first.publish(i, timestamp=1000 + i)
+    first.close()
+    assert first.pending == 0
+    with open(first.spill_path) as f:
+        assert [json.loads(line)['field1'] for line in f] == list(range(30))
+
+    other = TelemetryPublisher(server.url(), spill_dir=tmp_path, name='b')
+    other.close()
+    assert other.spill_path != first.spill_path
+
+    server.fail = 0.0
+    second = TelemetryPublisher(server.url(), flush_interval=0.02, min_interval=0, batch_size=7, spill_dir=tmp_path,
+                                name='a')
+    try:
+        assert wait_for(lambda: second.sent == 30)
+        assert [entry['field1'] for entry in server.received] == list(range(30))
+    finally:
+        second.close()
+    assert not os.path.exists(first.spill_path)
+
+
+def test_unspill_loads_at_most_max_memory_entries(tmp_path):
+    publisher = TelemetryPublisher('http://127.0.0.1:9/bulk', flush_interval=60, max_memory=10,
+                                   spill_dir=tmp_path, name='a')
+    publisher.close()
+    with open(publisher.spill_path, 'w') as f:
+        f.writelines(json.dumps({'field1': i}) + '\n' for i in range(25))
+
+    publisher._backlog.extend([{'field1': -2}, {'field1': -1}])
+    publisher._unspill()
+    assert [entry['field1'] for entry in publisher._backlog] == list(range(8)) + [-2, -1]
+    with open(publisher.spill_path) as f:
+        assert [json.loads(line)['field1'] for line in f] == list(range(8, 25))
+
+    publisher._backlog.clear()
+    publisher._unspill()
+    publisher._backlog.clear()
+    publisher._unspill()
+    assert [entry['field1'] for entry in publisher._backlog] == list(range(18, 25))
+    assert not os.path.exists(publisher.spill_path)
@@ -0,0 +1,20 @@
+import os
+
+import numpy as np
+
+from rhythmsync.tempo import RenditionCache
+
+
+def on_disk(cache):
+    return sum(size for _, size, _ in cache.entries())
+
+
+def test_cache_size_tracks_stores_overwrites_and_evictions(tmp_path):
+    cache = RenditionCache(str(tmp_path), max_bytes=3000)
+    assert cache.size() == 0
+    for tempo in (60, 70, 80, 90, 70):
+        path = cache.store('song', tempo, np.zeros(200, np.int16))
+        assert os.path.exists(path)
+        assert cache.size() == on_disk(cache) <= cache.max_bytes
+    assert len(cache.entries()) < 5  # the oldest renditions were evicted
+    assert RenditionCache(str(tmp_path), max_bytes=3000).size() == cache.size()